@@ -0,0 +1,105 @@
+"""
+唯讀資源共享區
+多個渲染行程需要同一份大型陣列 (柱子特徵、預先合成的背景、排版表、文字精靈圖)。
+主行程把陣列寫進記憶體映射檔一次 (Linux 放在 /dev/shm，實際上就是共享記憶體)，
+工作行程以唯讀 memmap 開啟，所有行程共用同一份實體記憶體頁面，不必各自重算或接收 pickle 複本，
+多開一個工作行程增加的記憶體與資源大小無關。
+Windows/macOS 的 spawn 行程也適用 (只需要傳遞很小的清單 manifest)。
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+MB = 1024 * 1024
+
+# 優先放在 tmpfs (共享記憶體)；沒有時用系統暫存資料夾 (作業系統的檔案快取一樣只有一份)
+SHARED_DIRS = ["/dev/shm"]
+
+
+def shared_base_dir():
+    for directory in SHARED_DIRS:
+        if os.path.isdir(directory) and os.access(directory, os.W_OK):
+            return directory
+    return None
+
+
+class AssetStore:
+    """
+    主行程端：publish() 把陣列寫入共享區，manifest 交給工作行程 attach()。
+    meta 放可 pickle 的小型資料 (設定值、索引表)。
+    結束時 close() 刪除整個資料夾 (工作行程已開啟的映射在關閉前仍然有效)。
+    """
+
+    def __init__(self, prefix="mv_assets_"):
+        self.directory = tempfile.mkdtemp(prefix=prefix, dir=shared_base_dir())
+        self.arrays = {}
+        self.meta = {}
+
+    def publish(self, name, array):
+        """寫入一個陣列，回傳唯讀 memmap (主行程之後也可以改用這份，釋放原本的陣列)"""
+        array = np.ascontiguousarray(array)
+        path = os.path.join(self.directory, f"{name}.bin")
+        if array.size:
+            mapped = np.memmap(path, dtype=array.dtype, mode='w+', shape=array.shape)
+            mapped[...] = array
+            mapped.flush()
+            del mapped
+        else:
+            open(path, 'wb').close()
+        self.arrays[name] = {'path': path, 'dtype': array.dtype.str, 'shape': array.shape}
+        return open_array(self.arrays[name])
+
+    def nbytes(self):
+        return sum(int(np.prod(info['shape'])) * np.dtype(info['dtype']).itemsize for info in self.arrays.values())
+
+    @property
+    def manifest(self):
+        return {'arrays': dict(self.arrays), 'meta': dict(self.meta)}
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_array(info):
+    """以唯讀 memmap 開啟一個陣列 (空陣列直接建立)"""
+    if not int(np.prod(info['shape'])):
+        return np.empty(info['shape'], dtype=info['dtype'])
+    return np.memmap(info['path'], dtype=info['dtype'], mode='r', shape=tuple(info['shape']))
+
+
+def attach(manifest):
+    """工作行程端：回傳 ({名稱: 唯讀陣列}, meta)"""
+    return {name: open_array(info) for name, info in manifest['arrays'].items()}, manifest['meta']
+
+
+def pack_arrays(arrays):
+    """
+    把許多小陣列 (同一 dtype) 串成一個一維陣列，回傳 (合併陣列, [(offset, shape), ...])，
+    避免每個精靈圖各開一個檔案。
+    """
+    if not arrays:
+        return np.empty(0, dtype=np.uint8), []
+    layout = []
+    offset = 0
+    for array in arrays:
+        layout.append((offset, array.shape))
+        offset += array.size
+    packed = np.empty(offset, dtype=arrays[0].dtype)
+    for array, (start, _) in zip(arrays, layout):
+        packed[start:start + array.size] = array.ravel()
+    return packed, layout
+
+
+def unpack_array(packed, entry):
+    """pack_arrays 的反向：取回其中一個陣列 (共享記憶體上的視圖，不複製)"""
+    offset, shape = entry
+    return packed[offset:offset + int(np.prod(shape))].reshape(shape)
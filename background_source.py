@@ -0,0 +1,233 @@
+"""
+背景來源
+- StaticBackground：靜態圖片或純色，遮罩只在建立時合成一次
+- VideoBackground：循環影片背景，ffmpeg 直接輸出目標解析度與幀率的 raw 畫面，
+  由預讀執行緒疊上遮罩後放進有上限的佇列；第一輪解碼時順便快取整段循環
+  (放得下記憶體預算就放記憶體，否則放 memmap 暫存檔)，之後的循環直接讀快取。
+兩者都提供 get_frame(t) (回傳可直接繪製的 RGBA 畫布) 與 frame_key(t) (判斷畫面是否相同)。
+"""
+
+import os
+import queue
+import subprocess
+import tempfile
+import threading
+
+import numpy as np
+from PIL import Image
+
+from ffmpeg_tools import get_ffmpeg_exe
+
+MB = 1024 * 1024
+
+
+def make_overlay(size, alpha):
+    """黑色半透明遮罩"""
+    return Image.new('RGBA', size, (0, 0, 0, int(255 * alpha)))
+
+
+class StaticBackground:
+    """靜態背景：背景圖 (或純色) 與遮罩預先合成，每幀只需複製"""
+
+    def __init__(self, size, overlay_alpha, image=None, color=(0, 0, 0)):
+        if image is not None:
+            base = image.convert("RGBA")
+        else:
+            base = Image.new('RGBA', size, tuple(color) + (255,))
+        self.composed = Image.alpha_composite(base, make_overlay(size, overlay_alpha))
+
+    @classmethod
+    def from_composed(cls, composed):
+        """直接使用已合成遮罩的畫布 (例如共享區上的唯讀影像)"""
+        background = cls.__new__(cls)
+        background.composed = composed
+        return background
+
+    def get_frame(self, t):
+        return self.composed.copy()
+
+    def frame_key(self, t):
+        return None
+
+    def queue_depth(self):
+        return 0
+
+    def close(self):
+        pass
+
+
+class VideoBackground:
+    """循環影片背景，解碼在背景執行緒進行，渲染端只從佇列或快取取畫面"""
+
+    def __init__(self, path, size, fps, overlay_alpha, ring_size=16, cache_mb=1024, mmap_mb=4096):
+        self.path = path
+        self.size = size
+        self.fps = fps
+        self.frame_bytes = size[0] * size[1] * 3
+        self.overlay = make_overlay(size, overlay_alpha)
+        self.cache_limit = int(cache_mb * MB // self.frame_bytes)
+        self.mmap_limit = int(mmap_mb * MB // self.frame_bytes)
+
+        self.ring = queue.Queue(maxsize=ring_size)
+        self.cache = []            # 第一輪解碼的畫面 (記憶體)
+        self.mmap = None           # 記憶體放不下時改用 memmap
+        self.mmap_path = None
+        self.loop_frames = None    # 一輪循環的幀數 (第一輪解碼完才知道)
+        self.cache_complete = False
+        self.current_index = -1
+        self.current_frame = None
+        self.error = None
+
+        self._stop = threading.Event()
+        self._proc = None
+        self._thread = threading.Thread(target=self._decode_loop, daemon=True)
+        self._thread.start()
+
+    def _start_ffmpeg(self):
+        w, h = self.size
+        cmd = [
+            get_ffmpeg_exe(), "-loglevel", "error", "-i", self.path,
+            "-vf", f"scale={w}:{h}:flags=lanczos,fps={self.fps}",
+            "-an", "-f", "rawvideo", "-pix_fmt", "rgb24", "-"
+        ]
+        return subprocess.Popen(cmd, stdout=subprocess.PIPE, stdin=subprocess.DEVNULL, bufsize=self.frame_bytes * 2)
+
+    def _compose(self, raw):
+        """疊上遮罩，回傳 RGB 陣列 (背景不透明，合成後 alpha 仍是 255)"""
+        w, h = self.size
+        img = Image.frombuffer("RGB", (w, h), raw, "raw", "RGB", 0, 1).convert("RGBA")
+        return np.asarray(Image.alpha_composite(img, self.overlay).convert("RGB"))
+
+    def _cache_frame(self, index, frame):
+        """第一輪解碼時快取畫面，超過預算就放棄快取"""
+        if self.cache is None:
+            return
+        if index < self.cache_limit:
+            self.cache.append(frame)
+            return
+        if index >= self.mmap_limit:
+            self.cache = None
+            self._drop_mmap()
+            return
+
+        if self.mmap is None:
+            # 記憶體預算不夠，把目前的快取搬到 memmap 暫存檔
+            fd, self.mmap_path = tempfile.mkstemp(suffix=".bgcache")
+            os.close(fd)
+            w, h = self.size
+            self.mmap = np.memmap(self.mmap_path, dtype=np.uint8, mode='w+', shape=(self.mmap_limit, h, w, 3))
+            for i, cached in enumerate(self.cache):
+                self.mmap[i] = cached
+            self.cache = []
+        self.mmap[index] = frame
+
+    def _drop_mmap(self):
+        if self.mmap is not None:
+            self.mmap._mmap.close()
+            self.mmap = None
+        if self.mmap_path and os.path.exists(self.mmap_path):
+            os.remove(self.mmap_path)
+        self.mmap_path = None
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self.ring.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _decode_loop(self):
+        global_index = 0
+        first_pass = True
+        try:
+            while not self._stop.is_set():
+                self._proc = self._start_ffmpeg()
+                loop_index = 0
+                while not self._stop.is_set():
+                    raw = self._proc.stdout.read(self.frame_bytes)
+                    if len(raw) < self.frame_bytes:
+                        break
+                    frame = self._compose(raw)
+                    if first_pass:
+                        self._cache_frame(loop_index, frame)
+                    if not self._put((global_index, frame)):
+                        break
+                    loop_index += 1
+                    global_index += 1
+                self._proc.stdout.close()
+                self._proc.wait()
+
+                if loop_index == 0:
+                    raise RuntimeError(f"無法解碼背景影片: {self.path}")
+                if first_pass:
+                    self.loop_frames = loop_index
+                    first_pass = False
+                    if self.cache is not None:
+                        # 整段循環都已快取，之後直接讀快取，不再解碼
+                        self.cache_complete = True
+                        return
+        except Exception as e:
+            self.error = e
+        finally:
+            if self.cache_complete:
+                # 渲染端之後只讀快取，不會再取佇列：只有它正在等待 (佇列是空的) 時才需要結束標記，
+                # 佇列滿著就直接結束執行緒，不在這裡輪詢到 close()
+                try:
+                    self.ring.put_nowait(None)
+                except queue.Full:
+                    pass
+            else:
+                self._put(None)
+
+    def _cached(self, index):
+        loop_index = index % self.loop_frames
+        if self.mmap is not None:
+            return self.mmap[loop_index]
+        return self.cache[loop_index]
+
+    def frame_index(self, t):
+        return int(t * self.fps + 1e-6)
+
+    def frame_key(self, t):
+        index = self.frame_index(t)
+        return index % self.loop_frames if self.loop_frames else index
+
+    def get_frame(self, t):
+        index = self.frame_index(t)
+
+        if self.cache_complete:
+            frame = self._cached(index)
+        else:
+            # 依序從佇列取畫面直到追上目標幀；往回取時沿用目前畫面
+            while self.current_index < index:
+                if self.cache_complete and self.ring.empty():
+                    # 解碼執行緒已結束，剩下的畫面都在快取裡
+                    self.current_frame = self._cached(index)
+                    self.current_index = index
+                    break
+                item = self.ring.get()
+                if item is None:
+                    if self.error:
+                        raise self.error
+                    if self.cache_complete:
+                        self.current_frame = self._cached(index)
+                        self.current_index = index
+                    break
+                self.current_index, self.current_frame = item
+            frame = self.current_frame
+
+        return Image.fromarray(np.asarray(frame), "RGB").convert("RGBA")
+
+    def queue_depth(self):
+        """預讀佇列中等待取用的幀數 (整段循環已快取後為 0)"""
+        return self.ring.qsize()
+
+    def close(self):
+        self._stop.set()
+        if self._proc and self._proc.poll() is None:
+            self._proc.kill()
+        self._thread.join(timeout=2)
+        self._drop_mmap()
+        self.cache = None
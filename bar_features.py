@@ -0,0 +1,107 @@
+"""
+視覺化柱子的頻譜特徵
+分析階段一次建好對數 (或 Mel) 頻率濾波器組稀疏矩陣，整首歌的柱子能量用一次矩陣乘法算出，
+再對整條時間軸做每首歌的正規化與 attack/release 平滑。
+渲染時每幀只需要取一欄，成本與 BAR_COUNT 無關。
+"""
+
+import numpy as np
+import librosa
+from scipy import sparse
+
+# 每次轉換的欄數，避免整首歌的功率矩陣同時存在
+CHUNK_FRAMES = 4096
+
+
+def band_edges(sr, n_fft, n_bands, fmin=40.0, fmax=16000.0, scale="log"):
+    """
+    n_bands + 2 個頻帶邊界。依刻度 (等比或 Mel) 平均分配，但相鄰邊界至少相隔一個 FFT 頻率點：
+    低頻刻度間距小於頻率解析度的部分改為線性間距，其餘頻帶在剩下的範圍內照刻度重新分配，
+    每個三角頻帶都至少涵蓋一個頻率點，也不會有兩個頻帶用到完全相同的頻率點。
+    """
+    if scale == "mel":
+        warp = lambda f: librosa.hz_to_mel(f)
+        unwarp = lambda m: librosa.mel_to_hz(m)
+    else:
+        warp = np.log
+        unwarp = np.exp
+
+    bin_width = sr / n_fft
+    edges = [fmin]
+    for remaining in range(n_bands + 1, 0, -1):
+        previous = edges[-1]
+        step = (warp(fmax) - warp(previous)) / remaining
+        edges.append(max(float(unwarp(warp(previous) + step)), previous + bin_width))
+    return np.array(edges)
+
+
+def build_filterbank(sr, n_fft, n_bands, fmin=40.0, fmax=16000.0, scale="log"):
+    """
+    建立 (n_bands, n_fft//2+1) 的稀疏三角濾波器組，每列權重總和為 1。
+    scale="log" 為等比頻帶，scale="mel" 為 Mel 頻帶 (邊界見 band_edges)。
+    頻帶數多到超出取樣頻率範圍時，沒有涵蓋任何頻率點的頻帶改用最接近中心頻率的單一頻率點。
+    """
+    fmax = min(fmax, sr / 2)
+    fft_freqs = librosa.fft_frequencies(sr=sr, n_fft=n_fft)
+    edges = band_edges(sr, n_fft, n_bands, fmin, fmax, scale)
+
+    lower = edges[:-2, None]
+    center = edges[1:-1, None]
+    upper = edges[2:, None]
+    rising = (fft_freqs[None, :] - lower) / (center - lower)
+    falling = (upper - fft_freqs[None, :]) / (upper - center)
+    weights = np.maximum(0, np.minimum(rising, falling))
+
+    empty = weights.sum(axis=1) == 0
+    if np.any(empty):
+        nearest = np.abs(fft_freqs[None, :] - center[empty]).argmin(axis=1)
+        weights[np.where(empty)[0], nearest] = 1.0
+
+    weights /= weights.sum(axis=1, keepdims=True)
+    return sparse.csr_matrix(weights.astype(np.float32))
+
+
+def smooth_attack_release(values, frame_rate, attack=0.02, release=0.25):
+    """
+    對 (n_bands, n_frames) 做非對稱平滑：上升快、下降慢。
+    每一步用哪個係數取決於濾波器自己上一步的輸出，不是線性濾波器，
+    無法拆成 scipy.signal.lfilter (分別套用兩個方向的結果與逐步切換不同)；
+    因此時間方向維持遞迴，但每一步同時處理所有頻帶，並重複使用緩衝區 (4 分鐘約 0.1 秒，每首歌只做一次)。
+    """
+    attack_coef = 1 - np.exp(-1.0 / (frame_rate * attack)) if attack > 0 else 1.0
+    release_coef = 1 - np.exp(-1.0 / (frame_rate * release)) if release > 0 else 1.0
+
+    out = np.empty_like(values)
+    state = values[:, 0].copy()
+    delta = np.empty_like(state)
+    coef = np.empty_like(state)
+    for i in range(values.shape[1]):
+        np.subtract(values[:, i], state, out=delta)
+        np.copyto(coef, release_coef)
+        coef[delta > 0] = attack_coef
+        delta *= coef
+        state += delta
+        out[:, i] = state
+    return out
+
+
+def compute_bar_heights(DB, sr, n_fft, hop_length, n_bands, max_height, scale="log",
+                        db_range=60.0, attack=0.02, release=0.25):
+    """
+    從分貝頻譜 DB (librosa.amplitude_to_db, ref=max) 算出整首歌每根柱子的高度，
+    回傳 (n_bands, n_frames) float32 矩陣，單位為 px。
+    """
+    fb = build_filterbank(sr, n_fft, n_bands, scale=scale)
+
+    # 分段把分貝轉回功率並乘上濾波器組 (振幅分貝 20log10(A) 即為功率分貝 10log10(A²))
+    band_db = np.empty((n_bands, DB.shape[1]), dtype=np.float32)
+    for start in range(0, DB.shape[1], CHUNK_FRAMES):
+        power = librosa.db_to_power(DB[:, start:start + CHUNK_FRAMES])
+        band_db[:, start:start + CHUNK_FRAMES] = librosa.power_to_db(fb @ power, ref=1.0, top_db=None)
+
+    # 每首歌自己正規化：第 99 百分位數為滿格，往下 db_range 為零
+    ceiling = np.percentile(band_db, 99)
+    heights = np.clip((band_db - (ceiling - db_range)) / db_range, 0, 1)
+
+    heights = smooth_attack_release(heights, sr / hop_length, attack, release)
+    return (heights * max_height).astype(np.float32)
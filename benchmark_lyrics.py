@@ -0,0 +1,179 @@
+"""
+歌詞優化流程效能基準測試
+啟動本地模擬的 OpenAI 相容伺服器 (可設定延遲、抖動、錯誤率)，
+對不同句數的合成歌曲執行 optimize_lyrics_local_gpt (斷句、對齊、翻譯)，
+量測端到端時間、每秒請求數、各階段耗時與隨句數增加的成長幅度。全程離線執行。
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pysrt
+
+import optimize_lyrics
+from benchmark_render import CJK_CHARS
+from mock_llm_server import MockLLMServer
+
+
+def generate_lyric_song(srt_path, reference_path, line_count, seed=0, chorus_every=8):
+    """
+    產生一首合成歌曲：SRT 為沒有標點的辨識結果，參考歌詞為加上標點的同一段文字。
+    每 chorus_every 句重複一次副歌，讓快取與去重複有作用。
+    """
+    rng = random.Random(seed)
+    chorus = [''.join(rng.choice(CJK_CHARS) for _ in range(rng.randint(5, 9))) for _ in range(2)]
+
+    phrases = []
+    while len(phrases) < line_count:
+        if chorus_every and len(phrases) % chorus_every == chorus_every - 2:
+            phrases.extend(chorus)
+        else:
+            phrases.append(''.join(rng.choice(CJK_CHARS) for _ in range(rng.randint(4, 12))))
+    phrases = phrases[:line_count]
+
+    subs = pysrt.SubRipFile()
+    reference_lines = []
+    t = 1000
+    for k in range(0, len(phrases), 2):
+        pair = phrases[k:k + 2]
+        # 一句 SRT 包含兩個樂句，參考歌詞以逗號與句號分開
+        text = ''.join(pair)
+        duration = 250 * len(text)
+        subs.append(pysrt.SubRipItem(index=len(subs) + 1, start=pysrt.SubRipTime(milliseconds=t),
+                                     end=pysrt.SubRipTime(milliseconds=t + duration), text=text))
+        reference_lines.append('，'.join(pair) + rng.choice("。！？"))
+        t += duration + rng.choice([100, 300, 1500])
+
+    subs.save(srt_path, encoding='utf-8')
+    with open(reference_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(reference_lines) + '\n')
+
+
+def run_size(server, tmp_dir, line_count, seed, concurrency, batch_size):
+    """對一首 line_count 句的合成歌曲執行完整流程，回傳量測結果"""
+    srt_path = os.path.join(tmp_dir, f"song_{line_count}.srt")
+    reference_path = os.path.join(tmp_dir, f"song_{line_count}.txt")
+    output_path = os.path.join(tmp_dir, f"song_{line_count}_優化.srt")
+    generate_lyric_song(srt_path, reference_path, line_count, seed)
+
+    server.reset_stats()
+    start = time.perf_counter()
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+        result = optimize_lyrics.optimize_lyrics_local_gpt(
+            srt_path, output_path, server.url, reference_path,
+            max_concurrency=concurrency, batch_size=batch_size, cache_path=None, resume=False
+        )
+    wall = time.perf_counter() - start
+    if result is None:
+        return {'lines': line_count, 'error': True}
+
+    timings = result['timings']
+    llm_seconds = sum(result['llm_seconds'].values())
+    return {
+        'lines': line_count,
+        'output_lines': result['lines'],
+        'wall_seconds': wall,
+        'segment_seconds': timings['segment'],
+        'align_seconds': timings['align'],
+        'translate_wait_seconds': timings['translate_wait'],
+        # 斷句與翻譯以外的部分 (讀檔、字幕建立、輸出) 約為本地處理時間
+        'local_seconds': max(0.0, wall - timings['segment'] - timings['translate_wait']),
+        'requests': server.requests,
+        'injected_errors': server.errors,
+        'peak_in_flight': server.peak_in_flight,
+        'requests_per_second': server.requests / wall if wall > 0 else None,
+        'llm_seconds': llm_seconds,
+        'llm_retries': result['llm_retries'],
+        'failed_translations': result['failed_translations'],
+        'exact_matches': result['exact_matches'],
+    }
+
+
+def scaling(results):
+    """以線性回歸估計每增加 100 句增加的秒數"""
+    points = [(r['lines'], r['wall_seconds']) for r in results if not r.get('error')]
+    if len(points) < 2:
+        return None
+    x, y = np.array(points, dtype=np.float64).T
+    slope, intercept = np.polyfit(x, y, 1)
+    return {'seconds_per_100_lines': slope * 100, 'fixed_seconds': intercept}
+
+
+def print_results(results, scale):
+    print(f"\n{'句數':>4}  {'端到端':>6}  {'斷句':>6}  {'對齊':>6}  {'等翻譯':>5}  {'本地':>6}  "
+          f"{'請求':>4}  {'req/s':>6}  {'併發':>4}  {'重試':>4}  {'失敗':>4}")
+    for r in results:
+        if r.get('error'):
+            print(f"{r['lines']:>6}  ✗ 執行失敗")
+            continue
+        print(f"{r['lines']:>6}  {r['wall_seconds']:>7.2f}s {r['segment_seconds']:>7.2f}s "
+              f"{r['align_seconds'] * 1000:>6.1f}ms {r['translate_wait_seconds']:>7.2f}s "
+              f"{r['local_seconds']:>7.2f}s {r['requests']:>6} {r['requests_per_second']:>7.1f} "
+              f"{r['peak_in_flight']:>6} {r['llm_retries']:>6} {r['failed_translations']:>6}")
+    if scale:
+        print(f"\n📈 每增加 100 句約增加 {scale['seconds_per_100_lines']:.2f} 秒 (固定開銷 {scale['fixed_seconds']:.2f} 秒)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="歌詞優化流程效能基準測試 (離線，使用模擬 LLM 伺服器)")
+    parser.add_argument("--lines", type=int, nargs="+", default=[20, 50, 100, 200], help="合成歌曲的句數")
+    parser.add_argument("--latency", type=float, default=0.2, help="模擬伺服器的基本延遲 (秒)")
+    parser.add_argument("--jitter", type=float, default=0.05, help="延遲的隨機變動範圍 (±秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模擬伺服器回傳 503 的比例")
+    parser.add_argument("--stream-delay", type=float, default=0.005, help="串流時每段之間的間隔 (秒)")
+    parser.add_argument("--concurrency", type=int, default=optimize_lyrics.LLM_MAX_CONCURRENCY, help="LLM 併發上限")
+    parser.add_argument("--batch-size", type=int, default=optimize_lyrics.TRANSLATE_BATCH_SIZE, help="每個翻譯請求的句數")
+    parser.add_argument("--canned", default=None, help="固定回應 JSON 檔: {模型名稱: 回應文字}")
+    parser.add_argument("--seed", type=int, default=0, help="隨機種子")
+    parser.add_argument("--output", default=None, help="結果 JSON 輸出路徑")
+    args = parser.parse_args()
+
+    canned = None
+    if args.canned:
+        with open(args.canned, 'r', encoding='utf-8') as f:
+            canned = json.load(f)
+
+    print("=" * 60)
+    print("歌詞優化流程效能基準測試")
+    print("=" * 60)
+    print(f"延遲 {args.latency}s ±{args.jitter}s, 錯誤率 {args.error_rate:.0%}, "
+          f"併發 {args.concurrency}, 每批 {args.batch_size} 句")
+
+    results = []
+    with MockLLMServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                       stream_delay=args.stream_delay, canned=canned, seed=args.seed) as server, \
+            tempfile.TemporaryDirectory() as tmp_dir:
+        for line_count in sorted(args.lines):
+            result = run_size(server, tmp_dir, line_count, args.seed, args.concurrency, args.batch_size)
+            results.append(result)
+            if result.get('error'):
+                print(f"  ✗ {line_count} 句: 執行失敗")
+            else:
+                print(f"  ✓ {line_count} 句: {result['wall_seconds']:.2f}s, {result['requests']} 個請求")
+
+    scale = scaling(results)
+    print_results(results, scale)
+
+    if args.output:
+        report = {
+            'config': {k: v for k, v in vars(args).items() if k != 'output'},
+            'results': results,
+            'scaling': scale,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 結果已儲存: {args.output}")
+
+    if any(r.get('error') for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
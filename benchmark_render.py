@@ -0,0 +1,279 @@
+"""
+渲染管線效能基準測試
+產生固定種子的合成音訊與中英雙語 SRT，量測頻譜分析時間、各渲染階段的每秒幀數、
+編碼吞吐量與峰值記憶體，結果寫成 JSON 基準檔，並可與舊基準比較找出效能退步。
+全程離線執行，只需要本機的 ffmpeg。
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+import pysrt
+from PIL import ImageDraw
+
+import make_music_videos as mmv
+from ffmpeg_tools import get_ffmpeg_exe
+from memory_budget import get_peak_rss_mb
+
+# 合成歌詞用的字庫
+CJK_CHARS = "我你他的是在有愛心夢想天空星光雨風花月夜晚時間回憶離開等待溫柔眼淚微笑世界永遠擁抱遠方城市街燈聲音故事青春陪伴"
+ENGLISH_WORDS = [
+    "love", "heart", "dream", "sky", "star", "light", "rain", "wind", "flower", "moon",
+    "night", "time", "memory", "leave", "wait", "gentle", "tears", "smile", "world",
+    "forever", "embrace", "far", "away", "city", "street", "voice", "story", "youth", "with", "you"
+]
+
+
+def generate_audio(path, duration=30.0, sr=22050, kind="tone", seed=0):
+    """產生合成音訊 (16-bit 單聲道 WAV)：kind 為 tone (和弦+節拍) 或 noise (白噪音)"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(duration * sr)) / sr
+
+    if kind == "noise":
+        signal = rng.uniform(-1.0, 1.0, len(t)) * 0.3
+    else:
+        # 每兩秒換一組和弦，再加上每拍的音量包絡，讓頻譜有明顯變化
+        signal = np.zeros_like(t)
+        roots = [220.0, 261.63, 196.0, 174.61]
+        for k, root in enumerate(roots):
+            mask = (t // 2.0).astype(int) % len(roots) == k
+            for ratio in (1.0, 1.25, 1.5, 2.0):
+                signal[mask] += np.sin(2 * np.pi * root * ratio * t[mask])
+        beat = 0.5 + 0.5 * np.exp(-((t * 2.0) % 1.0) * 6.0)
+        signal = signal / 4.0 * beat * 0.6
+
+    pcm = (np.clip(signal, -1.0, 1.0) * 32767).astype(np.int16)
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sr)
+        f.writeframes(pcm.tobytes())
+
+
+def generate_srt(path, duration=30.0, lines_per_minute=20, seed=0):
+    """產生中英雙語 SRT：每句長度與間隔隨機，但同一個種子結果固定"""
+    rng = random.Random(seed)
+    subs = pysrt.SubRipFile()
+    avg_slot = 60.0 / max(1, lines_per_minute)
+
+    t = rng.uniform(0.5, 2.0)
+    while t < duration - 0.5:
+        length = rng.randint(4, 22)
+        chinese = ''.join(rng.choice(CJK_CHARS) for _ in range(length))
+        # 偶爾插入逗號，讓換行邏輯有斷句點可用
+        if length > 10:
+            pos = rng.randint(4, length - 4)
+            chinese = chinese[:pos] + '，' + chinese[pos:]
+        english = ' '.join(rng.choice(ENGLISH_WORDS) for _ in range(rng.randint(2, 10)))
+
+        line_duration = min(avg_slot * rng.uniform(0.6, 1.2), duration - t)
+        start_ms = int(t * 1000)
+        end_ms = int((t + line_duration) * 1000)
+        subs.append(pysrt.SubRipItem(
+            index=len(subs) + 1,
+            start=pysrt.SubRipTime(milliseconds=start_ms),
+            end=pysrt.SubRipTime(milliseconds=end_ms),
+            text=f"{chinese}\n{english}"
+        ))
+        # 間隔有時很短、有時是長段空白 (間奏)
+        gap = rng.choice([0.0, 0.1, 0.3, avg_slot * 0.5, avg_slot * 2])
+        t += line_duration + gap
+
+    subs.save(path, encoding='utf-8')
+    return len(subs)
+
+
+def benchmark_stages(times):
+    """逐幀量測 make_frame 的各個階段，回傳 {階段名稱: 每秒幀數} 與取樣畫面"""
+    stage_seconds = {'background': 0.0, 'visualizer': 0.0, 'lyrics': 0.0, 'to_array': 0.0}
+    frames = []
+
+    for t in times:
+        t0 = time.perf_counter()
+        img = mmv.render_background(t)
+        t1 = time.perf_counter()
+        draw = ImageDraw.Draw(img)
+        mmv.draw_visualizer(draw, mmv.compute_bar_heights(t))
+        t2 = time.perf_counter()
+        mmv.draw_lyrics(img, draw, t, mmv.find_current_index(t))
+        t3 = time.perf_counter()
+        frame = np.array(img.convert("RGB"))
+        t4 = time.perf_counter()
+
+        stage_seconds['background'] += t1 - t0
+        stage_seconds['visualizer'] += t2 - t1
+        stage_seconds['lyrics'] += t3 - t2
+        stage_seconds['to_array'] += t4 - t3
+        frames.append(frame)
+
+    total = sum(stage_seconds.values())
+    stage_fps = {name: len(times) / sec if sec > 0 else None for name, sec in stage_seconds.items()}
+    stage_fps['make_frame'] = len(times) / total if total > 0 else None
+    return stage_fps, frames
+
+
+def benchmark_encode(frames, encode_frames, ffmpeg_exe):
+    """用與正式輸出相同的編碼設定 (見 make_music_videos.load_encoder_settings) 編碼取樣畫面，回傳每秒編碼幀數"""
+    w, h = mmv.VIDEO_SIZE
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_path = os.path.join(tmp_dir, "encode.mp4")
+        cmd = [
+            ffmpeg_exe, "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{w}x{h}", "-r", str(mmv.FPS), "-i", "-",
+            *mmv.encoder_output_args(mmv.load_encoder_settings()), "-pix_fmt", "yuv420p",
+            output_path
+        ]
+        start = time.perf_counter()
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        for i in range(encode_frames):
+            proc.stdin.write(frames[i % len(frames)].tobytes())
+        proc.stdin.close()
+        proc.wait()
+        elapsed = time.perf_counter() - start
+
+        if proc.returncode != 0:
+            print(f"⚠ ffmpeg 編碼失敗 (return code {proc.returncode})")
+            return None
+        return encode_frames / elapsed
+
+
+def run_benchmark(args):
+    """產生合成輸入並跑完整的基準測試，回傳結果字典"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        audio_path = os.path.join(tmp_dir, f"bench_{args.kind}.wav")
+        srt_path = os.path.join(tmp_dir, "bench.srt")
+        generate_audio(audio_path, args.duration, args.sr, args.kind, args.seed)
+        line_count = generate_srt(srt_path, args.duration, args.lines_per_minute, args.seed)
+
+        # 字體與字幕載入不列入分析時間
+        start = time.perf_counter()
+        if not mmv.load_assets(audio_path, srt_path, song_title="基準測試", font_path=args.font, bg_image_path=None):
+            return None
+        load_sec = time.perf_counter() - start
+
+        # 分析時間包含頻譜與柱子特徵 (load_audio 整段)，柱子特徵另外從記憶體階段紀錄取出
+        stage_count = len(mmv.MEMORY.stages)
+        start = time.perf_counter()
+        mmv.load_audio(audio_path)
+        analysis_sec = time.perf_counter() - start
+        bars_sec = next((entry['seconds'] for entry in mmv.MEMORY.stages[stage_count:]
+                         if entry['stage'] == 'bars'), None)
+
+    times = np.linspace(0, args.duration, args.frames, endpoint=False)
+    stage_fps, frames = benchmark_stages(times)
+    encode_fps = benchmark_encode(frames[:args.encode_frames], args.encode_frames, get_ffmpeg_exe())
+
+    metrics = {
+        'analysis_sec': analysis_sec,
+        'bars_sec': bars_sec,
+        'load_assets_sec': load_sec,
+        'encode_fps': encode_fps,
+        'peak_rss_mb': get_peak_rss_mb(),
+    }
+    for name, fps in stage_fps.items():
+        metrics[f'{name}_fps'] = fps
+
+    return {
+        'config': {
+            'duration': args.duration,
+            'sr': args.sr,
+            'kind': args.kind,
+            'lines_per_minute': args.lines_per_minute,
+            'lines': line_count,
+            'frames': args.frames,
+            'encode_frames': args.encode_frames,
+            'seed': args.seed,
+            'video_size': list(mmv.VIDEO_SIZE),
+        },
+        'metrics': metrics,
+        'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def compare_results(baseline, current, threshold=0.1):
+    """
+    比較兩次結果，回傳退步項目列表 [(名稱, 基準值, 目前值, 變化比例)]。
+    *_fps 越高越好，*_sec 與 *_mb 越低越好。
+    """
+    regressions = []
+    for name, base_value in baseline.get('metrics', {}).items():
+        value = current['metrics'].get(name)
+        if base_value is None or value is None or base_value == 0:
+            continue
+
+        change = (value - base_value) / base_value
+        if name.endswith('_fps'):
+            worse = change < -threshold
+        else:
+            worse = change > threshold
+
+        if worse:
+            regressions.append((name, base_value, value, change))
+    return regressions
+
+
+def print_results(result, baseline=None):
+    print("\n📊 基準測試結果:")
+    for name, value in result['metrics'].items():
+        line = f"  {name:<20} {value:>10.2f}" if value is not None else f"  {name:<20} {'N/A':>10}"
+        if baseline and baseline['metrics'].get(name):
+            base_value = baseline['metrics'][name]
+            if value is not None:
+                line += f"  (基準 {base_value:.2f}, {(value - base_value) / base_value:+.1%})"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="渲染管線效能基準測試")
+    parser.add_argument("--duration", type=float, default=30.0, help="合成音訊長度 (秒)")
+    parser.add_argument("--sr", type=int, default=22050, help="合成音訊取樣率")
+    parser.add_argument("--kind", choices=["tone", "noise"], default="tone", help="合成音訊種類")
+    parser.add_argument("--lines-per-minute", type=int, default=20, help="歌詞密度")
+    parser.add_argument("--frames", type=int, default=60, help="量測的幀數")
+    parser.add_argument("--encode-frames", type=int, default=60, help="編碼吞吐量量測的幀數")
+    parser.add_argument("--seed", type=int, default=0, help="隨機種子")
+    parser.add_argument("--font", default=None, help="字體路徑 (預設使用 make_music_videos 的搜尋邏輯)")
+    parser.add_argument("--output", default=None, help="結果 JSON 輸出路徑 (未指定且非比較模式時為 bench_baseline.json)")
+    parser.add_argument("--compare", default=None, help="要比較的基準 JSON")
+    parser.add_argument("--threshold", type=float, default=0.1, help="退步門檻 (0.1 = 10%%)")
+    args = parser.parse_args()
+
+    result = run_benchmark(args)
+    if result is None:
+        print("✗ 基準測試失敗：無法載入字體")
+        sys.exit(1)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    print_results(result, baseline)
+
+    # 比較模式預設不覆寫基準檔
+    output_path = args.output or (None if args.compare else "bench_baseline.json")
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\n✓ 結果已儲存至: {output_path}")
+
+    if baseline:
+        regressions = compare_results(baseline, result, args.threshold)
+        if regressions:
+            print(f"\n❌ 發現 {len(regressions)} 項效能退步 (門檻 {args.threshold:.0%}):")
+            for name, base_value, value, change in regressions:
+                print(f"  {name}: {base_value:.2f} → {value:.2f} ({change:+.1%})")
+            sys.exit(1)
+        print(f"\n✅ 沒有超過 {args.threshold:.0%} 的效能退步")
+
+
+if __name__ == "__main__":
+    main()
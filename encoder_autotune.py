@@ -0,0 +1,244 @@
+"""
+編碼設定自動調校
+歌詞影片大多是靜態背景加上小範圍變化 (柱子、歌詞)，固定的 medium / 8000k 通常又慢又大。
+這裡渲染一段連續的代表性畫面存成無損來源，再以不同的 preset、CRF 或位元率、tune 組合編碼，
+量測每秒編碼幀數、檔案大小與相對無損來源的 SSIM / PSNR，
+從品質達標的組合中選出建議設定，寫入 make_music_videos.ENCODER_PROFILE_PATH 供渲染時預設使用。
+用法: python encoder_autotune.py [--audio 歌.mp3 --srt 歌.srt] [--seconds 4] [--min-ssim 0.985]
+"""
+
+import argparse
+import itertools
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+import make_music_videos as mmv
+from benchmark_render import generate_audio, generate_srt
+from ffmpeg_tools import get_ffmpeg_exe
+
+DEFAULT_PRESETS = ["veryfast", "faster", "fast", "medium"]
+DEFAULT_RATES = ["crf:18", "crf:23", "bitrate:8000k"]
+DEFAULT_TUNES = ["none", "stillimage", "animation"]
+
+# 品質下限與檔案大小的容許範圍：大小不超過最小檔案的 SIZE_SLACK 倍時選編碼最快的組合
+MIN_SSIM = 0.985
+SIZE_SLACK = 1.25
+
+SSIM_PATTERN = re.compile(r"SSIM .*All:([\d.]+)")
+PSNR_PATTERN = re.compile(r"PSNR .*average:([\d.]+|inf)")
+
+
+def parse_rate(rate):
+    """'crf:23' -> {'crf': 23, 'bitrate': None}，'bitrate:8000k' -> {'crf': None, 'bitrate': '8000k'}"""
+    kind, _, value = rate.partition(':')
+    if kind == 'crf':
+        return {'crf': int(value), 'bitrate': None}
+    if kind == 'bitrate':
+        return {'crf': None, 'bitrate': value}
+    raise ValueError(f"無法解析的位元率設定: {rate} (應為 crf:N 或 bitrate:N)")
+
+
+def candidate_settings(presets, rates, tunes):
+    """列出所有要測試的編碼設定，目前的預設設定一定包含在內 (作為比較基準)"""
+    candidates = [dict(mmv.DEFAULT_ENCODER_SETTINGS)]
+    for preset, rate, tune in itertools.product(presets, rates, tunes):
+        settings = {'codec': 'libx264', 'preset': preset, 'tune': None if tune == 'none' else tune}
+        settings.update(parse_rate(rate))
+        if settings not in candidates:
+            candidates.append(settings)
+    return candidates
+
+
+def render_source(ffmpeg_exe, source_path, start, seconds):
+    """
+    從 start 開始渲染 seconds 秒的連續畫面 (與正式輸出相同的渲染路徑)，
+    以無損 RGB 編碼存成來源檔，回傳幀數。連續的畫面才能反映畫面間預測的效果。
+    """
+    w, h = mmv.VIDEO_SIZE
+    frame_count = max(1, int(round(seconds * mmv.FPS)))
+    cmd = [
+        ffmpeg_exe, "-y", "-loglevel", "error",
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{w}x{h}", "-r", str(mmv.FPS), "-i", "-",
+        "-c:v", "libx264rgb", "-qp", "0", "-preset", "ultrafast", source_path
+    ]
+    make_frame = mmv.make_frame_skipping if mmv.FRAME_SKIP else mmv.make_frame
+    mmv.reset_render_state()
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+    for i in range(frame_count):
+        proc.stdin.write(make_frame(start + i / mmv.FPS).tobytes())
+    proc.stdin.close()
+    if proc.wait() != 0:
+        raise RuntimeError(f"無損來源編碼失敗 (return code {proc.returncode})")
+    return frame_count
+
+
+def decode_seconds(ffmpeg_exe, source_path):
+    """單純解碼無損來源的時間，從編碼時間中扣除"""
+    start = time.perf_counter()
+    subprocess.run([ffmpeg_exe, "-loglevel", "error", "-i", source_path, "-f", "null", "-"], check=True)
+    return time.perf_counter() - start
+
+
+def measure_quality(ffmpeg_exe, encoded_path, source_path):
+    """以 yuv420p 比較編碼結果與無損來源，回傳 (SSIM, PSNR)"""
+    graph = ("[0:v]format=yuv420p,split[d1][d2];[1:v]format=yuv420p,split[r1][r2];"
+             "[d1][r1]ssim;[d2][r2]psnr")
+    proc = subprocess.run([ffmpeg_exe, "-hide_banner", "-nostats", "-i", encoded_path, "-i", source_path,
+                           "-lavfi", graph, "-f", "null", "-"], capture_output=True, text=True)
+    ssim = SSIM_PATTERN.search(proc.stderr)
+    psnr = PSNR_PATTERN.search(proc.stderr)
+    if proc.returncode != 0 or not ssim or not psnr:
+        raise RuntimeError(f"品質量測失敗: {proc.stderr.strip()[-200:]}")
+    return float(ssim.group(1)), float(psnr.group(1))
+
+
+def measure_candidate(ffmpeg_exe, settings, source_path, output_path, frame_count, decode_time):
+    """以 settings 編碼無損來源，回傳每秒編碼幀數、大小、位元率與品質"""
+    cmd = [ffmpeg_exe, "-y", "-loglevel", "error", "-i", source_path,
+           *mmv.encoder_output_args(settings), "-pix_fmt", "yuv420p", "-an", output_path]
+    start = time.perf_counter()
+    subprocess.run(cmd, check=True)
+    elapsed = time.perf_counter() - start
+
+    ssim, psnr = measure_quality(ffmpeg_exe, output_path, source_path)
+    size = os.path.getsize(output_path)
+    return {
+        'settings': settings,
+        'encode_fps': frame_count / max(elapsed - decode_time, 1e-3),
+        'size_kb': size / 1024,
+        'kbps': size * 8 / 1000 / (frame_count / mmv.FPS),
+        'ssim': ssim,
+        'psnr': psnr,
+    }
+
+
+def choose_profile(results, min_ssim=MIN_SSIM, size_slack=SIZE_SLACK):
+    """
+    從 SSIM 達標的結果中，選大小不超過最小檔案 size_slack 倍、且編碼最快的組合。
+    沒有組合達標時選 SSIM 最高的。
+    """
+    qualified = [result for result in results if result['ssim'] >= min_ssim]
+    if not qualified:
+        return max(results, key=lambda result: result['ssim'])
+    smallest = min(result['size_kb'] for result in qualified)
+    compact = [result for result in qualified if result['size_kb'] <= smallest * size_slack]
+    return max(compact, key=lambda result: result['encode_fps'])
+
+
+def pareto_front(results, min_ssim=MIN_SSIM):
+    """品質達標的組合中，沒有其他組合同時更快又更小的 (以 id 集合回傳)"""
+    qualified = [result for result in results if result['ssim'] >= min_ssim]
+    return {id(result) for result in qualified
+            if not any(other['encode_fps'] > result['encode_fps'] and other['size_kb'] < result['size_kb']
+                       for other in qualified)}
+
+
+def print_results(results, best, baseline, min_ssim):
+    front = pareto_front(results, min_ssim)
+    print(f"\n  {'設定':<40} {'編碼fps':>8} {'大小KB':>9} {'kbps':>8} {'SSIM':>7} {'PSNR':>6}")
+    for result in sorted(results, key=lambda result: -result['encode_fps']):
+        marker = "★" if result is best else ("◆" if id(result) in front else ("✗" if result['ssim'] < min_ssim else " "))
+        print(f"{marker} {mmv.describe_encoder(result['settings']):<42} {result['encode_fps']:>8.1f} "
+              f"{result['size_kb']:>9.0f} {result['kbps']:>8.0f} {result['ssim']:>7.4f} {result['psnr']:>6.2f}")
+    print(f"  ★ 建議設定  ◆ 速度與大小的最佳取捨  ✗ SSIM 低於 {min_ssim}")
+
+    print(f"\n✅ 建議設定: {mmv.describe_encoder(best['settings'])}")
+    print(f"   與目前預設 ({mmv.describe_encoder(baseline['settings'])}) 相比: "
+          f"編碼速度 {best['encode_fps'] / baseline['encode_fps']:.2f}x, "
+          f"檔案大小 {best['size_kb'] / baseline['size_kb']:.0%}, SSIM {best['ssim'] - baseline['ssim']:+.4f}")
+
+
+def sample_start(duration, seconds):
+    """取樣片段從第一句歌詞前一秒開始 (包含歌詞切換與柱子變化)"""
+    first_line = mmv.subs[0].start.ordinal / 1000.0 if mmv.subs else 0.0
+    return max(0.0, min(first_line - 1.0, duration - seconds))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="編碼設定自動調校 (速度、大小與畫質的量測)")
+    parser.add_argument("--audio", default=None, help="取樣用的音樂檔案 (預設使用合成音訊)")
+    parser.add_argument("--srt", default=None, help="取樣用的 SRT (預設使用合成歌詞)")
+    parser.add_argument("--font", default=None, help="字體路徑 (預設使用 make_music_videos 的搜尋邏輯)")
+    parser.add_argument("--start", type=float, default=None, help="取樣片段的開始時間 (秒，預設為第一句歌詞前一秒)")
+    parser.add_argument("--seconds", type=float, default=4.0, help="取樣片段長度 (秒)")
+    parser.add_argument("--presets", nargs="+", default=DEFAULT_PRESETS, help="要測試的 x264 preset")
+    parser.add_argument("--rates", nargs="+", default=DEFAULT_RATES, help="要測試的位元率控制: crf:N 或 bitrate:N")
+    parser.add_argument("--tunes", nargs="+", default=DEFAULT_TUNES, help="要測試的 x264 tune (none = 不指定)")
+    parser.add_argument("--min-ssim", type=float, default=MIN_SSIM, help="建議設定的最低 SSIM")
+    parser.add_argument("--size-slack", type=float, default=SIZE_SLACK, help="可接受的檔案大小 (最小檔案的倍數)")
+    parser.add_argument("--profile", default=mmv.ENCODER_PROFILE_PATH, help="建議設定的輸出路徑")
+    parser.add_argument("--dry-run", action="store_true", help="只顯示結果，不寫入設定檔")
+    args = parser.parse_args()
+
+    candidates = candidate_settings(args.presets, args.rates, args.tunes)
+    ffmpeg_exe = get_ffmpeg_exe()
+
+    print("=" * 60)
+    print("編碼設定自動調校")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        audio_file, srt_file = args.audio, args.srt
+        if not audio_file or not srt_file:
+            audio_file = os.path.join(tmp_dir, "sample.wav")
+            srt_file = os.path.join(tmp_dir, "sample.srt")
+            generate_audio(audio_file, duration=max(20.0, args.seconds + 5.0))
+            generate_srt(srt_file, duration=max(20.0, args.seconds + 5.0), lines_per_minute=30)
+        if not mmv.load_assets(audio_file, srt_file, song_title="編碼測試" if not args.audio else None,
+                               font_path=args.font):
+            print("✗ 無法載入字體")
+            sys.exit(1)
+
+        start = args.start if args.start is not None else sample_start(mmv.DURATION, args.seconds)
+        source_path = os.path.join(tmp_dir, "source.mkv")
+        print(f"\n🎬 渲染取樣片段: {start:.1f}s 起 {args.seconds:.1f} 秒 ({mmv.VIDEO_SIZE[0]}x{mmv.VIDEO_SIZE[1]}, {mmv.FPS} fps)")
+        frame_count = render_source(ffmpeg_exe, source_path, start, args.seconds)
+        decode_time = decode_seconds(ffmpeg_exe, source_path)
+
+        print(f"⏱ 測試 {len(candidates)} 組編碼設定...")
+        results = []
+        for k, settings in enumerate(candidates):
+            output_path = os.path.join(tmp_dir, f"candidate_{k}.mp4")
+            try:
+                result = measure_candidate(ffmpeg_exe, settings, source_path, output_path, frame_count, decode_time)
+            except (subprocess.CalledProcessError, RuntimeError) as e:
+                print(f"  ✗ {mmv.describe_encoder(settings)}: {e}")
+                continue
+            finally:
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+            results.append(result)
+            print(f"  ✓ {mmv.describe_encoder(settings)}: {result['encode_fps']:.1f} fps, "
+                  f"{result['size_kb']:.0f} KB, SSIM {result['ssim']:.4f}")
+
+    baseline = next((result for result in results if result['settings'] == mmv.DEFAULT_ENCODER_SETTINGS), None)
+    if not results or baseline is None:
+        print("❌ 編碼測試失敗")
+        sys.exit(1)
+
+    best = choose_profile(results, args.min_ssim, args.size_slack)
+    print_results(results, best, baseline, args.min_ssim)
+
+    if args.dry_run:
+        return
+    profile = {
+        'settings': best['settings'],
+        'measured': {key: best[key] for key in ('encode_fps', 'size_kb', 'kbps', 'ssim', 'psnr')},
+        'baseline': {key: baseline[key] for key in ('settings', 'encode_fps', 'size_kb', 'kbps', 'ssim', 'psnr')},
+        'criteria': {'min_ssim': args.min_ssim, 'size_slack': args.size_slack},
+        'sample': {'audio': args.audio, 'srt': args.srt, 'start': start, 'seconds': args.seconds,
+                   'video_size': list(mmv.VIDEO_SIZE), 'fps': mmv.FPS},
+        'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    with open(args.profile, 'w', encoding='utf-8') as f:
+        json.dump(profile, f, ensure_ascii=False, indent=2)
+    print(f"\n💾 建議設定已儲存: {args.profile} (make_music_videos 渲染時預設使用)")
+
+
+if __name__ == "__main__":
+    main()
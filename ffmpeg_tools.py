@@ -0,0 +1,12 @@
+"""
+ffmpeg 相關的共用工具
+"""
+
+
+def get_ffmpeg_exe():
+    """優先使用 MoviePy 內建的 imageio-ffmpeg，否則使用 PATH 上的 ffmpeg"""
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return "ffmpeg"
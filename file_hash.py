@@ -0,0 +1,16 @@
+"""
+檔案雜湊
+字體子集、字體涵蓋範圍、起音快取、遙測與黃金畫面都以檔案內容的 SHA-256 當作快取鍵或識別。
+只用標準函式庫，匯入這個模組不會連帶載入 fontTools 等選用套件。
+"""
+
+import hashlib
+
+
+def file_sha256(path):
+    """以 1 MB 區塊讀取檔案，回傳 SHA-256 十六進位字串"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
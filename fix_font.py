@@ -1,48 +1,109 @@
+import hashlib
 import os
 from fontTools.ttLib import TTFont
 
+from file_hash import file_sha256
+
 input_font = "ChenYuluoyan-2.0-Thin.ttf"
 output_font = "ChenYuluoyan-2.0-Thin_fixed.ttf"
 
-search_paths = [
-    os.path.join(os.getcwd(), input_font),
-    os.path.join(r"C:\Windows\Fonts", input_font),
-    os.path.join(os.environ.get("LOCALAPPDATA", ""), r"Microsoft\Windows\Fonts", input_font),
-    # Also check project dir explicitly
-    os.path.join("e:\\My Project\\make_music_videos", input_font)
-]
-
-found_path = None
-for p in search_paths:
-    if os.path.exists(p):
-        found_path = p
-        break
-
-if not found_path:
-    print(f"Error: Could not find {input_font}")
-    exit(1)
-
-print(f"Processing: {found_path}")
-
-try:
-    font = TTFont(found_path)
-    
-    # Tables related to TrueType hinting/instructions
-    # Removing these disables the bytecode instructions causing "too many function definitions"
-    hinting_tables = ['fpgm', 'prep', 'cvt ', 'hdmx', 'LTSH', 'VDMX', 'gasp']
-    
+# Tables related to TrueType hinting/instructions
+# Removing these disables the bytecode instructions causing "too many function definitions"
+HINTING_TABLES = ['fpgm', 'prep', 'cvt ', 'hdmx', 'LTSH', 'VDMX', 'gasp']
+
+# Bump when the subset options change, so subsets cached by older versions are rebuilt
+SUBSET_VERSION = 2
+
+
+def strip_hinting(font):
+    """Remove hinting tables from a loaded TTFont, returns the number of tables removed."""
     removed_count = 0
-    for tag in hinting_tables:
+    for tag in HINTING_TABLES:
         if tag in font:
             del font[tag]
             removed_count += 1
-            
+    return removed_count
+
+
+def fix_font(input_path, output_path):
+    """Save a copy of the font with all hinting tables removed."""
+    font = TTFont(input_path)
+    removed_count = strip_hinting(font)
     print(f"Removed {removed_count} hinting tables.")
-    
-    output_path = os.path.join(os.path.dirname(__file__), output_font)
     font.save(output_path)
-    print(f"Saved optimized font to: {output_path}")
+    return output_path
+
+
+def build_font_subset(font_path, text, cache_dir):
+    """
+    Build a subset with the hinting tables removed of font_path that only contains the glyphs used in text.
+    The result is cached in cache_dir, keyed by the font hash and the glyph set,
+    so repeated runs (and parallel workers) reuse the same small file.
+    Returns the path of the subset font.
+    """
+    from fontTools import subset
+
+    chars = ''.join(sorted(set(text) - {'\n', '\r'}))
+    font_key = file_sha256(font_path)[:16]
+    glyph_key = hashlib.sha256(f"{SUBSET_VERSION}:{chars}".encode('utf-8')).hexdigest()[:16]
+    base_name = os.path.splitext(os.path.basename(font_path))[0]
+    output_path = os.path.join(cache_dir, f"{base_name}_{font_key}_{glyph_key}.ttf")
+
+    if os.path.exists(output_path):
+        return output_path
+
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # Same treatment as fix_font(): only the hinting tables are dropped, per-glyph programs are kept
+    # so the subset rasterizes exactly like the fixed full font.
+    # The legacy 'kern' table is kept too (fontTools drops it by default): draw.text uses it for pair kerning
+    options = subset.Options()
+    options.hinting = True
+    options.legacy_kern = True
+    options.drop_tables += [tag for tag in HINTING_TABLES if tag not in options.drop_tables]
+    options.layout_features = ['*']
+    options.name_IDs = ['*']
+    options.notdef_outline = True
+
+    font = subset.load_font(font_path, options)
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(text=chars)
+    subsetter.subset(font)
+    strip_hinting(font)
+
+    # Write to a temp file first so concurrent workers never see a half-written font
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    subset.save_font(font, tmp_path, options)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+if __name__ == "__main__":
+    search_paths = [
+        os.path.join(os.getcwd(), input_font),
+        os.path.join(r"C:\Windows\Fonts", input_font),
+        os.path.join(os.environ.get("LOCALAPPDATA", ""), r"Microsoft\Windows\Fonts", input_font),
+        # Also check project dir explicitly
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), input_font)
+    ]
+
+    found_path = None
+    for p in search_paths:
+        if os.path.exists(p):
+            found_path = p
+            break
+
+    if not found_path:
+        print(f"Error: Could not find {input_font}")
+        exit(1)
+
+    print(f"Processing: {found_path}")
+
+    try:
+        output_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), output_font)
+        fix_font(found_path, output_path)
+        print(f"Saved optimized font to: {output_path}")
 
-except Exception as e:
-    print(f"Failed to fix font: {e}")
-    exit(1)
+    except Exception as e:
+        print(f"Failed to fix font: {e}")
+        exit(1)
@@ -0,0 +1,243 @@
+"""
+字體備援鏈
+主要字體 (手寫風格) 缺少的字 (罕用字、全形符號、英文翻譯裡的表情符號等) 會畫成方塊。
+這裡依序列出多個字體，每個字體的 cmap 涵蓋範圍只建立一次並快取在磁碟
+(依路徑、大小與修改時間，不必每次讀完整個字體檔計算雜湊)，同一行程內再快取在記憶體，
+載入歌詞時把每行文字切成連續的區段 (run)，各自指定給第一個涵蓋該字的字體；
+排版結果 (每個字使用的字體與寬度) 依 (文字, 字級, 字距) 快取，渲染時不再逐幀檢查涵蓋範圍。
+"""
+
+import hashlib
+import os
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+# 不需要字形的字元：跟著前一個字使用同一個字體，不會切開區段
+INHERIT_CHARS = set(' \t\u200b\u200c\u200d\ufe0e\ufe0f')
+
+# 本行程已讀取的涵蓋範圍 {(路徑, 大小, 修改時間): frozenset}
+_COVERAGE = {}
+
+
+def font_file_key(font_path):
+    """(絕對路徑, 大小, 修改時間 ns)：字體檔被替換或修改時會改變，不需要讀取檔案內容"""
+    stat = os.stat(font_path)
+    return os.path.abspath(font_path), stat.st_size, stat.st_mtime_ns
+
+
+def coverage_cache_path(font_path, cache_dir, file_key=None):
+    file_key = file_key or font_file_key(font_path)
+    base_name = os.path.splitext(os.path.basename(font_path))[0]
+    digest = hashlib.sha256(repr(file_key).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{base_name}_{digest}.cmap.npy")
+
+
+def load_coverage(font_path, cache_dir):
+    """
+    回傳字體涵蓋的 Unicode 碼位 (frozenset)。
+    第一次讀取 cmap 後把排序好的碼位陣列存成 .npy，之後直接讀快取；同一行程內只讀一次。
+    .ttc 字體集使用第一個字體。
+    """
+    file_key = font_file_key(font_path)
+    coverage = _COVERAGE.get(file_key)
+    if coverage is not None:
+        return coverage
+
+    cache_path = coverage_cache_path(font_path, cache_dir, file_key)
+    if os.path.exists(cache_path):
+        try:
+            coverage = frozenset(np.load(cache_path).tolist())
+            _COVERAGE[file_key] = coverage
+            return coverage
+        except (OSError, ValueError):
+            pass
+
+    from fontTools.ttLib import TTFont
+
+    font = TTFont(font_path, fontNumber=0, lazy=True)
+    try:
+        cmap = font.getBestCmap() or {}
+    finally:
+        font.close()
+    codepoints = np.array(sorted(cmap), dtype=np.uint32)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp.npy"
+    np.save(tmp_path, codepoints)
+    os.replace(tmp_path, cache_path)
+    coverage = frozenset(codepoints.tolist())
+    _COVERAGE[file_key] = coverage
+    return coverage
+
+
+class TextLayout:
+    """一行文字的排版：每個字使用的字體與寬度，以及加上字距後的總寬度"""
+
+    def __init__(self, chars, fonts, widths, spacing):
+        self.chars = chars
+        self.fonts = fonts
+        self.widths = widths
+        total_width = 0
+        for w in widths:
+            total_width += w
+        total_width += spacing * (len(chars) - 1) if len(chars) > 1 else 0
+        self.total_width = total_width
+        self.glyphs = list(zip(chars, fonts, widths))
+
+
+class FontChain:
+    """
+    依序排列的字體 (第 0 個為主要字體) 與各自的涵蓋範圍。
+    fonts[k] 為第 k 個字體載入後的各字級字體物件 (與主要字體的字級一一對應)，沒用到的字體為 None。
+    """
+
+    def __init__(self, paths, coverages):
+        self.paths = paths
+        self.coverages = coverages
+        self.fonts = [None] * len(paths)
+        self.loaded_paths = [None] * len(paths)  # 實際載入的檔案 (字體子集)
+        self.layouts = {}
+        self._measure = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+
+    def font_index(self, char):
+        """第一個涵蓋 char 的字體索引，都沒有時回傳 None"""
+        code = ord(char)
+        for index, coverage in enumerate(self.coverages):
+            if code in coverage:
+                return index
+        return None
+
+    def split_runs(self, text):
+        """
+        把文字切成 [(字體索引, 區段文字), ...]。
+        空白等不需字形的字元併入前一個區段 (該字體要涵蓋這個字元，否則會畫成 .notdef 方塊)；
+        沒有任何字體涵蓋的字交給主要字體 (會畫成方塊)。
+        """
+        runs = []
+        for char in text:
+            if char in INHERIT_CHARS and runs and ord(char) in self.coverages[runs[-1][0]]:
+                index = runs[-1][0]
+            else:
+                index = self.font_index(char)
+                if index is None:
+                    index = 0
+            if runs and runs[-1][0] == index:
+                runs[-1][1].append(char)
+            else:
+                runs.append((index, [char]))
+        return [(index, ''.join(chars)) for index, chars in runs]
+
+    def assign(self, text):
+        """
+        {字體索引: 該字體要畫的字元集合}，以及沒有任何字體涵蓋的字元。
+        空白等字元記在主要字體；備援字體的子集另外要加上 inherited_chars (見 split_runs)。
+        """
+        assigned = {}
+        missing = set()
+        for char in set(text) - {'\n', '\r'}:
+            index = 0 if char in INHERIT_CHARS else self.font_index(char)
+            if index is None:
+                missing.add(char)
+                index = 0
+            assigned.setdefault(index, set()).add(char)
+        return assigned, missing
+
+    def inherited_chars(self, text, index):
+        """text 中併入第 index 個字體區段時需要該字體字形的字元 (空白等，該字體有涵蓋的)"""
+        return {char for char in set(text) & INHERIT_CHARS if ord(char) in self.coverages[index]}
+
+    def covered_by_primary(self, text):
+        return all(char in INHERIT_CHARS or ord(char) in self.coverages[0] for char in text)
+
+    def layout(self, text, font, spacing):
+        """
+        text 以主要字體的某個字級 font 繪製時的排版 (依 (文字, 字級, 字距) 快取)。
+        每個區段改用對應字體的同一字級；該字體沒有載入時沿用主要字體。
+        """
+        key = (text, id(font), spacing)
+        layout = self.layouts.get(key)
+        if layout is not None:
+            return layout
+
+        slot = self.font_slot(font)
+        chars, fonts = [], []
+        for index, run in self.split_runs(text):
+            run_font = font
+            if slot is not None and self.fonts[index] is not None:
+                run_font = self.fonts[index][slot]
+            chars.extend(run)
+            fonts.extend([run_font] * len(run))
+        widths = [self._measure.textlength(char, font=char_font) for char, char_font in zip(chars, fonts)]
+
+        layout = TextLayout(chars, fonts, widths, spacing)
+        self.layouts[key] = layout
+        return layout
+
+    def font_slot(self, font):
+        """font 在主要字體各字級中的位置，不是主要字體時回傳 None"""
+        return next((i for i, primary in enumerate(self.fonts[0] or ()) if primary is font), None)
+
+    def export_layouts(self):
+        """
+        把排版快取轉成與行程無關的表格：([(文字, 字級位置, 字距, offset)], 字寬陣列, 字體索引陣列)。
+        字體物件以 (備援鏈索引, 字級位置) 表示，另一個行程載入相同字體後用 seed_layouts 還原。
+        """
+        entries, widths, indexes = [], [], []
+        for (text, _, spacing), layout in self.layouts.items():
+            slot = self.font_slot(layout.fonts[0]) if layout.fonts else None
+            if slot is None and layout.fonts:
+                continue
+            entries.append((text, slot, spacing, len(widths)))
+            for char_font, width in zip(layout.fonts, layout.widths):
+                index = next((k for k, fonts in enumerate(self.fonts) if fonts is not None and fonts[slot] is char_font), 0)
+                indexes.append(index)
+                widths.append(width)
+        return entries, np.array(widths, dtype=np.float64), np.array(indexes, dtype=np.int16)
+
+    def seed_layouts(self, entries, widths, indexes):
+        """以 export_layouts 的表格填入排版快取"""
+        for text, slot, spacing, offset in entries:
+            if slot is None:
+                continue
+            font = self.fonts[0][slot]
+            end = offset + len(text)
+            fonts = [(self.fonts[index] or self.fonts[0])[slot] for index in indexes[offset:end].tolist()]
+            self.layouts[(text, id(font), spacing)] = TextLayout(list(text), fonts, widths[offset:end].tolist(), spacing)
+
+
+def single_font_layout(text, font, spacing):
+    """沒有備援鏈時的排版 (全部使用同一字體，不快取)"""
+    measure = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+    chars = list(text)
+    return TextLayout(chars, [font] * len(chars), [measure.textlength(char, font=font) for char in chars], spacing)
+
+
+class AllCoverage:
+    """無法讀取 cmap 的主要字體：假設涵蓋所有字 (與沒有備援鏈時的行為相同)"""
+
+    def __contains__(self, code):
+        return True
+
+
+def build_font_chain(font_paths, cache_dir):
+    """
+    建立備援鏈，跳過不存在或無法讀取 cmap 的字體 (主要字體讀取失敗時視為涵蓋全部，交給 FreeType 處理)。
+    回傳 FontChain。
+    """
+    paths, coverages = [], []
+    for position, path in enumerate(font_paths):
+        if not path or not os.path.isfile(path):
+            if position == 0:
+                paths.append(path)
+                coverages.append(AllCoverage())
+            continue
+        try:
+            coverages.append(load_coverage(path, cache_dir))
+            paths.append(path)
+        except Exception as e:
+            print(f"⚠ 無法讀取字體涵蓋範圍 {os.path.basename(path)}: {e}")
+            if position == 0:
+                paths.append(path)
+                coverages.append(AllCoverage())
+    return FontChain(paths, coverages)
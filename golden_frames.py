@@ -0,0 +1,326 @@
+"""
+黃金畫面回歸測試
+用參考的 make_frame 在指定時間點渲染合成歌曲並存成黃金畫面 (PNG)，
+之後每條加速渲染路徑都要在同樣的時間點與參考畫面比對
+(最大像素差、PSNR、SSIM)，超過容許值就視為畫面改變。
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import PIL
+from PIL import Image, ImageDraw
+
+import asset_store
+import make_music_videos as mmv
+import parallel_render
+from font_fallback import INHERIT_CHARS
+from benchmark_render import generate_audio, generate_srt
+from file_hash import file_sha256
+
+GOLDEN_DIR = "golden_frames"
+
+# 合成歌曲組合：涵蓋密集/稀疏歌詞、和弦/噪音頻譜
+SYNTHETIC_SONGS = [
+    {'name': 'tone_dense', 'kind': 'tone', 'duration': 20.0, 'lines_per_minute': 30, 'seed': 1},
+    {'name': 'tone_sparse', 'kind': 'tone', 'duration': 20.0, 'lines_per_minute': 8, 'seed': 2},
+    {'name': 'noise_dense', 'kind': 'noise', 'duration': 20.0, 'lines_per_minute': 24, 'seed': 3},
+]
+
+# 預設容許值
+MAX_ABS_DIFF = 8
+MIN_PSNR = 40.0
+MIN_SSIM = 0.99
+
+# 空白檢查用的文字：符號通常不在主要字體裡，會切出備援字體區段，區段內的空白也用備援字體畫
+BLANK_GLYPH_PROBE = "snow ☃ ☃ man ♪ ★ → ✓ 你好 世界"
+
+# 渲染路徑註冊表：名稱 -> 工廠函數 (在 load_assets 之後呼叫，回傳 t -> RGB 陣列 的函數)
+RENDER_PATHS = {
+    'reference': lambda: mmv.make_frame,
+    'frame_skip': lambda: mmv.make_frame_skipping,
+}
+# 整批渲染的路徑：工廠函數直接收時間點列表，回傳畫面列表
+BATCH_RENDER_PATHS = set()
+
+
+def register_render_path(name, factory, batch=False):
+    """註冊一條加速渲染路徑，供黃金畫面比對"""
+    RENDER_PATHS[name] = factory
+    if batch:
+        BATCH_RENDER_PATHS.add(name)
+    else:
+        BATCH_RENDER_PATHS.discard(name)
+
+
+def _worker_frames(times):
+    """在工作行程中依序渲染時間點 (init_worker 之後執行)"""
+    mmv.reset_render_state()
+    return [mmv.make_frame(t) for t in times]
+
+
+def render_parallel_worker(times):
+    """
+    走 parallel_render 的路徑：主行程 publish_assets 放進共享區，
+    spawn 出的工作行程只靠 init_worker 還原狀態 (排版表、精靈圖) 再渲染，
+    export_layouts/seed_layouts 或精靈圖打包格式不一致時畫面就會不同。
+    """
+    bar_heights, db = mmv.BAR_HEIGHTS, mmv.DB
+    try:
+        with asset_store.AssetStore() as store:
+            parallel_render.publish_assets(store)
+            with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn"),
+                                     initializer=parallel_render.init_worker,
+                                     initargs=(store.manifest,)) as executor:
+                return executor.submit(_worker_frames, times).result()
+    finally:
+        # publish_assets 把柱子特徵換成共享區的映射，共享區關閉後還原
+        mmv.BAR_HEIGHTS, mmv.DB = bar_heights, db
+
+
+register_render_path('parallel_worker', render_parallel_worker, batch=True)
+
+
+def pick_timestamps(subs, duration):
+    """挑選具代表性的時間點：前奏、每句開頭的滑動動畫中段、句子中間、句間空白與結尾之後"""
+    times = [0.0]
+    for i, sub in enumerate(subs):
+        start = sub.start.ordinal / 1000.0
+        end = sub.end.ordinal / 1000.0
+        times.append(start + 0.2)
+        times.append((start + end) / 2)
+        if i + 1 < len(subs) and subs[i + 1].start.ordinal - sub.end.ordinal > 500:
+            times.append(end + 0.25)
+    times.append(max(0.0, duration - 0.05))
+    return sorted(set(round(t, 3) for t in times if 0 <= t < duration))
+
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    if mse == 0:
+        return float('inf')
+    return 10 * np.log10(255.0 ** 2 / mse)
+
+
+def ssim(a, b):
+    """以亮度通道計算 SSIM (高斯視窗 sigma=1.5)"""
+    from scipy.ndimage import gaussian_filter
+
+    def luma(img):
+        return img[..., 0] * 0.299 + img[..., 1] * 0.587 + img[..., 2] * 0.114
+
+    x = luma(a.astype(np.float64))
+    y = luma(b.astype(np.float64))
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+
+    mu_x = gaussian_filter(x, 1.5)
+    mu_y = gaussian_filter(y, 1.5)
+    sigma_x = gaussian_filter(x * x, 1.5) - mu_x ** 2
+    sigma_y = gaussian_filter(y * y, 1.5) - mu_y ** 2
+    sigma_xy = gaussian_filter(x * y, 1.5) - mu_x * mu_y
+
+    ssim_map = ((2 * mu_x * mu_y + c1) * (2 * sigma_xy + c2)) / \
+               ((mu_x ** 2 + mu_y ** 2 + c1) * (sigma_x + sigma_y + c2))
+    return float(ssim_map.mean())
+
+
+def compare_frames(reference, candidate):
+    """回傳兩張畫面的差異指標"""
+    diff = np.abs(reference.astype(np.int16) - candidate.astype(np.int16))
+    return {
+        'max_abs_diff': int(diff.max()),
+        'psnr': psnr(reference, candidate),
+        'ssim': ssim(reference, candidate),
+    }
+
+
+def within_tolerance(metrics, max_abs_diff=MAX_ABS_DIFF, min_psnr=MIN_PSNR, min_ssim=MIN_SSIM):
+    return (metrics['max_abs_diff'] <= max_abs_diff
+            and metrics['psnr'] >= min_psnr
+            and metrics['ssim'] >= min_ssim)
+
+
+def render_times(path_name, times):
+    """用指定渲染路徑依序渲染時間點 (每條路徑都從相同的初始狀態開始)"""
+    mmv.reset_render_state()
+    if path_name in BATCH_RENDER_PATHS:
+        return RENDER_PATHS[path_name](times)
+    render = RENDER_PATHS[path_name]()
+    return [render(t) for t in times]
+
+
+def prepare_song(song, tmp_dir, font_path):
+    """產生合成歌曲並載入資源，回傳時間點列表"""
+    audio_path = os.path.join(tmp_dir, f"{song['name']}.wav")
+    srt_path = os.path.join(tmp_dir, f"{song['name']}.srt")
+    generate_audio(audio_path, song['duration'], kind=song['kind'], seed=song['seed'])
+    generate_srt(srt_path, song['duration'], song['lines_per_minute'], song['seed'])
+
+    if not mmv.load_assets(audio_path, srt_path, song_title=song['name'], font_path=font_path, bg_image_path=None):
+        return None
+    return pick_timestamps(mmv.subs, song['duration'])
+
+
+def update_golden(golden_dir, font_path):
+    """用參考路徑重新產生所有黃金畫面"""
+    manifest = {'font_sha256': None, 'pillow': PIL.__version__, 'video_size': list(mmv.VIDEO_SIZE), 'songs': {}}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for song in SYNTHETIC_SONGS:
+            times = prepare_song(song, tmp_dir, font_path)
+            if times is None:
+                return False
+            if manifest['font_sha256'] is None and os.path.exists(mmv.FONT_PATH):
+                manifest['font_sha256'] = file_sha256(mmv.FONT_PATH)
+
+            song_dir = os.path.join(golden_dir, song['name'])
+            os.makedirs(song_dir, exist_ok=True)
+            frames = render_times('reference', times)
+            for t, frame in zip(times, frames):
+                Image.fromarray(frame).save(os.path.join(song_dir, f"{t:09.3f}.png"))
+
+            manifest['songs'][song['name']] = {'song': song, 'times': times}
+            print(f"✓ {song['name']}: 已儲存 {len(times)} 張黃金畫面")
+
+    with open(os.path.join(golden_dir, "manifest.json"), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return True
+
+
+def blank_glyph_failures(chain, texts):
+    """
+    備援字體區段內的空白等不需字形的字元 (INHERIT_CHARS) 不能有墨跡
+    (備援字體子集少了這個字元時會畫成 .notdef 方塊)。回傳 [(字元, 字體檔名), ...]。
+    """
+    failures = []
+    checked = set()
+    for text in texts:
+        for index, run in chain.split_runs(text):
+            if index == 0 or not chain.fonts[index]:
+                continue
+            fonts = chain.fonts[index]
+            for char in set(run) & INHERIT_CHARS:
+                if (char, index) in checked:
+                    continue
+                checked.add((char, index))
+                canvas = Image.new("L", (fonts[0].size * 3, fonts[0].size * 3))
+                ImageDraw.Draw(canvas).text((fonts[0].size, fonts[0].size), char, font=fonts[0], fill=255)
+                if np.asarray(canvas).any():
+                    failures.append((char, os.path.basename(chain.loaded_paths[index] or chain.paths[index])))
+    return failures
+
+
+def check_blank_glyphs(font_path):
+    """以 BLANK_GLYPH_PROBE 建立字體備援鏈，檢查每個字體區段內的空白都不會畫出方塊，回傳失敗數"""
+    mmv.FONT_PATH = font_path if font_path else mmv.find_font_file()
+    with contextlib.redirect_stdout(io.StringIO()):
+        chain = mmv.load_fonts(BLANK_GLYPH_PROBE)
+    if chain is None:
+        return -1
+
+    fallbacks = [os.path.basename(chain.paths[i]) for i, fonts in enumerate(chain.fonts) if i > 0 and fonts]
+    failures = blank_glyph_failures(chain, BLANK_GLYPH_PROBE.split('\n'))
+    if failures:
+        print(f"❌ 空白字元畫出了方塊: " + ", ".join(f"{char!r} ({name})" for char, name in failures))
+    else:
+        used = f"備援字體: {', '.join(fallbacks)}" if fallbacks else "沒有用到備援字體"
+        print(f"✓ 空白字元在各字體區段都沒有墨跡 ({used})")
+    return len(failures)
+
+
+def check_golden(golden_dir, font_path, path_names, tolerances):
+    """比對每條渲染路徑與黃金畫面，回傳失敗數"""
+    with open(os.path.join(golden_dir, "manifest.json"), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    if manifest.get('pillow') != PIL.__version__:
+        print(f"⚠ Pillow 版本不同 (黃金畫面 {manifest.get('pillow')}, 目前 {PIL.__version__})，文字抗鋸齒可能略有差異")
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, entry in manifest['songs'].items():
+            song = entry['song']
+            times = entry['times']
+            if prepare_song(song, tmp_dir, font_path) is None:
+                return -1
+
+            if manifest.get('font_sha256') and os.path.exists(mmv.FONT_PATH) \
+                    and file_sha256(mmv.FONT_PATH) != manifest['font_sha256']:
+                print(f"⚠ 字體檔與產生黃金畫面時不同: {mmv.FONT_PATH}")
+
+            song_dir = os.path.join(golden_dir, name)
+            golden = [np.array(Image.open(os.path.join(song_dir, f"{t:09.3f}.png")).convert("RGB")) for t in times]
+
+            for path_name in path_names:
+                frames = render_times(path_name, times)
+                worst = None
+                bad_times = []
+                for t, ref, frame in zip(times, golden, frames):
+                    metrics = compare_frames(ref, frame)
+                    if worst is None or metrics['ssim'] < worst['ssim']:
+                        worst = dict(metrics, t=t)
+                    if not within_tolerance(metrics, **tolerances):
+                        bad_times.append((t, metrics))
+
+                if bad_times:
+                    failures += len(bad_times)
+                    print(f"❌ {name} / {path_name}: {len(bad_times)}/{len(times)} 張超出容許值")
+                    for t, metrics in bad_times[:5]:
+                        print(f"    t={t:.3f}s max_diff={metrics['max_abs_diff']} "
+                              f"PSNR={metrics['psnr']:.2f} SSIM={metrics['ssim']:.4f}")
+                else:
+                    print(f"✓ {name} / {path_name}: {len(times)} 張通過 "
+                          f"(最差 t={worst['t']:.3f}s PSNR={worst['psnr']:.2f} SSIM={worst['ssim']:.4f})")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="黃金畫面回歸測試")
+    parser.add_argument("--update", action="store_true", help="用參考 make_frame 重新產生黃金畫面")
+    parser.add_argument("--golden-dir", default=GOLDEN_DIR, help="黃金畫面資料夾")
+    parser.add_argument("--font", default=None, help="字體路徑 (預設使用 make_music_videos 的搜尋邏輯)")
+    parser.add_argument("--paths", nargs="*", default=None, help="要比對的渲染路徑 (預設全部)")
+    parser.add_argument("--max-abs-diff", type=int, default=MAX_ABS_DIFF)
+    parser.add_argument("--min-psnr", type=float, default=MIN_PSNR)
+    parser.add_argument("--min-ssim", type=float, default=MIN_SSIM)
+    args = parser.parse_args()
+
+    if args.update:
+        if not update_golden(args.golden_dir, args.font):
+            print("✗ 無法載入字體，黃金畫面未更新")
+            sys.exit(1)
+        print(f"\n✅ 黃金畫面已更新: {args.golden_dir}")
+        return
+
+    path_names = args.paths or list(RENDER_PATHS)
+    unknown = [p for p in path_names if p not in RENDER_PATHS]
+    if unknown:
+        print(f"✗ 未知的渲染路徑: {', '.join(unknown)} (可用: {', '.join(RENDER_PATHS)})")
+        sys.exit(1)
+
+    tolerances = {'max_abs_diff': args.max_abs_diff, 'min_psnr': args.min_psnr, 'min_ssim': args.min_ssim}
+    failures = check_golden(args.golden_dir, args.font, path_names, tolerances)
+    blank_failures = check_blank_glyphs(args.font) if failures >= 0 else -1
+    if failures < 0 or blank_failures < 0:
+        print("✗ 無法載入字體")
+        sys.exit(1)
+    if failures:
+        print(f"\n❌ 共 {failures} 張畫面與黃金畫面不符")
+    if blank_failures:
+        print(f"\n❌ 共 {blank_failures} 個空白字元畫出了方塊")
+    if failures or blank_failures:
+        sys.exit(1)
+    print("\n✅ 所有渲染路徑都與黃金畫面一致")
+
+
+if __name__ == "__main__":
+    main()
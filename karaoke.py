@@ -0,0 +1,234 @@
+"""
+卡拉 OK 逐字填色
+每句歌詞的時長平均分給每個實際發音的字 (與 optimize_lyrics 的 char_time_map 相同的線性插值)，
+當前歌詞的每一行預先渲染成「原色」與「填色」兩張精靈圖，加上一張字元邊界表；
+每幀只需要依進度算出填色的欄位，做一次欄位遮罩的混合。
+
+精靈圖以 out = bg * A + B 的形式混合 (A 為每個像素保留背景的比例，B 為文字貢獻)，
+分別在黑底與白底上各畫一次即可求得，因此混合結果與直接用 PIL 畫在背景上相同 (誤差 1~2 階)。
+精靈圖只保存黑底與白底的 uint8 畫面，A 與 B 在混合時只對用到的範圍計算，
+記憶體只有存 float32 的 A、B 的 3/8，也方便放進共享區給多個渲染行程使用 (見 asset_store)。
+"""
+
+import math
+import re
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+# 不計時的字元 (標點與空白)，與 optimize_lyrics 的清理規則一致
+UNTIMED_CHARS = re.compile(r'[，。、！？：；,.!?:;\s]')
+
+# 次像素位置量化成 1/SUBPIXEL_STEPS px：滑動動畫時每幀的 y 都不同，不量化的話精靈圖永遠無法重用
+SUBPIXEL_STEPS = 4
+
+
+def timed_char_count(text):
+    """回傳需要計時的字數 (去除標點與空白)"""
+    return len(UNTIMED_CHARS.sub('', text))
+
+
+def sung_chars(t, start_sec, end_sec, total_chars):
+    """回傳 t 時刻已唱完的字數 (可為小數)，線性分配句子時長"""
+    if total_chars == 0 or end_sec <= start_sec:
+        return float(total_chars) if t >= start_sec else 0.0
+    progress = (t - start_sec) / (end_sec - start_sec)
+    return min(max(progress, 0.0), 1.0) * total_chars
+
+
+class LineSprite:
+    """一行文字的原色/填色精靈圖與字元邊界表"""
+
+    def __init__(self, draw_text, text, font, spacing, base_passes, high_passes, frac_x, frac_y, layout=None):
+        self.draw_text = draw_text
+        self.text = text
+        if layout is not None:
+            # 與 draw_text 相同的排版 (含備援字體的字寬)
+            char_widths = layout(text, font, spacing).widths
+        else:
+            measure = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+            char_widths = [measure.textlength(char, font=font) for char in text]
+        total_width = sum(char_widths) + (spacing * (len(text) - 1) if len(text) > 1 else 0)
+
+        max_stroke = max(stroke for _, stroke, _ in base_passes + high_passes)
+        pad = int(math.ceil(max_stroke)) + 4
+        self.width = int(math.ceil(total_width)) + 2 * pad
+        self.height = int(font.size * 2) + 2 * pad
+        # 精靈圖內的中心點 (整數部分 + 與實際位置相同的小數部分，確保次像素排版一致)
+        self.center = (self.width // 2, self.height // 2)
+        sx = self.center[0] + frac_x
+        sy = self.center[1] + frac_y
+
+        self.base = self._render(text, font, spacing, base_passes, (sx, sy))
+        self.high = self._render(text, font, spacing, high_passes, (sx, sy))
+
+        # 字元邊界表：第 k 個計時字的左右邊界 (精靈圖座標)
+        lefts, rights = [], []
+        x = sx - total_width / 2
+        for char, w in zip(text, char_widths):
+            if not UNTIMED_CHARS.match(char):
+                lefts.append(x)
+                rights.append(x + w)
+            x += w + spacing
+        self.lefts = np.array(lefts, dtype=np.float32)
+        self.rights = np.array(rights, dtype=np.float32)
+        self.timed_count = len(lefts)
+        self.ink_box = self._ink_box()
+
+    @classmethod
+    def from_arrays(cls, text, center, base, high, lefts, rights):
+        """由已渲染好的 (黑底, 白底) 畫面重建精靈圖 (例如共享區上的唯讀陣列)"""
+        sprite = cls.__new__(cls)
+        sprite.draw_text = None
+        sprite.text = text
+        sprite.height, sprite.width = base[0].shape[:2]
+        sprite.center = center
+        sprite.base = base
+        sprite.high = high
+        sprite.lefts = np.asarray(lefts, dtype=np.float32)
+        sprite.rights = np.asarray(rights, dtype=np.float32)
+        sprite.timed_count = len(sprite.lefts)
+        sprite.ink_box = sprite._ink_box()
+        return sprite
+
+    def _ink_box(self):
+        """
+        有文字的範圍 (left, top, right, bottom)。範圍外黑底為 0、白底為 255 (A = 1, B = 0)，
+        混合後與背景相同，blit 時直接略過。
+        """
+        # 黑底不為 0 或白底不為 255 的位置 (各色版分開看)，先找列再找欄
+        ink = np.zeros((self.height, self.width * 3), dtype=bool)
+        for on_black, on_white in (self.base, self.high):
+            ink |= on_black.reshape(self.height, -1) != 0
+            ink |= on_white.reshape(self.height, -1) != 255
+        rows = np.flatnonzero(ink.any(axis=1))
+        if not rows.size:
+            return (0, 0, 0, 0)
+        top, bottom = int(rows[0]), int(rows[-1]) + 1
+        cols = np.flatnonzero(ink[top:bottom].any(axis=0)) // 3
+        return (int(cols[0]), top, int(cols[-1]) + 1, bottom)
+
+    def _render(self, text, font, spacing, passes, center):
+        """在黑底與白底各畫一次，回傳 (黑底, 白底) 的 RGB uint8 畫面"""
+        layers = []
+        for bg in (0, 255):
+            canvas = Image.new("RGBA", (self.width, self.height), (bg, bg, bg, 255))
+            draw = ImageDraw.Draw(canvas)
+            for fill, stroke_width, stroke_fill in passes:
+                self.draw_text(draw, center, text, font=font, fill=fill, stroke_width=stroke_width,
+                               stroke_fill=stroke_fill, spacing=spacing, anchor="mm")
+            layers.append(np.ascontiguousarray(np.asarray(canvas)[..., :3]))
+        return tuple(layers)
+
+    @staticmethod
+    def _blend_terms(layers, rows, cols):
+        """指定範圍的 (A, B)：A = 黑白底差異 / 255 (三色平均)，B = 黑底畫面"""
+        on_black = layers[0][rows, cols].astype(np.float32)
+        on_white = layers[1][rows, cols].astype(np.float32)
+        keep = ((on_white - on_black) / 255.0).mean(axis=2, keepdims=True)
+        return keep, on_black
+
+    def wipe_x(self, sung):
+        """已唱字數 -> 填色邊界的 x 座標 (精靈圖座標)"""
+        if self.timed_count == 0 or sung <= 0:
+            return 0.0
+        if sung >= self.timed_count:
+            return float(self.width)
+        k = int(sung)
+        return float(self.lefts[k] + (sung - k) * (self.rights[k] - self.lefts[k]))
+
+    def blit(self, img, xy, sung):
+        """
+        把精靈圖畫到 img 上，xy 為文字中心 (與 draw_text_with_spacing 相同)。
+        只處理有文字的範圍；填色邊界左側只需要填色圖、右側只需要原色圖，只有邊界所在的欄位需要混合兩張。
+        """
+        left = int(xy[0]) - self.center[0]
+        top = int(xy[1]) - self.center[1]
+        box_left, box_top, box_right, box_bottom = self.ink_box
+
+        # 文字範圍與畫布相交的部分
+        x0, y0 = max(0, left + box_left), max(0, top + box_top)
+        x1, y1 = min(img.width, left + box_right), min(img.height, top + box_bottom)
+        if x0 >= x1 or y0 >= y1:
+            return
+        sx0, sy0 = x0 - left, y0 - top
+        sx1, sy1 = sx0 + (x1 - x0), sy0 + (y1 - y0)
+        rows = slice(sy0, sy1)
+
+        wipe = self.wipe_x(sung)
+        high_end = min(max(int(math.floor(wipe)), sx0), sx1)
+        base_start = min(max(int(math.ceil(wipe)), sx0), sx1)
+
+        region = img.crop((x0, y0, x1, y1))
+        pixels = np.asarray(region).copy()
+        for layers, c0, c1 in ((self.high, sx0, high_end), (None, high_end, base_start), (self.base, base_start, sx1)):
+            if c0 >= c1:
+                continue
+            cols = slice(c0, c1)
+            if layers is not None:
+                keep, ink = self._blend_terms(layers, rows, cols)
+            else:
+                # 邊界所在欄位按比例混合
+                columns = np.arange(c0, c1, dtype=np.float32) + 0.5
+                weight = np.clip(wipe - columns + 0.5, 0.0, 1.0)[None, :, None]
+                base_keep, base_ink = self._blend_terms(self.base, rows, cols)
+                high_keep, high_ink = self._blend_terms(self.high, rows, cols)
+                keep = base_keep * (1 - weight) + high_keep * weight
+                ink = base_ink * (1 - weight) + high_ink * weight
+            target = pixels[:, c0 - sx0:c1 - sx0, :3]
+            target[...] = np.clip(np.rint(target.astype(np.float32) * keep + ink), 0, 255).astype(np.uint8)
+        img.paste(Image.fromarray(pixels, "RGBA"), (x0, y0))
+
+
+def quantize_position(xy):
+    """把文字中心位置量化到 1/SUBPIXEL_STEPS px"""
+    return tuple(round(v * SUBPIXEL_STEPS) / SUBPIXEL_STEPS for v in xy)
+
+
+class KaraokeRenderer:
+    """
+    依 (文字, 字體, 次像素位置 (量化到 1/SUBPIXEL_STEPS px), 顏色) 快取精靈圖。
+    draw_text 為實際繪製單行文字的函數 (make_music_videos.draw_text_with_spacing)，
+    layout(text, font, spacing) 回傳 draw_text 使用的排版 (字寬)，None 表示全部用 font 量測。
+    """
+
+    def __init__(self, draw_text, max_sprites=64, layout=None):
+        self.draw_text = draw_text
+        self.layout = layout
+        self.max_sprites = max_sprites
+        self.sprites = OrderedDict()
+
+    def get_sprite(self, text, font, spacing, base_passes, high_passes, xy):
+        """xy 應先經過 quantize_position (draw_line 會處理)，否則每個小數位置各建一張精靈圖"""
+        frac_x = math.modf(xy[0])[0]
+        frac_y = math.modf(xy[1])[0]
+        key = (text, id(font), spacing, tuple(base_passes), tuple(high_passes), frac_x, frac_y)
+        sprite = self.sprites.get(key)
+        if sprite is None:
+            sprite = LineSprite(self.draw_text, text, font, spacing, base_passes, high_passes, frac_x, frac_y,
+                                self.layout)
+            self.sprites[key] = sprite
+            if len(self.sprites) > self.max_sprites:
+                self.sprites.popitem(last=False)
+        else:
+            self.sprites.move_to_end(key)
+        return sprite
+
+    def draw_line(self, img, xy, text, font, spacing, base_passes, high_passes, sung):
+        """
+        畫一行帶填色進度的文字，回傳這行的計時字數。
+        passes 為依序繪製的 [(fill, stroke_width, stroke_fill), ...]，與直接繪製時的呼叫相同。
+        """
+        xy = quantize_position(xy)
+        sprite = self.get_sprite(text, font, spacing, base_passes, high_passes, xy)
+        sprite.blit(img, xy, sung)
+        return sprite.timed_count
+
+    def seed(self, key, sprite):
+        """放入事先建立好的精靈圖 (key 與 get_sprite 相同)"""
+        self.sprites[key] = sprite
+        self.max_sprites = max(self.max_sprites, len(self.sprites))
+
+    def clear(self):
+        self.sprites.clear()
@@ -0,0 +1,230 @@
+"""
+歌詞關鍵幀索引
+渲染時把每句歌詞開始的時間點 (間隔至少 min_spacing 秒) 指定給編碼器作為強制關鍵幀 (IDR)，
+編碼完成後直接解析 MP4 的 sample table 找出每個關鍵幀的時間與位元組位置，
+寫成旁邊的 <影片>.keyframes.json：每句歌詞對應到開始時間以前最近的關鍵幀。
+跳到某一句或在句子邊界剪輯時，從該關鍵幀開始即可，不必從很遠的關鍵幀解碼或重新編碼。
+"""
+
+import json
+import os
+import struct
+
+import numpy as np
+
+# 兩個強制關鍵幀之間的最小間隔 (秒)
+KEYFRAME_MIN_SPACING = 1.0
+
+# 只會往下解析的容器 box
+CONTAINER_BOXES = {b'moov', b'trak', b'mdia', b'minf', b'stbl', b'edts'}
+
+
+def lyric_keyframe_times(subs, min_spacing=KEYFRAME_MIN_SPACING):
+    """每句歌詞的開始時間 (秒)，與前一個保留的時間點太近的略過"""
+    times = []
+    for start in sorted(sub.start.ordinal / 1000.0 for sub in subs):
+        if start <= 0:
+            continue
+        if not times or start - times[-1] >= min_spacing:
+            times.append(start)
+    return times
+
+
+def force_keyframe_params(times):
+    """ffmpeg 的強制關鍵幀參數 (強制幀一律為 IDR，才能從該處獨立解碼)"""
+    if not times:
+        return []
+    return ["-force_key_frames", ','.join(f"{t:.3f}" for t in times), "-forced-idr", "1"]
+
+
+def iter_boxes(data, start=0, end=None):
+    """列出 data[start:end] 中的 (box 類型, 內容開始, 內容結束)"""
+    end = len(data) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', data, pos)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            break
+        yield kind, pos + header, pos + size
+        pos += size
+
+
+def find_video_table(data):
+    """回傳影像軌的 {box 類型: (內容開始, 內容結束)} (只含 sample table 相關的 box)"""
+    for kind, start, end in iter_boxes(data):
+        if kind != b'moov':
+            continue
+        for trak_kind, trak_start, trak_end in iter_boxes(data, start, end):
+            if trak_kind != b'trak':
+                continue
+            table = {}
+            stack = [(trak_start, trak_end)]
+            while stack:
+                box_start, box_end = stack.pop()
+                for child, child_start, child_end in iter_boxes(data, box_start, box_end):
+                    if child in CONTAINER_BOXES:
+                        stack.append((child_start, child_end))
+                    else:
+                        table[child] = (child_start, child_end)
+            if b'hdlr' in table and data[table[b'hdlr'][0] + 8:table[b'hdlr'][0] + 12] == b'vide':
+                return table
+    raise ValueError("找不到 MP4 影像軌")
+
+
+def full_box_array(data, box, dtype, fields=1):
+    """讀取 full box (version/flags + entry_count) 後面的 entry 陣列"""
+    start, _ = box
+    count = struct.unpack_from('>I', data, start + 4)[0]
+    return np.frombuffer(data, dtype=dtype, count=count * fields, offset=start + 8).reshape(count, fields)
+
+
+def read_moov(path):
+    """
+    只讀取 MP4 的 moov box (含 box 標頭)，其他頂層 box (mdat 等) 直接跳過不讀，
+    回傳的 bytes 可交給 iter_boxes / find_video_table 解析 (sample 位置仍是整個檔案的位元組位置)。
+    """
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            size, kind = struct.unpack('>I4s', header)
+            header_size = 8
+            if size == 1:
+                header += f.read(8)
+                size = struct.unpack_from('>Q', header, 8)[0]
+                header_size = 16
+            elif size == 0:
+                size = os.fstat(f.fileno()).st_size - f.tell() + header_size
+            if kind == b'moov':
+                return header + f.read(size - header_size)
+            f.seek(size - header_size, os.SEEK_CUR)
+    raise ValueError("找不到 MP4 的 moov")
+
+
+def read_movie_duration(path):
+    """MP4 的總長度 (秒，取自 mvhd)。只讀取 moov，不載入整個檔案"""
+    moov = read_moov(path)
+    for _, start, end in iter_boxes(moov):
+        for child, child_start, _ in iter_boxes(moov, start, end):
+            if child == b'mvhd':
+                if moov[child_start] == 1:
+                    timescale, duration = struct.unpack_from('>IQ', moov, child_start + 20)
+                else:
+                    timescale, duration = struct.unpack_from('>II', moov, child_start + 12)
+                return duration / timescale
+    raise ValueError("找不到 MP4 的 mvhd")
+
+
+def read_video_samples(path):
+    """
+    解析 MP4 影像軌的 sample table，回傳 (顯示時間 秒, 位元組位置, 大小, 是否為關鍵幀) 四個陣列。
+    顯示時間已套用 composition offset (ctts) 與 edit list 的起始偏移。
+    只讀取 moov (sample table 都在裡面)，記憶體用量與影片長度成正比而非檔案大小。
+    """
+    data = read_moov(path)
+    table = find_video_table(data)
+
+    mdhd_start = table[b'mdhd'][0]
+    version = data[mdhd_start]
+    timescale = struct.unpack_from('>I', data, mdhd_start + (20 if version == 1 else 12))[0]
+
+    # 每個 sample 的大小
+    stsz_start = table[b'stsz'][0]
+    uniform_size, sample_count = struct.unpack_from('>II', data, stsz_start + 4)
+    if uniform_size:
+        sizes = np.full(sample_count, uniform_size, dtype=np.int64)
+    else:
+        sizes = np.frombuffer(data, dtype='>u4', count=sample_count, offset=stsz_start + 12).astype(np.int64)
+
+    # 解碼時間 (stts: 連續相同時長的 sample 以 (數量, 時長) 表示)
+    stts = full_box_array(data, table[b'stts'], '>u4', 2).astype(np.int64)
+    durations = np.repeat(stts[:, 1], stts[:, 0])
+    dts = np.concatenate(([0], np.cumsum(durations)[:-1]))
+
+    # 顯示時間 = 解碼時間 + composition offset - edit list 起點
+    pts = dts.copy()
+    if b'ctts' in table:
+        # version 1 為有號數；version 0 的值實際上不會超過 2^31，一律當有號數讀取
+        ctts = full_box_array(data, table[b'ctts'], '>u4', 2)
+        pts += np.repeat(ctts[:, 1].view('>i4').astype(np.int64), ctts[:, 0].astype(np.int64))
+    if b'elst' in table:
+        elst_start = table[b'elst'][0]
+        if data[elst_start] == 1:
+            media_time = struct.unpack_from('>q', data, elst_start + 16)[0]
+        else:
+            media_time = struct.unpack_from('>i', data, elst_start + 12)[0]
+        if media_time > 0:
+            pts -= media_time
+
+    # 每個 chunk 的位置與 sample 數 (stsc 只記錄 sample 數改變的 chunk)
+    if b'co64' in table:
+        chunk_offsets = full_box_array(data, table[b'co64'], '>u8')[:, 0].astype(np.int64)
+    else:
+        chunk_offsets = full_box_array(data, table[b'stco'], '>u4')[:, 0].astype(np.int64)
+    stsc = full_box_array(data, table[b'stsc'], '>u4', 3).astype(np.int64)
+    first_chunks = stsc[:, 0] - 1
+    run_lengths = np.diff(np.append(first_chunks, len(chunk_offsets)))
+    samples_per_chunk = np.repeat(stsc[:, 1], run_lengths)
+
+    # sample 的位置 = 所在 chunk 的位置 + 同一 chunk 內前面 sample 的大小總和
+    chunk_of_sample = np.repeat(np.arange(len(chunk_offsets)), samples_per_chunk)[:sample_count]
+    first_sample = np.cumsum(samples_per_chunk) - samples_per_chunk
+    cumulative = np.concatenate(([0], np.cumsum(sizes)))
+    offsets = chunk_offsets[chunk_of_sample] + cumulative[np.arange(sample_count)] - cumulative[first_sample[chunk_of_sample]]
+
+    keyframes = np.ones(sample_count, dtype=bool)
+    if b'stss' in table:
+        keyframes[:] = False
+        keyframes[full_box_array(data, table[b'stss'], '>u4')[:, 0].astype(np.int64) - 1] = True
+
+    return pts / timescale, offsets, sizes, keyframes
+
+
+def build_keyframe_index(video_path, subs):
+    """建立影片的關鍵幀索引：所有關鍵幀，以及每句歌詞對應的關鍵幀"""
+    times, offsets, _, keyframes = read_video_samples(video_path)
+    key_times = times[keyframes]
+    key_offsets = offsets[keyframes]
+    order = np.argsort(key_times)
+    key_times, key_offsets = key_times[order], key_offsets[order]
+
+    starts = np.array([sub.start.ordinal / 1000.0 for sub in subs])
+    # 強制關鍵幀落在開始時間之後的第一幀，所以往後多找不到一幀的範圍
+    frame_time = np.median(np.diff(np.sort(times))) if len(times) > 1 else 0.0
+    positions = np.clip(np.searchsorted(key_times, starts + frame_time * 0.99, side='right') - 1, 0, len(key_times) - 1)
+
+    lines = []
+    for i, (sub, position) in enumerate(zip(subs, positions)):
+        keyframe_time = float(key_times[position])
+        lines.append({
+            'index': i + 1,
+            'start': sub.start.ordinal / 1000.0,
+            'end': sub.end.ordinal / 1000.0,
+            'text': sub.text.split('\n')[0],
+            'keyframe_time': round(keyframe_time, 3),
+            'byte_offset': int(key_offsets[position]),
+            'exact': bool(abs(keyframe_time - sub.start.ordinal / 1000.0) < frame_time),
+        })
+
+    return {
+        'video': os.path.basename(video_path),
+        'keyframes': [{'time': round(float(t), 3), 'byte_offset': int(offset)}
+                      for t, offset in zip(key_times, key_offsets)],
+        'lines': lines,
+    }
+
+
+def write_keyframe_index(video_path, subs, index_path=None):
+    """寫入 <影片>.keyframes.json，回傳 (索引路徑, 索引內容)"""
+    index = build_keyframe_index(video_path, subs)
+    index_path = index_path or f"{os.path.splitext(video_path)[0]}.keyframes.json"
+    with open(index_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+    return index_path, index
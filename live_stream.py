@@ -0,0 +1,311 @@
+"""
+即時串流輸出
+依牆上時間以 FPS 的節奏送出畫面，與音軌一起由 ffmpeg 封裝成 MPEG-TS 或 FLV，
+寫到標準輸出、具名管道或檔案，可直接接到直播推流或本機的 ffmpeg 接收端。
+渲染執行緒在前面預先渲染少量畫面 (lookahead)；畫面來不及時重送上一幀並跳過已經過期的畫面，
+持續落後時逐級降低畫質 (加大柱子量化單位、每隔幾幀才重新渲染)，追上後再恢復。
+用法:
+  python live_stream.py --audio 歌.mp3 --srt 歌_優化.srt > live.ts
+  python live_stream.py --audio 歌.mp3 --srt 歌_優化.srt --format flv --output /tmp/live.fifo
+  python live_stream.py ... | ffplay -
+"""
+
+import argparse
+import collections
+import contextlib
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+import make_music_videos as mmv
+from ffmpeg_tools import get_ffmpeg_exe
+
+LIVE_PRESET = "veryfast"
+LIVE_BITRATE = "4500k"
+LOOKAHEAD_FRAMES = 15       # 預先渲染的幀數 (0.5 秒)
+STATS_INTERVAL = 5.0        # 印出統計的間隔 (秒)
+
+# 降級等級：(每幾幀重新渲染一次, 判斷畫面相同時的柱子量化單位 px)
+DEGRADE_LEVELS = [(1, mmv.BAR_KEY_STEP), (1, 2.0), (2, 2.0), (3, 4.0)]
+# 每秒檢查一次：來不及的幀超過這個比例就降一級；緩衝區連續幾秒都是滿的就升一級
+DEGRADE_STARVED_RATIO = 0.1
+RECOVER_SECONDS = 3
+
+FORMATS = {
+    'mpegts': ["-f", "mpegts"],
+    'flv': ["-f", "flv", "-flvflags", "no_duration_filesize"],
+}
+
+
+class FrameBuffer:
+    """渲染執行緒與送出迴圈之間的有限緩衝區，存放 (幀號, 畫面)"""
+
+    def __init__(self, capacity):
+        self.capacity = max(1, capacity)
+        self.frames = collections.deque()
+        self.closed = False
+        self._cond = threading.Condition()
+
+    def put(self, index, frame):
+        """放入一幀，緩衝區滿時等待；關閉後回傳 False"""
+        with self._cond:
+            while len(self.frames) >= self.capacity and not self.closed:
+                self._cond.wait()
+            if self.closed:
+                return False
+            self.frames.append((index, frame))
+            self._cond.notify_all()
+            return True
+
+    def take(self, slot):
+        """取出幀號 <= slot 的最新一幀 (較舊的直接丟掉)，沒有時回傳 None"""
+        with self._cond:
+            latest = None
+            while self.frames and self.frames[0][0] <= slot:
+                latest = self.frames.popleft()
+            if latest is not None:
+                self._cond.notify_all()
+            return latest
+
+    def depth(self):
+        with self._cond:
+            return len(self.frames)
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class LiveStats:
+    """即時輸出的統計：送出、重送、來不及、丟棄與延遲"""
+
+    def __init__(self):
+        self.written = 0        # 送出的幀數 (每個時間格一幀)
+        self.rendered = 0       # 實際渲染的幀數
+        self.reused = 0         # 重送上一幀的次數 (降級或來不及)
+        self.starved = 0        # 時間到了緩衝區卻沒有可用畫面的次數
+        self.dropped = 0        # 渲染時已經過期而跳過的幀數
+        self.late = 0           # 送出時間比預定晚超過一幀的次數
+        self.max_late_ms = 0.0
+        self.depth_total = 0
+        self.level = 0
+        self.max_level = 0
+
+    def as_dict(self):
+        return {
+            'written': self.written, 'rendered': self.rendered, 'reused': self.reused,
+            'starved': self.starved, 'dropped': self.dropped, 'late': self.late,
+            'max_late_ms': self.max_late_ms, 'avg_buffer': self.depth_total / max(1, self.written),
+            'level': self.level, 'max_level': self.max_level,
+        }
+
+    def print_line(self, elapsed):
+        print(f"📊 {elapsed:6.1f}s  送出 {self.written}  渲染 {self.rendered}  重送 {self.reused}  "
+              f"來不及 {self.starved}  丟棄 {self.dropped}  延遲 {self.late} (最多 {self.max_late_ms:.0f} ms)  "
+              f"緩衝 {self.depth_total / max(1, self.written):.1f}  降級 {self.level}", file=sys.stderr)
+
+
+class LiveRenderer:
+    """依牆上時間送出畫面的即時輸出"""
+
+    def __init__(self, total_frames, lookahead=LOOKAHEAD_FRAMES):
+        self.total_frames = total_frames
+        self.buffer = FrameBuffer(lookahead)
+        self.stats = LiveStats()
+        self.start_time = None      # 第 0 幀的預定送出時間 (perf_counter)
+        self.stop_event = threading.Event()
+        self._thread = None
+
+    def current_slot(self):
+        """目前牆上時間對應的幀號，開始前為 -1"""
+        if self.start_time is None:
+            return -1
+        return int((time.perf_counter() - self.start_time) * mmv.FPS)
+
+    def set_level(self, level):
+        level = max(0, min(level, len(DEGRADE_LEVELS) - 1))
+        if level != self.stats.level:
+            self.stats.level = level
+            self.stats.max_level = max(self.stats.max_level, level)
+            mmv.BAR_KEY_STEP = DEGRADE_LEVELS[level][1]
+            print(f"{'⚠ 落後，降級' if level else '✓ 已追上，恢復'}到等級 {level} "
+                  f"(每 {DEGRADE_LEVELS[level][0]} 幀渲染一次, 柱子量化 {DEGRADE_LEVELS[level][1]} px)",
+                  file=sys.stderr)
+
+    def _render_loop(self):
+        index = 0
+        while index < self.total_frames and not self.stop_event.is_set():
+            # 已經過了送出時間的幀不必渲染
+            slot = self.current_slot()
+            if index <= slot:
+                self.stats.dropped += slot + 1 - index
+                index = slot + 1
+                if index >= self.total_frames:
+                    break
+            frame = mmv.make_frame_skipping(index / mmv.FPS)
+            self.stats.rendered += 1
+            if not self.buffer.put(index, frame):
+                break
+            index += DEGRADE_LEVELS[self.stats.level][0]
+
+    def start_rendering(self):
+        self._thread = threading.Thread(target=self._render_loop, daemon=True)
+        self._thread.start()
+
+    def prefill(self, timeout=10.0):
+        """開始計時前先填滿緩衝區 (或等到 timeout)"""
+        deadline = time.perf_counter() + timeout
+        while self.buffer.depth() < min(self.buffer.capacity, self.total_frames) and time.perf_counter() < deadline:
+            time.sleep(0.005)
+
+    def run(self, sink):
+        """
+        每個時間格送出一幀給 sink(bytes)：有新畫面就送新的，沒有就重送上一幀。
+        sink 拋出 BrokenPipeError (接收端關閉) 時停止。
+        """
+        w, h = mmv.VIDEO_SIZE
+        last = np.zeros((h, w, 3), dtype=np.uint8)
+        frame_seconds = 1.0 / mmv.FPS
+        window_starved = 0
+        full_seconds = 0
+        next_stats = STATS_INTERVAL
+
+        self.start_time = time.perf_counter()
+        for slot in range(self.total_frames):
+            if self.stop_event.is_set():
+                break
+            deadline = self.start_time + slot * frame_seconds
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+            self.stats.depth_total += self.buffer.depth()
+            item = self.buffer.take(slot)
+            if item is not None and item[0] == slot:
+                last = item[1]
+            else:
+                if item is not None:
+                    last = item[1]
+                self.stats.reused += 1
+                # 降級時本來就每隔幾幀才渲染，只有緩衝區空了才算來不及
+                if self.buffer.depth() == 0 and (item is None or DEGRADE_LEVELS[self.stats.level][0] == 1):
+                    self.stats.starved += 1
+                    window_starved += 1
+
+            sink(last.tobytes())
+            self.stats.written += 1
+            late_ms = (time.perf_counter() - deadline) * 1000
+            self.stats.max_late_ms = max(self.stats.max_late_ms, late_ms)
+            if late_ms > frame_seconds * 1000:
+                self.stats.late += 1
+
+            # 每秒調整一次降級等級
+            if (slot + 1) % mmv.FPS == 0:
+                if window_starved > DEGRADE_STARVED_RATIO * mmv.FPS:
+                    self.set_level(self.stats.level + 1)
+                    full_seconds = 0
+                elif self.buffer.depth() >= self.buffer.capacity - DEGRADE_LEVELS[self.stats.level][0]:
+                    full_seconds += 1
+                    if full_seconds >= RECOVER_SECONDS and self.stats.level > 0:
+                        self.set_level(self.stats.level - 1)
+                        full_seconds = 0
+                else:
+                    full_seconds = 0
+                window_starved = 0
+
+            elapsed = time.perf_counter() - self.start_time
+            if elapsed >= next_stats:
+                self.stats.print_line(elapsed)
+                next_stats += STATS_INTERVAL
+
+    def stop(self):
+        self.stop_event.set()
+        self.buffer.close()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+
+def ffmpeg_command(audio_file, output, fmt, seconds=None):
+    """原始 RGB 畫面 (標準輸入) + 音訊檔 -> 低延遲 H.264/AAC 的 MPEG-TS 或 FLV"""
+    w, h = mmv.VIDEO_SIZE
+    bitrate = int(LIVE_BITRATE.rstrip('k'))
+    cmd = [
+        get_ffmpeg_exe(), "-y", "-loglevel", "error",
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{w}x{h}", "-r", str(mmv.FPS), "-i", "pipe:0",
+        "-i", audio_file,
+        "-map", "0:v", "-map", "1:a",
+        "-c:v", "libx264", "-preset", LIVE_PRESET, "-tune", "zerolatency", "-pix_fmt", "yuv420p",
+        "-b:v", LIVE_BITRATE, "-maxrate", LIVE_BITRATE, "-bufsize", f"{bitrate * 2}k", "-g", str(mmv.FPS * 2),
+        "-c:a", "aac", "-b:a", "192k",
+        "-shortest",
+    ]
+    if seconds is not None:
+        cmd += ["-t", f"{seconds:.3f}"]
+    return cmd + FORMATS[fmt] + ["pipe:1" if output == "-" else output]
+
+
+def stream_live(audio_file, srt_file, output="-", fmt="mpegts", seconds=None, lookahead=LOOKAHEAD_FRAMES,
+                font_path=None):
+    """
+    載入資源後即時輸出到 output ("-" = 標準輸出)，回傳統計字典；載入失敗回傳 None。
+    標準輸出是影音串流，所以所有訊息都印到標準錯誤。
+    """
+    with contextlib.redirect_stdout(sys.stderr):
+        if not mmv.load_assets(audio_file, srt_file, font_path=font_path):
+            return None
+
+        duration = mmv.DURATION if seconds is None else min(seconds, mmv.DURATION)
+        total_frames = int(duration * mmv.FPS)
+        renderer = LiveRenderer(total_frames, lookahead)
+        print(f"📡 即時輸出: {fmt} → {'標準輸出' if output == '-' else output} "
+              f"({duration:.1f} 秒, {mmv.FPS} fps, 預先渲染 {lookahead} 幀)")
+
+        renderer.start_rendering()
+        renderer.prefill()
+        proc = subprocess.Popen(ffmpeg_command(audio_file, output, fmt, duration), stdin=subprocess.PIPE)
+
+        def sink(data):
+            proc.stdin.write(data)
+
+        original_step = mmv.BAR_KEY_STEP
+        try:
+            renderer.run(sink)
+        except (BrokenPipeError, OSError) as e:
+            print(f"⚠ 接收端已關閉 ({e})，停止輸出")
+        except KeyboardInterrupt:
+            print("⚠ 使用者中斷，停止輸出")
+        finally:
+            renderer.stop()
+            mmv.BAR_KEY_STEP = original_step
+            with contextlib.suppress(OSError):
+                proc.stdin.close()
+            proc.wait()
+
+        stats = renderer.stats.as_dict()
+        renderer.stats.print_line(time.perf_counter() - renderer.start_time)
+        print(f"✅ 即時輸出結束 (ffmpeg return code {proc.returncode})")
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="即時串流輸出 (依牆上時間送出畫面，MPEG-TS / FLV)")
+    parser.add_argument("--audio", required=True, help="音樂檔案")
+    parser.add_argument("--srt", required=True, help="SRT 歌詞")
+    parser.add_argument("--output", default="-", help="輸出：- (標準輸出)、具名管道或檔案")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="mpegts", help="封裝格式")
+    parser.add_argument("--seconds", type=float, default=None, help="只輸出前幾秒 (測試用)")
+    parser.add_argument("--lookahead", type=int, default=LOOKAHEAD_FRAMES, help="預先渲染的幀數")
+    parser.add_argument("--font", default=None, help="字體路徑 (預設使用 make_music_videos 的搜尋邏輯)")
+    args = parser.parse_args()
+
+    stats = stream_live(args.audio, args.srt, args.output, args.format, args.seconds, args.lookahead, args.font)
+    if stats is None:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
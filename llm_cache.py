@@ -0,0 +1,183 @@
+"""
+LLM 回應的本地快取 (SQLite)
+以 (API 端點, 模型, prompt 雜湊, temperature) 為鍵儲存完整的回應 JSON，
+重新處理同一首歌時直接讀取，不必再等模型。
+- 同一次執行中相同的請求只送一次 (進行中的相同請求會等待第一個完成)
+- 資料庫超過大小上限時，依最後使用時間淘汰最舊的回應
+  (總大小記在單列的 cache_stats 表，與新增/刪除在同一個交易中更新，不必每次加總整個表)
+- 記錄命中/未命中次數
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+MB = 1024 * 1024
+
+
+def request_key(endpoint, model, messages, temperature, max_tokens=None):
+    """計算請求的快取鍵"""
+    prompt = json.dumps({'messages': messages, 'max_tokens': max_tokens}, ensure_ascii=False, sort_keys=True)
+    prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+    raw = json.dumps([endpoint, model, prompt_hash, round(float(temperature), 4)])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    """SQLite 回應快取，可在多個執行緒間共用；多個行程共用同一個檔案也安全"""
+
+    def __init__(self, path, max_mb=256):
+        self.path = path
+        self.max_bytes = int(max_mb * MB)
+        self._lock = threading.Lock()
+        self._memory = {}     # 本次執行已取得的回應
+        self._pending = {}    # 進行中的請求: key -> threading.Event
+        self.hits = 0
+        self.dedup_hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                endpoint TEXT,
+                model TEXT,
+                temperature REAL,
+                response TEXT,
+                size INTEGER,
+                created REAL,
+                last_used REAL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON responses(last_used)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS cache_stats (id INTEGER PRIMARY KEY CHECK (id = 0), total_size INTEGER)")
+        # 舊版資料庫沒有計數表：加總一次作為起點
+        self._db.execute("INSERT OR IGNORE INTO cache_stats SELECT 0, COALESCE(SUM(size), 0) FROM responses")
+        self._db.commit()
+
+    def get(self, key):
+        """查詢快取，沒有時回傳 None (計為未命中)"""
+        with self._lock:
+            if key in self._memory:
+                self.dedup_hits += 1
+                return self._memory[key]
+            response = self._load(key)
+            if response is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._memory[key] = response
+            return response
+
+    def put(self, key, response, endpoint="", model="", temperature=0.0):
+        """存入一筆回應"""
+        with self._lock:
+            self._memory[key] = response
+            self._store(key, response, endpoint, model, temperature)
+
+    def get_or_fetch(self, key, fetch, endpoint="", model="", temperature=0.0):
+        """
+        有快取就直接回傳，否則呼叫 fetch() 取得回應並存入快取。
+        同一個 key 同時只會有一個 fetch() 在執行，其他呼叫等待它的結果。
+        """
+        while True:
+            with self._lock:
+                if key in self._memory:
+                    self.dedup_hits += 1
+                    return self._memory[key]
+                event = self._pending.get(key)
+                if event is None:
+                    response = self._load(key)
+                    if response is not None:
+                        self.hits += 1
+                        self._memory[key] = response
+                        return response
+                    self.misses += 1
+                    event = self._pending[key] = threading.Event()
+                    owner = True
+                else:
+                    owner = False
+
+            if not owner:
+                # 等待進行中的相同請求；若它失敗，重新嘗試自己送出
+                event.wait()
+                continue
+
+            try:
+                response = fetch()
+                with self._lock:
+                    self._memory[key] = response
+                    self._store(key, response, endpoint, model, temperature)
+                return response
+            finally:
+                with self._lock:
+                    self._pending.pop(key, None)
+                event.set()
+
+    def _load(self, key):
+        row = self._db.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self._db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        self._db.commit()
+        return json.loads(row[0])
+
+    def _total_size(self):
+        return self._db.execute("SELECT total_size FROM cache_stats WHERE id = 0").fetchone()[0]
+
+    def _store(self, key, response, endpoint, model, temperature):
+        text = json.dumps(response, ensure_ascii=False)
+        size = len(text.encode('utf-8'))
+        now = time.time()
+        # 取代舊回應時扣掉舊的大小；IMMEDIATE 交易讓其他行程不會在中間插入
+        self._db.execute("BEGIN IMMEDIATE")
+        row = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        self._db.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, endpoint, model, temperature, text, size, now, now)
+        )
+        self._db.execute("UPDATE cache_stats SET total_size = total_size + ? WHERE id = 0",
+                         (size - (row[0] if row else 0),))
+        self._db.commit()
+        self._evict()
+
+    def _evict(self):
+        """超過大小上限時淘汰最久沒用到的回應，直到降到上限的 90%"""
+        if self._total_size() <= self.max_bytes:
+            return
+        self._db.execute("BEGIN IMMEDIATE")
+        total = self._total_size()
+        target = self.max_bytes * 0.9
+        removed = []
+        freed = 0
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY last_used ASC"):
+            if total - freed <= target:
+                break
+            removed.append((key,))
+            freed += size
+        self._db.executemany("DELETE FROM responses WHERE key = ?", removed)
+        self._db.execute("UPDATE cache_stats SET total_size = total_size - ? WHERE id = 0", (freed,))
+        self._db.commit()
+        self.evicted += len(removed)
+
+    def size_mb(self):
+        with self._lock:
+            total = self._total_size()
+            count = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return total / MB, count
+
+    def print_stats(self):
+        size_mb, count = self.size_mb()
+        print(f"💾 LLM 快取: 命中 {self.hits} 次, 本次重複 {self.dedup_hits} 次, 未命中 {self.misses} 次, "
+              f"淘汰 {self.evicted} 筆 ({count} 筆, {size_mb:.1f} MB / {self.max_bytes / MB:.0f} MB)")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
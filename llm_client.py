@@ -0,0 +1,237 @@
+"""
+本地 LLM (OpenAI 相容 API) 用戶端
+- 共用一個 requests.Session 連線池，避免每個請求重新建立連線
+- 同時進行中的請求數受 max_concurrency 限制 (多個工作共用同一個用戶端即共用上限)
+- 連線錯誤、逾時、429 與 5xx 以指數退避重試
+- 記錄每個請求的延遲、token 用量與重試次數，最後可印出統計
+- 可搭配 llm_cache.LLMCache，相同的請求直接讀取快取
+- chat_stream 以 SSE 串流接收回應，邊收邊產生文字片段
+"""
+
+import json
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from llm_cache import request_key
+
+# 需要重試的 HTTP 狀態碼
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    """API 回應非 200 (重試後仍失敗) 或回應格式不正確"""
+
+    def __init__(self, message, status_code=None, body=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.body = body
+
+
+def percentile(values, q):
+    """簡單的百分位數 (最近秩)，values 為空時回傳 0"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, math.ceil(q / 100.0 * len(ordered)) - 1))
+    return ordered[k]
+
+
+class LLMClient:
+    """OpenAI 相容 /chat/completions 用戶端，可在多個執行緒間共用"""
+
+    def __init__(self, api_url, max_concurrency=4, max_retries=3, backoff_base=0.5, backoff_max=8.0, cache=None,
+                 slots=None):
+        """
+        slots 可傳入外部的 semaphore (例如 multiprocessing.Manager().BoundedSemaphore)，
+        讓多個行程的用戶端共用同一個進行中請求上限；未指定時依 max_concurrency 建立。
+        """
+        self.api_url = api_url.rstrip('/')
+        self.cache = cache
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+
+        self._slots = slots if slots is not None else threading.BoundedSemaphore(self.max_concurrency)
+        self._lock = threading.Lock()
+        self.latencies = {}   # model -> [每個成功請求的延遲 (秒)]
+        self.usage = {}       # model -> {'prompt_tokens': ..., 'completion_tokens': ...}
+        self.retries = 0
+        self.failures = 0
+
+    def _backoff(self, attempt):
+        """第 attempt 次重試前的等待時間 (指數退避加隨機抖動)"""
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay * (0.5 + random.random() / 2)
+
+    def _record(self, model, latency=None, retried=0, failed=False, usage=None):
+        with self._lock:
+            if latency is not None:
+                self.latencies.setdefault(model, []).append(latency)
+            if isinstance(usage, dict):
+                totals = self.usage.setdefault(model, {'prompt_tokens': 0, 'completion_tokens': 0})
+                for key in totals:
+                    totals[key] += usage.get(key) or 0
+            self.retries += retried
+            if failed:
+                self.failures += 1
+
+    def chat(self, model, messages, temperature=0.7, max_tokens=None, timeout=30):
+        """
+        送出一次 chat completion，回傳完整的回應 JSON (有快取時優先讀取快取)。
+        重試用完仍是連線錯誤時拋出原本的 requests 例外，HTTP 錯誤則拋出 LLMError。
+        """
+        payload = {"model": model, "messages": messages, "temperature": temperature}
+        if max_tokens is not None:
+            payload["max_tokens"] = max_tokens
+
+        if self.cache is None:
+            return self._request(model, payload, timeout)
+        key = request_key(self.api_url, model, messages, temperature, max_tokens)
+        return self.cache.get_or_fetch(key, lambda: self._request(model, payload, timeout),
+                                       endpoint=self.api_url, model=model, temperature=temperature)
+
+    def _post(self, model, payload, timeout, stream=False):
+        """
+        送出請求，失敗時依設定重試 (呼叫端需已取得併發名額)。
+        回傳 (狀態 200 的 response, 重試次數, 最後一次送出的時間)
+        """
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                response = self.session.post(f"{self.api_url}/chat/completions", json=payload,
+                                             timeout=timeout, stream=stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = e
+            else:
+                if response.status_code == 200:
+                    return response, attempt, start
+                error = LLMError(f"API 請求失敗: {response.status_code}", response.status_code, response.text)
+                response.close()
+                if response.status_code not in RETRY_STATUS:
+                    self._record(model, retried=attempt, failed=True)
+                    raise error
+
+            if attempt >= self.max_retries:
+                self._record(model, retried=attempt, failed=True)
+                raise error
+            time.sleep(self._backoff(attempt))
+            attempt += 1
+
+    def _request(self, model, payload, timeout):
+        """送出一般 (非串流) 請求，回傳回應 JSON"""
+        with self._slots:
+            response, attempt, start = self._post(model, payload, timeout)
+            try:
+                result = response.json()
+            except ValueError:
+                self._record(model, retried=attempt, failed=True)
+                raise LLMError("API 回應不是 JSON", response.status_code, response.text)
+            self._record(model, time.perf_counter() - start, retried=attempt, usage=result.get('usage'))
+            return result
+
+    def chat_stream(self, model, messages, temperature=0.7, max_tokens=None, timeout=60):
+        """
+        以 SSE 串流送出 chat completion，逐段 yield 回應文字。
+        快取命中時一次 yield 完整內容；串流完成後把完整回應存入快取 (與 chat 共用同一個鍵)。
+        只有在收到第一段內容之前的失敗會重試。
+        """
+        payload = {"model": model, "messages": messages, "temperature": temperature, "stream": True}
+        if max_tokens is not None:
+            payload["max_tokens"] = max_tokens
+
+        key = None
+        if self.cache is not None:
+            key = request_key(self.api_url, model, messages, temperature, max_tokens)
+            cached = self.cache.get(key)
+            if cached is not None:
+                yield cached['choices'][0]['message']['content']
+                return
+
+        parts = []
+        usage = None
+        with self._slots:
+            response, attempt, start = self._post(model, payload, timeout, stream=True)
+            try:
+                for raw_line in response.iter_lines():
+                    line = raw_line.decode('utf-8').strip()
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    usage = chunk.get('usage') or usage
+                    for choice in chunk.get('choices') or []:
+                        delta = (choice.get('delta') or {}).get('content')
+                        if delta:
+                            parts.append(delta)
+                            yield delta
+            except (requests.exceptions.RequestException, ValueError) as e:
+                self._record(model, retried=attempt, failed=True)
+                raise LLMError(f"串流中斷: {e}")
+            finally:
+                response.close()
+            self._record(model, time.perf_counter() - start, retried=attempt, usage=usage)
+
+        if key is not None:
+            result = {"choices": [{"message": {"role": "assistant", "content": "".join(parts)}}], "usage": usage}
+            self.cache.put(key, result, endpoint=self.api_url, model=model, temperature=temperature)
+
+    def chat_text(self, model, messages, **kwargs):
+        """送出 chat completion 並只回傳第一個選項的文字內容"""
+        result = self.chat(model, messages, **kwargs)
+        try:
+            return result['choices'][0]['message']['content']
+        except (KeyError, IndexError, TypeError):
+            raise LLMError("API 回應缺少 choices[0].message.content", body=result)
+
+    def map(self, func, items):
+        """
+        以最多 max_concurrency 個執行緒對 items 呼叫 func，結果依原本順序回傳。
+        func 拋出的例外會原樣放進結果列表，由呼叫端決定如何處理。
+        """
+        def run(item):
+            try:
+                return func(item)
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            return list(executor.map(run, items))
+
+    def print_stats(self):
+        """印出每個模型的請求延遲統計"""
+        with self._lock:
+            latencies = {model: list(values) for model, values in self.latencies.items()}
+            usage = {model: dict(totals) for model, totals in self.usage.items()}
+            retries, failures = self.retries, self.failures
+
+        if self.cache is not None:
+            self.cache.print_stats()
+        if not latencies and not failures:
+            return
+        print(f"\n📊 LLM 請求統計 (併發上限 {self.max_concurrency}):")
+        for model, values in latencies.items():
+            print(f"  {model}: {len(values)} 次, 平均 {sum(values) / len(values):.2f}s, "
+                  f"p50 {percentile(values, 50):.2f}s, p95 {percentile(values, 95):.2f}s, "
+                  f"最長 {max(values):.2f}s, 累計 {sum(values):.1f}s")
+            if model in usage:
+                print(f"    tokens: 輸入 {usage[model]['prompt_tokens']}, 輸出 {usage[model]['completion_tokens']}")
+        print(f"  重試 {retries} 次, 失敗 {failures} 次")
+
+    def close(self):
+        self.session.close()
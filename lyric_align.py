@@ -0,0 +1,190 @@
+"""
+歌詞時間對齊
+把原始 SRT 的每個字依句子時長線性分配時間，存成 NumPy 陣列 (字碼、開始、結束、所屬句子)；
+重新斷句後的歌詞去掉標點後，以帶狀 (banded) 編輯距離與原始字串對齊，
+再由每句對齊到的第一個與最後一個原始字決定時間。
+模型漏字、多字或改字只影響附近幾個字，不會讓後面所有句子的時間跟著位移。
+"""
+
+import re
+
+import numpy as np
+
+# 不計時的字元 (標點與空白)
+UNTIMED_CHARS = re.compile(r'[，。、！？：；\s]')
+
+# 帶狀對齊的半寬：至少 MIN_BAND 字、較長字串的 BAND_RATIO 倍，以及兩者長度差再加 MIN_BAND
+# (整段副歌被刪掉或回覆被截斷時，長度差集中在一處，路徑會偏離對角線整個長度差)
+MIN_BAND = 64
+BAND_RATIO = 0.05
+
+# 找不到任何對應字的句子使用的時長 (毫秒)
+UNMATCHED_DURATION = 2000
+# 對齊後時長不足時的最短時長 (毫秒)
+MIN_DURATION = 500
+
+DIAG, UP, LEFT = 0, 1, 2
+INF = 1 << 29
+
+
+def clean_text(text):
+    """去除換行、標點與空白，只保留實際歌詞文字"""
+    return UNTIMED_CHARS.sub('', text.replace('\n', ''))
+
+
+def to_codes(text):
+    """字串 -> Unicode 字碼陣列"""
+    return np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.int32)
+
+
+def band_half_width(m, n):
+    return max(MIN_BAND, int(BAND_RATIO * max(m, n)), abs(n - m) + MIN_BAND)
+
+
+def align_chars(target, source, band=None):
+    """
+    以帶狀編輯距離把 target 對齊到 source (兩者皆為字碼陣列)。
+    每一列 (target 的一個字) 只計算對角線附近 2 * band + 1 個欄位，
+    同一列內的插入以累積最小值一次算完，整體為 O(len(target) * band)。
+    回溯路徑碰到帶狀邊緣時 (最佳路徑可能在帶外)，加倍帶寬重算，最後退回完整的編輯距離。
+    回傳長度 len(target) 的陣列：每個字對應的 source 索引 (相同或替換)，多出來的字為 -1。
+    """
+    m, n = len(target), len(source)
+    if m == 0 or n == 0:
+        return np.full(m, -1, dtype=np.int64)
+
+    half = band or band_half_width(m, n)
+    while True:
+        matched, touched_edge = _align_band(target, source, half)
+        if not touched_edge or 2 * half + 1 >= n + 1:
+            return matched
+        half *= 2
+
+
+def _align_band(target, source, half):
+    """帶狀編輯距離，回傳 (對應索引, 回溯路徑是否碰到帶狀邊緣)"""
+    m, n = len(target), len(source)
+    matched = np.full(m, -1, dtype=np.int64)
+    width = min(n + 1, 2 * half + 1)
+    centers = np.round(np.arange(m + 1) * (n / m)).astype(np.int64)
+    lows = np.clip(centers - half, 0, n + 1 - width)
+
+    moves = np.empty((m + 1, width), dtype=np.int8)
+    row = np.full(n + 1, INF, dtype=np.int32)
+    lo = lows[0]
+    row[lo:lo + width] = np.arange(lo, lo + width)
+    moves[0] = LEFT
+    prev_lo = lo
+
+    for i in range(1, m + 1):
+        lo = lows[i]
+        hi = lo + width
+        cols = np.arange(lo, hi, dtype=np.int32)
+
+        diag = np.full(width, INF, dtype=np.int32)
+        j0 = max(lo, 1)
+        diag[j0 - lo:] = row[j0 - 1:hi - 1] + (source[j0 - 1:hi - 1] != target[i - 1])
+        up = row[lo:hi] + 1
+
+        best = np.minimum(diag, up)
+        move = np.where(diag <= up, DIAG, UP).astype(np.int8)
+        # 同一列往右的插入：D[j] = min_k<=j (best[k] + j - k)
+        current = np.minimum.accumulate(best - cols) + cols
+        move[current < best] = LEFT
+        moves[i] = move
+
+        row[prev_lo:prev_lo + width] = INF
+        row[lo:hi] = np.minimum(current, INF)
+        prev_lo = lo
+
+    # 從右下角回溯 (帶狀邊緣不是矩陣邊界時，代表路徑被帶寬限制住)
+    touched_edge = False
+    i, j = m, n
+    while i > 0:
+        col = j - lows[i]
+        if (col == 0 and lows[i] > 0) or (col == width - 1 and lows[i] + width - 1 < n):
+            touched_edge = True
+        move = moves[i, col]
+        if move == DIAG:
+            matched[i - 1] = j - 1
+            i -= 1
+            j -= 1
+        elif move == UP:
+            i -= 1
+        else:
+            j -= 1
+    return matched, touched_edge
+
+
+class CharTimeline:
+    """原始 SRT 每個字的時間 (毫秒)，以陣列儲存"""
+
+    def __init__(self, subs):
+        texts = [clean_text(sub.text.strip()) for sub in subs]
+        counts = np.array([len(text) for text in texts], dtype=np.int64)
+        sub_starts = np.array([sub.start.ordinal for sub in subs], dtype=np.int64)
+        sub_ends = np.array([sub.end.ordinal for sub in subs], dtype=np.int64)
+
+        self.codes = to_codes(''.join(texts))
+        self.sub_first = np.cumsum(counts) - counts
+        self.sub_counts = counts
+        self.sub_starts = sub_starts
+        self.sub_ends = sub_ends
+        self.sub_index = np.repeat(np.arange(len(subs)), counts)
+
+        # 每個字在句子中的位置，時長線性分配 (與逐字計算 int(duration * i / n) 相同)
+        position = np.arange(len(self.codes)) - np.repeat(self.sub_first, counts)
+        total = np.repeat(np.maximum(counts, 1), counts)
+        duration = np.repeat(sub_ends - sub_starts, counts)
+        base = np.repeat(sub_starts, counts)
+        self.starts = base + duration * position // total
+        self.ends = base + duration * (position + 1) // total
+
+    def __len__(self):
+        return len(self.codes)
+
+    def assign(self, lines):
+        """
+        為每句歌詞分配時間，回傳 ([(start_ms, end_ms, 類型), ...], 對齊統計)。
+        類型: 'exact' 剛好對應一句完整的原始歌詞、'aligned' 由對齊結果決定、'unmatched' 找不到對應的字。
+        """
+        line_codes = [to_codes(clean_text(line)) for line in lines]
+        lengths = np.array([len(codes) for codes in line_codes], dtype=np.int64)
+        target = np.concatenate(line_codes) if line_codes else np.empty(0, dtype=np.int32)
+        matched = align_chars(target, self.codes)
+
+        hit = matched >= 0
+        same = int(np.count_nonzero(target[hit] == self.codes[matched[hit]]))
+        stats = {
+            'same': same,
+            'substituted': int(np.count_nonzero(hit)) - same,
+            'inserted': int(np.count_nonzero(~hit)),
+            'deleted': len(self.codes) - int(np.count_nonzero(hit)),
+        }
+
+        results = []
+        prev_end = int(self.sub_starts[0]) if len(self.sub_starts) else 0
+        offsets = np.cumsum(lengths) - lengths
+        for offset, length in zip(offsets, lengths):
+            segment = matched[offset:offset + length]
+            hits = segment[segment >= 0]
+            if len(hits) == 0:
+                start = prev_end
+                end = start + UNMATCHED_DURATION
+                kind = 'unmatched'
+            else:
+                first, last = int(hits[0]), int(hits[-1])
+                start = int(self.starts[first])
+                end = int(self.ends[last])
+                sub = self.sub_index[first]
+                kind = 'aligned'
+                if (self.sub_index[last] == sub and first == self.sub_first[sub]
+                        and last - first + 1 == self.sub_counts[sub] == length
+                        and np.array_equal(target[offset:offset + length], self.codes[first:last + 1])):
+                    start, end = int(self.sub_starts[sub]), int(self.sub_ends[sub])
+                    kind = 'exact'
+                if end <= start:
+                    end = start + MIN_DURATION
+            results.append((start, end, kind))
+            prev_end = end
+        return results, stats
@@ -6,147 +6,323 @@ from PIL import Image, ImageDraw, ImageFont, ImageFile
 from tkinter import Tk, filedialog
 import os
 import glob
+import json
+import time
 import traceback
 
-# ================= 設定區 =================
-# 使用檔案選擇對話框
-print("請選擇檔案...")
-
-# 初始化 tkinter（隱藏主視窗）
-root = Tk()
-root.withdraw()
-root.attributes('-topmost', True)
-root.lift()
-root.focus_force()
-
-# 選擇音樂檔案
-print("\n1. 請選擇音樂檔案 (MP3)")
-AUDIO_FILE = filedialog.askopenfilename(
-    parent=root,
-    title="選擇音樂檔案",
-    filetypes=[("音樂檔案", "*.mp3 *.wav *.m4a"), ("所有檔案", "*.*")]
-)
-
-if not AUDIO_FILE:
-    print("未選擇音樂檔案，程式結束")
-    exit()
-
-print(f"已選擇音樂: {os.path.basename(AUDIO_FILE)}")
-
-# 選擇歌詞檔案
-print("\n2. 請選擇歌詞檔案 (SRT)")
-SRT_FILE = filedialog.askopenfilename(
-    parent=root,
-    title="選擇歌詞檔案",
-    filetypes=[("字幕檔案", "*.srt"), ("所有檔案", "*.*")]
-)
-
-if not SRT_FILE:
-    print("未選擇歌詞檔案，程式結束")
-    exit()
-
-print(f"已選擇歌詞: {os.path.basename(SRT_FILE)}")
+import bar_features
+import font_fallback
+import keyframe_index
+import telemetry
+from background_source import StaticBackground, VideoBackground
+from karaoke import KaraokeRenderer, sung_chars, timed_char_count
+from memory_budget import MemoryTracker, plan_memory, print_estimate, LOW_MEMORY_LOOKAHEAD, STREAM_BLOCK_FRAMES
 
+# ================= 設定區 =================
 # 指定目標字體名稱 (優先使用修復版)
 TARGET_FONT_NAME = "ChenYuluoyan-2.0-Thin_fixed.ttf"
 ORIGINAL_FONT_NAME = "ChenYuluoyan-2.0-Thin.ttf"
 
-# 定義搜尋路徑
-search_paths = [
-    # 1. 專案目錄 (Fixed)
-    os.path.join(os.path.dirname(__file__), TARGET_FONT_NAME),
-    # 2. 專案目錄 (Original - if fixed doesn't exist yet but we will try to find fixed first)
-    os.path.join(os.path.dirname(__file__), ORIGINAL_FONT_NAME),
-    # 3. 系統字體目錄
-    os.path.join(os.environ.get("SystemRoot", r"C:\Windows"), "Fonts", TARGET_FONT_NAME),
-    os.path.join(os.environ.get("SystemRoot", r"C:\Windows"), "Fonts", ORIGINAL_FONT_NAME),
-    # 4. 使用者字體目錄
-    os.path.join(os.environ.get("LOCALAPPDATA", ""), r"Microsoft\Windows\Fonts", TARGET_FONT_NAME),
-    os.path.join(os.environ.get("LOCALAPPDATA", ""), r"Microsoft\Windows\Fonts", ORIGINAL_FONT_NAME)
-]
-
-FONT_FILE = None
-# 嘗試在已知路徑尋找
-for path in search_paths:
-    if os.path.exists(path):
-        FONT_FILE = path
-        print(f"\n找到字體: {FONT_FILE}")
-        # 如果找到的是修復版，直接停止搜尋
-        if "fixed" in os.path.basename(path):
-            break
-
-# 如果還沒產生 fixed 檔，但找到了原檔，會繼續執行，但後面可能會報錯
-# 在這裡我們不強制要求一定是 fixed，因為之前的修復腳本是外部執行的
-# 但為了確保穩定，我們可以加上自動修復提示
-
-
-if FONT_FILE:
-    print(f"\n使用指定字體: {FONT_FILE}")
-else:
-    # 如果找不到路徑，嘗試直接使用檔名（讓系統去尋找安裝的字體）
-    print(f"\n在資料夾中未找到 {TARGET_FONT_NAME}，嘗試直接呼叫系統已安裝字體...")
-    FONT_FILE = TARGET_FONT_NAME
-
-# 自動使用音檔名稱作為歌曲名稱
-SONG_TITLE = os.path.splitext(os.path.basename(AUDIO_FILE))[0]
-print(f"歌曲名稱: {SONG_TITLE}")
-
-# 選擇輸出位置
-print("\n3. 請選擇影片輸出位置")
-OUTPUT_FILE = filedialog.asksaveasfilename(
-    parent=root,
-    title="儲存影片",
-    defaultextension=".mp4",
-    filetypes=[("MP4 影片", "*.mp4"), ("所有檔案", "*.*")],
-    initialfile=f"{SONG_TITLE}.mp4"
-)
-
-if not OUTPUT_FILE:
-    OUTPUT_FILE = f"{SONG_TITLE}.mp4"
-    print(f"使用預設輸出檔名: {OUTPUT_FILE}")
-else:
-    print(f"輸出檔案: {os.path.basename(OUTPUT_FILE)}")
-
-root.destroy()
-
-FONT_PATH = FONT_FILE if FONT_FILE else TARGET_FONT_NAME
-
 VIDEO_SIZE = (1920, 1080)     # 影片解析度 (1080p)
 FPS = 30                      # 每秒幾格
 BAR_COUNT = 120               # 畫面要有幾根音頻柱子
 BAR_COLOR = (90, 90, 173)     # 柱子顏色 #5A5AAD
+BAR_SCALE = "log"             # 柱子頻率刻度："log" 對數頻帶、"mel" Mel 頻帶、"linear" 舊版 (只取最低 100 個頻率點)
+BAR_DB_RANGE = 60.0           # 柱子從零到滿格的分貝範圍 (每首歌以自己的音量正規化)
+BAR_ATTACK = 0.02             # 柱子上升時間常數 (秒)
+BAR_RELEASE = 0.25            # 柱子下降時間常數 (秒)
 BG_COLOR = (227, 242, 253)    # 背景顏色 #E3F2FD 淺藍
 CURRENT_LYRICS_COLOR = (72, 72, 145)  # 當前歌詞顏色 #484891
 OTHER_LYRICS_COLOR = (72, 72, 145)  # 其他歌詞顏色 #484891
 FONT_SIZE = 65               # 統一字體大小 (原本 38)
 CURRENT_FONT_SIZE = 75       # 當前歌詞字體大小 (原本 55)
 BG_IMAGE_PATH = "background.png"  # 背景圖片路徑（放在專案資料夾）
+BG_VIDEO_PATH = None         # 循環影片背景路徑 (設定後取代 BG_IMAGE_PATH)
+BG_RING_SIZE = 16            # 影片背景預讀佇列的幀數
+BG_CACHE_MB = 1024           # 影片背景循環快取的記憶體預算 (MB)，超過改用 memmap 暫存檔
+BG_MMAP_MB = 4096            # memmap 暫存檔上限 (MB)，再超過就每輪重新解碼
 OVERLAY_ALPHA = 0.7          # 黑色遮罩透明度
 TEXT_STROKE_WIDTH = 0.7        # 文字白邊寬度
 OTHER_TEXT_STROKE_WIDTH = 0.4  # 其他文字白邊寬度
 TEXT_STROKE_COLOR = (255, 255, 255)
 OTHER_LYRICS_ALPHA = 50     # 非當前歌詞透明度 (0-255) 降低透明度讓當前歌詞更突顯
+KARAOKE_HIGHLIGHT = True    # 當前歌詞隨演唱進度逐字填色 (卡拉 OK 效果)
+KARAOKE_COLOR = (255, 196, 87)  # 填色顏色 #FFC457
+MEMORY_BUDGET_MB = None      # 記憶體預算 (MB)，None 表示不限制；超過時改用低記憶體模式或拒絕執行
+MEMORY_TRACE = False         # 是否用 tracemalloc 記錄每個階段的配置 (會拖慢渲染)
+FONT_SUBSET = True           # 依歌詞自動產生去除 hinting 的字體子集 (快取於 FONT_CACHE_DIR)
+FONT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "font_cache")
+# 主要字體缺字時依序改用的備援字體 (檔名或完整路徑)，涵蓋範圍快取於 FONT_CACHE_DIR
+FALLBACK_FONTS = ["NotoSansTC-Regular.otf", "msjh.ttc", "msyh.ttc", "NotoSansCJK-Regular.ttc",
+                  "seguisym.ttf", "seguiemj.ttf", "DejaVuSans.ttf"]
+FRAME_SKIP = True            # 畫面狀態與上一幀相同時直接沿用上一幀 (前奏、間奏、結尾)
+BAR_KEY_STEP = 0.5           # 判斷畫面是否相同時，柱子高度的量化單位 (px)
+# 編碼設定：encoder_autotune.py 量測後寫入 ENCODER_PROFILE_PATH，沒有設定檔時使用預設值
+ENCODER_PROFILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "encoder_profile.json")
+DEFAULT_ENCODER_SETTINGS = {'codec': 'libx264', 'preset': 'medium', 'crf': None, 'bitrate': '8000k', 'tune': None}
+LYRIC_KEYFRAMES = True       # 每句歌詞開始時強制關鍵幀，並輸出 <影片>.keyframes.json (每句對應的關鍵幀位元組位置)
+TELEMETRY_PATH = None        # 渲染遙測輸出檔 (.prom 為 Prometheus textfile，其他為 JSON lines)，None 表示不輸出
+TELEMETRY_INTERVAL = telemetry.TELEMETRY_INTERVAL  # 遙測寫出間隔 (秒)
+TELEMETRY_JOB_ID = None      # 遙測的工作 ID，None 表示以音檔名稱加雜湊自動產生
 # =========================================
 
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
-print("1. 正在載入音訊與分析頻譜... (這可能需要幾秒鐘)")
-# 載入音訊
-y, sr = librosa.load(AUDIO_FILE, sr=None)
-
-# 計算短時距傅立葉變換 (STFT) -> 得到頻譜
 # n_fft 決定了頻率的解析度，hop_length 決定了時間的密度
+n_fft = 2048
 hop_length = 512
-D = np.abs(librosa.stft(y, n_fft=2048, hop_length=hop_length))
-DB = librosa.amplitude_to_db(D, ref=np.max) # 轉成對數刻度(分貝)，比較符合人耳聽感
 
-# 載入字幕
-subs = pysrt.open(SRT_FILE)
-print(f"✓ 字幕載入成功: {len(subs)} 句歌詞")
+# 執行期資源：由 load_assets() 填入，make_frame 直接讀取這些全域變數
+y = None
+sr = None
+DB = None
+BAR_HEIGHTS = None  # (BAR_COUNT, 幀數) 預先算好的柱子高度，BAR_SCALE="linear" 時為 None
+DURATION = 0.0
+LOW_MEMORY = False
+MEMORY = MemoryTracker(trace=MEMORY_TRACE)
+subs = None
+SONG_TITLE = ""
+SRT_FILE = None
+FONT_PATH = TARGET_FONT_NAME
+CHINESE_FONT = CHINESE_FONT_CURRENT = ENGLISH_FONT = ENGLISH_FONT_CURRENT = TITLE_FONT = SINGER_FONT = None
+FONT_CHAIN = None       # 字體備援鏈 (font_fallback.FontChain)，含排版快取
+TITLE_FALLBACK = False  # 標題含主要字體缺少的字，需要逐字改用備援字體
+BG_IMAGE = None
+BACKGROUND = None  # 背景來源 (StaticBackground / VideoBackground)
+KARAOKE = None     # 卡拉 OK 精靈圖快取
+
+# 用來記錄最後顯示的歌詞索引，避免空白時段消失
+last_valid_index = 0
+
+# 上一幀的狀態與畫面，用於跳過重複渲染
+last_frame_key = None
+last_frame = None
+
+
+def select_files():
+    """使用檔案選擇對話框選擇音樂、歌詞與輸出位置，取消時回傳 None"""
+    print("請選擇檔案...")
+
+    # 初始化 tkinter（隱藏主視窗）
+    root = Tk()
+    root.withdraw()
+    root.attributes('-topmost', True)
+    root.lift()
+    root.focus_force()
+
+    # 選擇音樂檔案
+    print("\n1. 請選擇音樂檔案 (MP3)")
+    audio_file = filedialog.askopenfilename(
+        parent=root,
+        title="選擇音樂檔案",
+        filetypes=[("音樂檔案", "*.mp3 *.wav *.m4a"), ("所有檔案", "*.*")]
+    )
+
+    if not audio_file:
+        print("未選擇音樂檔案，程式結束")
+        return None
+
+    print(f"已選擇音樂: {os.path.basename(audio_file)}")
+
+    # 選擇歌詞檔案
+    print("\n2. 請選擇歌詞檔案 (SRT)")
+    srt_file = filedialog.askopenfilename(
+        parent=root,
+        title="選擇歌詞檔案",
+        filetypes=[("字幕檔案", "*.srt"), ("所有檔案", "*.*")]
+    )
+
+    if not srt_file:
+        print("未選擇歌詞檔案，程式結束")
+        return None
+
+    print(f"已選擇歌詞: {os.path.basename(srt_file)}")
+
+    # 自動使用音檔名稱作為歌曲名稱
+    song_title = os.path.splitext(os.path.basename(audio_file))[0]
+
+    # 選擇輸出位置
+    print("\n3. 請選擇影片輸出位置")
+    output_file = filedialog.asksaveasfilename(
+        parent=root,
+        title="儲存影片",
+        defaultextension=".mp4",
+        filetypes=[("MP4 影片", "*.mp4"), ("所有檔案", "*.*")],
+        initialfile=f"{song_title}.mp4"
+    )
+
+    if not output_file:
+        output_file = f"{song_title}.mp4"
+        print(f"使用預設輸出檔名: {output_file}")
+    else:
+        print(f"輸出檔案: {os.path.basename(output_file)}")
+
+    root.destroy()
+    return audio_file, srt_file, output_file
+
+
+def find_font_file():
+    """在專案目錄與系統字體目錄中尋找字體，找不到時回傳檔名讓系統自行尋找"""
+    # 定義搜尋路徑
+    search_paths = [
+        # 1. 專案目錄 (Fixed)
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), TARGET_FONT_NAME),
+        # 2. 專案目錄 (Original - if fixed doesn't exist yet but we will try to find fixed first)
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), ORIGINAL_FONT_NAME),
+        # 3. 系統字體目錄
+        os.path.join(os.environ.get("SystemRoot", r"C:\Windows"), "Fonts", TARGET_FONT_NAME),
+        os.path.join(os.environ.get("SystemRoot", r"C:\Windows"), "Fonts", ORIGINAL_FONT_NAME),
+        # 4. 使用者字體目錄
+        os.path.join(os.environ.get("LOCALAPPDATA", ""), r"Microsoft\Windows\Fonts", TARGET_FONT_NAME),
+        os.path.join(os.environ.get("LOCALAPPDATA", ""), r"Microsoft\Windows\Fonts", ORIGINAL_FONT_NAME)
+    ]
+
+    font_file = None
+    # 嘗試在已知路徑尋找
+    for path in search_paths:
+        if os.path.exists(path):
+            font_file = path
+            print(f"\n找到字體: {font_file}")
+            # 如果找到的是修復版，直接停止搜尋
+            if "fixed" in os.path.basename(path):
+                break
+
+    if font_file:
+        print(f"\n使用指定字體: {font_file}")
+    else:
+        # 如果找不到路徑，嘗試直接使用檔名（讓系統去尋找安裝的字體）
+        print(f"\n在資料夾中未找到 {TARGET_FONT_NAME}，嘗試直接呼叫系統已安裝字體...")
+        font_file = TARGET_FONT_NAME
+
+    return font_file
+
+
+def font_directories():
+    """專案目錄與各平台的字體目錄"""
+    home = os.path.expanduser("~")
+    return [
+        os.path.dirname(os.path.abspath(__file__)),
+        os.path.join(os.environ.get("SystemRoot", r"C:\Windows"), "Fonts"),
+        os.path.join(os.environ.get("LOCALAPPDATA", ""), r"Microsoft\Windows\Fonts"),
+        "/usr/share/fonts", "/usr/local/share/fonts", os.path.join(home, ".fonts"),
+        os.path.join(home, ".local", "share", "fonts"),
+        "/Library/Fonts", "/System/Library/Fonts", os.path.join(home, "Library", "Fonts"),
+    ]
+
+
+_FONT_FILES = None  # 字體目錄掃描結果 {小寫檔名: 路徑}，每個行程只掃描一次
+
+
+def scan_font_files():
+    """掃描所有字體目錄 (Linux 的字體目錄有子資料夾，一併搜尋)，結果快取在模組層級"""
+    global _FONT_FILES
+    if _FONT_FILES is None:
+        found = {}
+        for directory in font_directories():
+            if not os.path.isdir(directory):
+                continue
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    found.setdefault(name.lower(), os.path.join(root, name))
+        _FONT_FILES = found
+    return _FONT_FILES
+
+
+def find_fallback_fonts(names=None):
+    """依 FALLBACK_FONTS 的順序找出存在的備援字體路徑"""
+    names = FALLBACK_FONTS if names is None else names
+    found = scan_font_files()
+
+    paths = []
+    for name in names:
+        path = name if os.path.isabs(name) and os.path.isfile(name) else found.get(os.path.basename(name).lower())
+        if path and path not in paths:
+            paths.append(path)
+    return paths
+
+
+def analyze_audio(audio_file):
+    """載入音訊並計算分貝頻譜，回傳 (y, sr, DB)"""
+    # 載入音訊
+    y, sr = librosa.load(audio_file, sr=None)
+
+    # 計算短時距傅立葉變換 (STFT) -> 得到頻譜
+    D = np.abs(librosa.stft(y, n_fft=n_fft, hop_length=hop_length))
+    DB = librosa.amplitude_to_db(D, ref=np.max) # 轉成對數刻度(分貝)，比較符合人耳聽感
+    return y, sr, DB
+
+
+def analyze_audio_streaming(audio_file):
+    """
+    低記憶體模式：分塊讀取音訊計算頻譜，不保留整首波形與複數 STFT，回傳 (None, sr, DB)。
+    只支援 soundfile 能讀取的格式 (wav/flac/mp3 等)。
+    """
+    sr = librosa.get_samplerate(audio_file)
+    stream = librosa.stream(audio_file, block_length=STREAM_BLOCK_FRAMES, frame_length=n_fft, hop_length=hop_length, fill_value=0)
+
+    # 補上 center=True 時開頭的半個視窗，讓幀索引與一般模式對齊
+    blocks = [np.zeros((n_fft // 2 + 1, (n_fft // 2) // hop_length), dtype=np.float32)]
+    for block in stream:
+        blocks.append(np.abs(librosa.stft(block, n_fft=n_fft, hop_length=hop_length, center=False)))
+    # 最後一個區塊以 0 補滿，裁掉多出的靜音幀
+    n_frames = 1 + int(librosa.get_duration(path=audio_file) * sr) // hop_length
+    D = np.concatenate(blocks, axis=1)[:, :n_frames]
+    del blocks
+
+    DB = librosa.amplitude_to_db(D, ref=np.max)
+    return None, sr, DB
+
+
+def check_memory_budget(audio_file):
+    """依 MEMORY_BUDGET_MB 決定執行策略 ('normal' / 'low_memory' / 'refuse')"""
+    if MEMORY_BUDGET_MB is None:
+        return 'normal'
+
+    try:
+        duration = librosa.get_duration(path=audio_file)
+        audio_sr = librosa.get_samplerate(audio_file)
+    except Exception as e:
+        print(f"⚠ 無法讀取音訊資訊，略過記憶體預估: {e}")
+        return 'normal'
+
+    strategy, estimate = plan_memory(duration, audio_sr, VIDEO_SIZE, MEMORY_BUDGET_MB, n_fft, hop_length)
+    print_estimate(estimate, MEMORY_BUDGET_MB)
+    if strategy == 'low_memory':
+        print("⚠ 超過記憶體預算，改用低記憶體模式 (串流分析、縮小編碼佇列)")
+    return strategy
+
+
+FONT_TEST_TEXT = "測試渲染Test"  # 沒有指定測試文字時，載入字體後的渲染測試字串
+
+
+def font_text(subs, title):
+    """字體需要涵蓋的所有文字 (標題與歌詞)"""
+    return title + ''.join(sub.text for sub in subs) + ' '
+
+
+def prepare_font_subset(font_path, text):
+    """
+    產生只包含 text 用字、且去除 hinting 的字體子集 (依字體雜湊 + 字集快取)，
+    失敗時回傳原本的字體路徑。
+    """
+    if not os.path.isfile(font_path):
+        return font_path
+
+    try:
+        from fix_font import build_font_subset
+        subset_path = build_font_subset(font_path, text, FONT_CACHE_DIR)
+        print(f"✓ 字體子集: {os.path.basename(subset_path)} ({os.path.getsize(subset_path) // 1024} KB)")
+        return subset_path
+    except ImportError:
+        print("⚠ 需要安裝 fontTools 套件才能產生字體子集: pip install fonttools")
+    except Exception as e:
+        print(f"⚠ 字體子集產生失敗 ({e})，改用完整字體")
+    return font_path
+
 
 # 預先載入字體與背景，避免每幀重複初始化
-def try_load_fonts(font_path):
-    """嘗試載入並測試字體，成功回傳字體物件，失敗回傳 None"""
+def try_load_fonts(font_path, test_text=FONT_TEST_TEXT):
+    """嘗試載入字體並實際渲染 test_text (這個字體要畫的字) 測試，成功回傳字體物件，失敗回傳 None"""
     
     def load_font_set(engine=None):
         kwargs = {}
@@ -171,7 +347,7 @@ def try_load_fonts(font_path):
         c_font = fonts[0]
         dummy_img = Image.new("RGB", (100, 100))
         dummy_draw = ImageDraw.Draw(dummy_img)
-        dummy_draw.text((10, 10), "測試渲染Test", font=c_font)
+        dummy_draw.text((10, 10), test_text, font=c_font)
         
         return fonts
     except Exception as e:
@@ -184,7 +360,7 @@ def try_load_fonts(font_path):
             c_font = fonts[0]
             dummy_img = Image.new("RGB", (100, 100))
             dummy_draw = ImageDraw.Draw(dummy_img)
-            dummy_draw.text((10, 10), "測試渲染Test", font=c_font)
+            dummy_draw.text((10, 10), test_text, font=c_font)
             
             print("✓ 使用 BASIC 引擎載入成功")
             return fonts
@@ -192,32 +368,181 @@ def try_load_fonts(font_path):
             print(f"⚠ 字體 {font_path} 測試失敗: {e2}")
             return None
 
-# 1. 先嘗試預定的 FONT_PATH
-fonts = try_load_fonts(FONT_PATH)
 
-# 2. 只有在真的找不到時才報錯，不再自動切換回微軟正黑體
-if fonts is None:
-    print(f"✗ 致命錯誤: 無法載入字體 {FONT_PATH}。")
-    print("請確認該字體檔案位於專案目錄下，或是已正確安裝在 Windows 中。")
-    exit(1)
+def load_background(bg_image_path=BG_IMAGE_PATH):
+    """載入背景圖片並縮放到影片解析度，失敗回傳 None"""
+    if bg_image_path and os.path.exists(bg_image_path):
+        try:
+            return Image.open(bg_image_path).convert("RGB").resize(VIDEO_SIZE, Image.Resampling.LANCZOS)
+        except Exception as e:
+            print(f"背景圖片載入失敗: {e}")
+    return None
+
+
+def create_background_source(bg_video_path=None):
+    """建立背景來源：有影片背景就用影片，否則用靜態背景圖 (或純色)"""
+    if bg_video_path and os.path.exists(bg_video_path):
+        try:
+            # 低記憶體模式縮小預讀佇列，循環快取直接放 memmap
+            source = VideoBackground(
+                bg_video_path, VIDEO_SIZE, FPS, OVERLAY_ALPHA,
+                ring_size=4 if LOW_MEMORY else BG_RING_SIZE,
+                cache_mb=0 if LOW_MEMORY else BG_CACHE_MB,
+                mmap_mb=BG_MMAP_MB
+            )
+            print(f"✓ 使用影片背景: {os.path.basename(bg_video_path)}")
+            return source
+        except Exception as e:
+            print(f"背景影片載入失敗: {e}")
+    return StaticBackground(VIDEO_SIZE, OVERLAY_ALPHA, BG_IMAGE, BG_COLOR)
+
+
+def load_assets(audio_file, srt_file, song_title=None, font_path=None, bg_image_path=BG_IMAGE_PATH,
+                bg_video_path=BG_VIDEO_PATH):
+    """
+    載入音訊、字幕、字體與背景到模組全域變數，供 make_frame 使用。
+    字體載入失敗時回傳 False。
+    """
+    if not begin_assets(audio_file, song_title, font_path):
+        return False
+    load_audio(audio_file)
+    if not load_lyrics(srt_file):
+        return False
+    load_background_assets(bg_image_path, bg_video_path)
+    reset_render_state()
+    return True
+
+
+def begin_assets(audio_file, song_title=None, font_path=None):
+    """
+    決定歌曲名稱、字體路徑與記憶體策略 (其他載入步驟都依賴這幾項)。
+    預估記憶體超過預算時回傳 False。
+    """
+    global SONG_TITLE, FONT_PATH, LOW_MEMORY
+
+    FONT_PATH = font_path if font_path else find_font_file()
+
+    # 自動使用音檔名稱作為歌曲名稱
+    SONG_TITLE = song_title if song_title is not None else os.path.splitext(os.path.basename(audio_file))[0]
+    print(f"歌曲名稱: {SONG_TITLE}")
+
+    strategy = check_memory_budget(audio_file)
+    if strategy == 'refuse':
+        print(f"✗ 預估記憶體超過預算 {MEMORY_BUDGET_MB} MB，即使低記憶體模式也無法執行，拒絕渲染")
+        return False
+    LOW_MEMORY = strategy == 'low_memory'
+    return True
+
+
+def load_audio(audio_file):
+    """分析音訊 (依 begin_assets 決定的記憶體策略) 並算出柱子高度"""
+    global y, sr, DB, BAR_HEIGHTS, DURATION
+
+    print("1. 正在載入音訊與分析頻譜... (這可能需要幾秒鐘)")
+    with MEMORY.stage("analysis"):
+        if LOW_MEMORY:
+            try:
+                y, sr, DB = analyze_audio_streaming(audio_file)
+            except Exception as e:
+                print(f"⚠ 串流分析失敗 ({e})，改用一般分析")
+                y, sr, DB = analyze_audio(audio_file)
+        else:
+            y, sr, DB = analyze_audio(audio_file)
+    DURATION = librosa.get_duration(y=y, sr=sr) if y is not None else librosa.get_duration(path=audio_file)
+
+    # 柱子特徵一次算完 (濾波器組 + 正規化 + 平滑)，之後只保留柱子高度
+    if BAR_SCALE != "linear":
+        with MEMORY.stage("bars"):
+            BAR_HEIGHTS = bar_features.compute_bar_heights(
+                DB, sr, n_fft, hop_length, BAR_COUNT, MAX_BAR_LENGTH, scale=BAR_SCALE,
+                db_range=BAR_DB_RANGE, attack=BAR_ATTACK, release=BAR_RELEASE
+            )
+        DB = None
+    else:
+        BAR_HEIGHTS = None
+
+
+def load_fonts(text):
+    """
+    建立字體備援鏈，把 text 的每個字指定給第一個涵蓋它的字體，
+    以各自的字體子集載入用得到的字體 (所有字級)。回傳 FontChain，主要字體載入失敗回傳 None。
+    """
+    with MEMORY.stage("fonts"):
+        chain = font_fallback.build_font_chain([FONT_PATH] + find_fallback_fonts(), FONT_CACHE_DIR)
+        assigned, missing = chain.assign(text)
+        assigned.setdefault(0, set())
+
+        for index, chars in sorted(assigned.items()):
+            path = chain.paths[index]
+            # 主要字體的子集沿用整段文字 (缺字本來就不會放進子集)；.ttc 字體集無法產生子集
+            # 備援字體區段內的空白等字元用同一字體畫，子集也要包含這些字元，否則會畫成 .notdef 方塊
+            subset_text = text if index == 0 else ''.join(chars | chain.inherited_chars(text, index))
+            if FONT_SUBSET and not path.lower().endswith(".ttc"):
+                path = prepare_font_subset(path, subset_text)
+            fonts = try_load_fonts(path, ''.join(sorted(chars)) or FONT_TEST_TEXT)
+            if fonts is None:
+                if index == 0:
+                    return None
+                # 無法使用的備援字體：這些字退回主要字體
+                continue
+            chain.fonts[index] = fonts
+            chain.loaded_paths[index] = path
+            if index > 0:
+                print(f"✓ 備援字體: {os.path.basename(chain.paths[index])} ({len(chars)} 個字)")
+
+        if missing:
+            print(f"⚠ 沒有任何字體涵蓋這些字，會顯示為方塊: {''.join(sorted(missing))}")
+        return chain
+
+
+def load_lyrics(srt_file, fonts=None, fonts_text=""):
+    """
+    載入字幕與字體。fonts 為事先以 fonts_text 載入的字體備援鏈 (見 load_fonts)，
+    能涵蓋所有歌詞用字時直接使用，否則重新產生子集。字體載入失敗時回傳 False。
+    """
+    global subs, SRT_FILE, CHINESE_FONT, CHINESE_FONT_CURRENT, ENGLISH_FONT, ENGLISH_FONT_CURRENT, TITLE_FONT, SINGER_FONT
+    global FONT_CHAIN, TITLE_FALLBACK
+
+    # 載入字幕
+    subs = pysrt.open(srt_file)
+    SRT_FILE = srt_file
+    print(f"✓ 字幕載入成功: {len(subs)} 句歌詞")
+
+    text = font_text(subs, SONG_TITLE)
+    if fonts is None or not set(text) - {'\n', '\r'} <= set(fonts_text):
+        fonts = load_fonts(text)
+
+    # 只有在真的找不到時才報錯，不再自動切換回微軟正黑體
+    if fonts is None:
+        print(f"✗ 致命錯誤: 無法載入字體 {FONT_PATH}。")
+        print("請確認該字體檔案位於專案目錄下，或是已正確安裝在 Windows 中。")
+        return False
 
-if fonts:
-    CHINESE_FONT, CHINESE_FONT_CURRENT, ENGLISH_FONT, ENGLISH_FONT_CURRENT, TITLE_FONT, SINGER_FONT = fonts
+    FONT_CHAIN = fonts
+    CHINESE_FONT, CHINESE_FONT_CURRENT, ENGLISH_FONT, ENGLISH_FONT_CURRENT, TITLE_FONT, SINGER_FONT = fonts.fonts[0]
+    TITLE_FALLBACK = not fonts.covered_by_primary(SONG_TITLE)
     print(f"✓ 字體最終確認: {os.path.basename(FONT_PATH)}")
-else:
-    print(f"✗ 致命錯誤: 無法載入任何可用字體。請確認 {FONT_PATH} 或 msjh.ttc 是否存在。")
-    exit(1)
+    return True
 
-BG_IMAGE = None
-if BG_IMAGE_PATH and os.path.exists(BG_IMAGE_PATH):
-    try:
-        BG_IMAGE = Image.open(BG_IMAGE_PATH).convert("RGB").resize(VIDEO_SIZE, Image.Resampling.LANCZOS)
-    except Exception as e:
-        print(f"背景圖片載入失敗: {e}")
-        BG_IMAGE = None
 
-# 用來記錄最後顯示的歌詞索引，避免空白時段消失
-last_valid_index = 0
+def load_background_assets(bg_image_path=BG_IMAGE_PATH, bg_video_path=BG_VIDEO_PATH):
+    """載入背景圖片、建立背景來源與卡拉 OK 精靈圖快取"""
+    global BG_IMAGE, BACKGROUND, KARAOKE
+
+    BG_IMAGE = load_background(bg_image_path)
+    if BACKGROUND is not None:
+        BACKGROUND.close()
+    BACKGROUND = create_background_source(bg_video_path)
+    KARAOKE = KaraokeRenderer(draw_text_with_spacing, layout=text_layout)
+
+
+def reset_render_state():
+    """清除跨幀狀態 (最後歌詞索引與上一幀快取)，換歌或重新渲染前呼叫"""
+    global last_valid_index, last_frame_key, last_frame
+    last_valid_index = 0
+    last_frame_key = None
+    last_frame = None
+
 
 # 歌詞換行輔助函數（移到外部避免重複定義）
 # 使用简化的换行逻辑，避免频繁调用 textbbox
@@ -264,6 +589,12 @@ def wrap_english_text_simple(text, max_chars_per_line=30):
 
     return lines if lines else [text]
 
+def text_layout(text, font, spacing):
+    """文字排版 (每個字的字體與寬度)；有備援鏈時依 (文字, 字級, 字距) 快取"""
+    if FONT_CHAIN is None:
+        return font_fallback.single_font_layout(text, font, spacing)
+    return FONT_CHAIN.layout(text, font, spacing)
+
 def draw_text_with_spacing(draw, xy, text, font, fill, stroke_width, stroke_fill, spacing=1, anchor="mm"):
     """
     繪製帶有字間距的文字。
@@ -277,73 +608,62 @@ def draw_text_with_spacing(draw, xy, text, font, fill, stroke_width, stroke_fill
         draw.text(xy, text, font=font, fill=fill, stroke_width=stroke_width, stroke_fill=stroke_fill, anchor=anchor)
         return
 
-    # 計算總寬度
-    total_width = 0
-    char_widths = []
-    for char in text:
-        # textlength 回傳浮點數，累積計算
-        w = draw.textlength(char, font=font)
-        char_widths.append(w)
-        total_width += w
-    
-    # 加上間距總和
-    total_width += spacing * (len(text) - 1) if len(text) > 1 else 0
+    # 每個字的字體 (主要字體缺字時改用備援字體) 與寬度，已快取
+    layout = text_layout(text, font, spacing)
     
     # 計算起始 X (xy[0] 是中心 x)
-    start_x = xy[0] - total_width / 2
+    start_x = xy[0] - layout.total_width / 2
     y = xy[1] # xy[1] 是中心 y
     
     current_x = start_x
-    for i, char in enumerate(text):
+    for char, char_font, char_width in layout.glyphs:
         # 使用 "lm" (Left-Middle) 讓文字垂直置中於 y，水平從 current_x 開始
-        draw.text((current_x, y), char, font=font, fill=fill, stroke_width=stroke_width, stroke_fill=stroke_fill, anchor="lm")
-        current_x += char_widths[i] + spacing
+        draw.text((current_x, y), char, font=char_font, fill=fill, stroke_width=stroke_width, stroke_fill=stroke_fill, anchor="lm")
+        current_x += char_width + spacing
 
-def make_frame(t):
-    """
-    這是核心函數：MoviePy 會傳入時間 t (秒)，我們要回傳當下的畫面圖片 (numpy array)
-    """
-    global last_valid_index
-    
-    # --- A. 建立背景 ---
-    if BG_IMAGE is not None:
-        img = BG_IMAGE.copy().convert("RGBA")
-    else:
-        img = Image.new('RGBA', VIDEO_SIZE, BG_COLOR + (255,))
+def render_background(t):
+    """--- A. 建立背景 --- 回傳已疊加 70% 黑色遮罩的 RGBA 畫布 (遮罩由背景來源預先合成)"""
+    return BACKGROUND.get_frame(t)
 
-    # 疊加 70% 黑色遮罩
-    overlay = Image.new('RGBA', VIDEO_SIZE, (0, 0, 0, int(255 * OVERLAY_ALPHA)))
-    img = Image.alpha_composite(img, overlay)
+# 圓形視覺化參數
+BASE_RADIUS = 120      # 基礎半徑
+MAX_BAR_LENGTH = 150   # 最大柱子長度（增加）
 
-    draw = ImageDraw.Draw(img)
-    
-    w, h = VIDEO_SIZE
-    
-    # --- B. 繪製圓形音頻視覺化 ---
+def compute_bar_heights(t):
+    """回傳 t 時刻每根柱子的高度 (px)，超出頻譜範圍時回傳 None"""
     frame_index = int(t * sr / hop_length)
-    
-    if frame_index < DB.shape[1]:
-        freqs = DB[:100, frame_index]
-        
-        # 確保生成正好 BAR_COUNT 個柱子
-        bars = []
-        for i in range(BAR_COUNT):
-            idx = int(i * len(freqs) / BAR_COUNT)
-            bars.append(freqs[idx])
-        
+
+    if BAR_HEIGHTS is not None:
+        if frame_index >= BAR_HEIGHTS.shape[1]:
+            return None
+        return BAR_HEIGHTS[:, frame_index]
+
+    # 舊版：只取最低 100 個線性頻率點
+    if frame_index >= DB.shape[1]:
+        return None
+
+    freqs = DB[:100, frame_index]
+    # 確保生成正好 BAR_COUNT 個柱子
+    idx = (np.arange(BAR_COUNT) * len(freqs) / BAR_COUNT).astype(int)
+    # 柱子高度（增加倍數讓動態更明顯）
+    return np.clip((freqs[idx] + 80) * 2.5, 0, MAX_BAR_LENGTH)
+
+def draw_visualizer(draw, bar_heights):
+    """--- B. 繪製圓形音頻視覺化 --- bar_heights 為 None 時不繪製"""
+    w, h = VIDEO_SIZE
+
+    if bar_heights is not None:
         # 圓形參數
         center_x = w // 4  # 圓心在左側1/4處
         center_y = h // 2
-        base_radius = 120  # 基礎半徑
-        max_bar_length = 150  # 最大柱子長度（增加）
+        base_radius = BASE_RADIUS
+        max_bar_length = MAX_BAR_LENGTH
         
         # 繪製圓形頻譜
-        for i, val in enumerate(bars):
+        for i, bar_height in enumerate(bar_heights):
             # 計算角度（360度分成BAR_COUNT份）
             angle = (i / BAR_COUNT) * 2 * np.pi
             
-            # 柱子高度（增加倍數讓動態更明顯）
-            bar_height = np.clip((val + 80) * 2.5, 0, max_bar_length)
             gradient_ratio = 0 if max_bar_length == 0 else min(1.0, bar_height / max_bar_length)
             bar_color = tuple(
                 int(BAR_COLOR[c] + (255 - BAR_COLOR[c]) * gradient_ratio)
@@ -366,23 +686,31 @@ def make_frame(t):
         
         # 在圓形中心繪製歌曲名稱
         try:
-            # 使用中心锚点简化居中
-            draw.text(
-                (center_x, center_y),
-                SONG_TITLE,
-                font=TITLE_FONT,
-                fill=BAR_COLOR,
-                stroke_width=TEXT_STROKE_WIDTH,
-                stroke_fill=TEXT_STROKE_COLOR,
-                anchor="mm"  # 中心锚点
-            )
+            if TITLE_FALLBACK:
+                # 標題有主要字體缺少的字：逐字排版，缺字改用備援字體
+                draw_text_with_spacing(draw, (center_x, center_y), SONG_TITLE, font=TITLE_FONT, fill=BAR_COLOR,
+                                       stroke_width=TEXT_STROKE_WIDTH, stroke_fill=TEXT_STROKE_COLOR, spacing=0)
+            else:
+                # 使用中心锚点简化居中
+                draw.text(
+                    (center_x, center_y),
+                    SONG_TITLE,
+                    font=TITLE_FONT,
+                    fill=BAR_COLOR,
+                    stroke_width=TEXT_STROKE_WIDTH,
+                    stroke_fill=TEXT_STROKE_COLOR,
+                    anchor="mm"  # 中心锚点
+                )
         except Exception as e:
             if not hasattr(make_frame, '_title_error_logged'):
                 print(f"⚠ 標題渲染錯誤: {e}")
                 traceback.print_exc()
                 make_frame._title_error_logged = True
 
-    # --- C. 繪製滾動式歌詞 - 右半邊 ---
+def find_current_index(t):
+    """找出當前時間對應的字幕索引，空白時段沿用最後一次有效的索引"""
+    global last_valid_index
+
     # 找出當前時間對應的字幕索引
     current_index = -1
     for i, sub in enumerate(subs):
@@ -401,7 +729,31 @@ def make_frame(t):
         current_index = last_valid_index
     else:
         last_valid_index = current_index
-    
+    return current_index
+
+ANIM_DURATION = 0.5  # 歌詞滑動動畫持續 0.5 秒
+
+def lyric_anim_progress(t, current_index):
+    """回傳當前歌詞滑動動畫的進度 (0~1)，不在動畫中時回傳 None"""
+    if current_index <= 0 or current_index >= len(subs):
+        return None
+    dt = t - subs[current_index].start.ordinal / 1000.0
+    if 0 <= dt < ANIM_DURATION:
+        return dt / ANIM_DURATION
+    return None
+
+def karaoke_progress(t, current_index):
+    """回傳當前歌詞已唱完的字數 (可為小數)，未啟用填色時回傳 None"""
+    if not KARAOKE_HIGHLIGHT or current_index < 0 or current_index >= len(subs):
+        return None
+    sub = subs[current_index]
+    chinese_text = sub.text.split('\n')[0]
+    return sung_chars(t, sub.start.ordinal / 1000.0, sub.end.ordinal / 1000.0, timed_char_count(chinese_text))
+
+def draw_lyrics(img, draw, t, current_index):
+    """--- C. 繪製滾動式歌詞 - 右半邊 ---"""
+    w, h = VIDEO_SIZE
+
     if current_index >= 0 and current_index < len(subs):
         try:
             # 設定顯示參數
@@ -477,11 +829,9 @@ def make_frame(t):
             global_y_offset = 0
             # 只有在非第一句，且上一句也在顯示列表內時才做動畫
             if current_index > 0 and current_item_idx > 0:
-                 start_sec = subs[current_index].start.ordinal / 1000.0
-                 dt = t - start_sec
-                 anim_duration = 0.5  # 動畫持續 0.5 秒
+                 progress = lyric_anim_progress(t, current_index)
                  
-                 if 0 <= dt < anim_duration:
+                 if progress is not None:
                      curr_item = visible_items[current_item_idx]
                      prev_item = visible_items[current_item_idx - 1]
                      
@@ -490,7 +840,6 @@ def make_frame(t):
                      stack_dist = (curr_item['block_height'] / 2) + margin + (prev_item['block_height'] / 2)
                      
                      # Cubic Ease Out: 快速滑動後減速
-                     progress = dt / anim_duration
                      ease = 1 - (1 - progress) ** 3
                      global_y_offset = stack_dist * (1 - ease)
             
@@ -543,11 +892,17 @@ def make_frame(t):
                     stroke_color = (int(stroke_color[0]*dim_factor), int(stroke_color[1]*dim_factor), int(stroke_color[2]*dim_factor), OTHER_LYRICS_ALPHA)
 
                 # 繪製中文區塊
+                sung = karaoke_progress(t, i) if item['is_current'] else None
                 for idx, line in enumerate(chinese_lines):
                     x = lyrics_center_x
                     y = block_top + idx * c_lh
                     
-                    if item['is_current']:
+                    if sung is not None:
+                        # 當前歌詞逐字填色：預先渲染的原色/填色精靈圖 + 欄位遮罩
+                        base_passes = [(color, 3, stroke_color), (color, 1, color)]
+                        high_passes = [(KARAOKE_COLOR, 3, stroke_color), (KARAOKE_COLOR, 1, KARAOKE_COLOR)]
+                        sung -= KARAOKE.draw_line(img, (x, y), line, CHINESE_FONT_CURRENT, 8, base_passes, high_passes, sung)
+                    elif item['is_current']:
                          # 當前歌詞：模擬粗體 + 白邊 (增加字距 spacing)
                         draw_text_with_spacing(draw, (x, y), line, font=CHINESE_FONT_CURRENT, fill=color, stroke_width=3, stroke_fill=stroke_color, spacing=8, anchor="mm")
                         draw_text_with_spacing(draw, (x, y), line, font=CHINESE_FONT_CURRENT, fill=color, stroke_width=1, stroke_fill=color, spacing=8, anchor="mm")
@@ -579,20 +934,189 @@ def make_frame(t):
                 traceback.print_exc()
                 make_frame._error_logged = True
 
+def make_frame(t):
+    """
+    這是核心函數：MoviePy 會傳入時間 t (秒)，我們要回傳當下的畫面圖片 (numpy array)
+    """
+    bar_heights = compute_bar_heights(t)
+    current_index = find_current_index(t)
+
+    img = render_background(t)
+    draw = ImageDraw.Draw(img)
+
+    draw_visualizer(draw, bar_heights)
+    draw_lyrics(img, draw, t, current_index)
+
     # --- D. 演唱者標記 (移除) ---
     # (原本顯示於右下角的代碼已移除)
 
     return np.array(img.convert("RGB"))
 
+def frame_state_key(bar_heights, current_index, t):
+    """
+    畫面狀態鍵：背景畫面、量化後的柱子高度、當前歌詞索引、動畫進度與填色進度。
+    兩幀的鍵相同代表畫面相同 (標題是靜態的)。
+    """
+    bars_key = None if bar_heights is None else np.round(bar_heights / BAR_KEY_STEP).astype(np.int16).tobytes()
+    progress = lyric_anim_progress(t, current_index)
+    anim_key = None if progress is None else round(progress * ANIM_DURATION * FPS)
+    sung = karaoke_progress(t, current_index)
+    karaoke_key = None if sung is None else round(sung, 3)
+    return BACKGROUND.frame_key(t), bars_key, current_index, anim_key, karaoke_key
+
+def make_frame_skipping(t):
+    """
+    與 make_frame 相同，但狀態鍵與上一幀相同時直接回傳上一幀的畫面，
+    讓前奏、間奏、淡出等靜態片段只剩編碼成本。
+    """
+    global last_frame_key, last_frame
+
+    bar_heights = compute_bar_heights(t)
+    current_index = find_current_index(t)
+    key = frame_state_key(bar_heights, current_index, t)
+    if key == last_frame_key and last_frame is not None:
+        return last_frame
+
+    img = render_background(t)
+    draw = ImageDraw.Draw(img)
+    draw_visualizer(draw, bar_heights)
+    draw_lyrics(img, draw, t, current_index)
+
+    last_frame_key = key
+    last_frame = np.array(img.convert("RGB"))
+    return last_frame
+
 # ================= 執行輸出 =================
-print("2. 開始合成影片... (這會花一點時間，取決於電腦效能)")
+def load_encoder_settings(profile_path=ENCODER_PROFILE_PATH):
+    """讀取 encoder_autotune.py 產生的建議編碼設定，沒有設定檔或讀取失敗時回傳預設值"""
+    settings = dict(DEFAULT_ENCODER_SETTINGS)
+    if not profile_path or not os.path.exists(profile_path):
+        return settings
+    try:
+        with open(profile_path, 'r', encoding='utf-8') as f:
+            profile = json.load(f)
+        settings.update({key: value for key, value in profile['settings'].items() if key in settings})
+    except (OSError, ValueError, KeyError, AttributeError) as e:
+        print(f"⚠ 編碼設定檔讀取失敗 ({e})，使用預設編碼設定")
+        return dict(DEFAULT_ENCODER_SETTINGS)
+    return settings
+
+
+def encoder_ffmpeg_params(settings):
+    """CRF 與 tune 的 ffmpeg 參數 (MoviePy 的 write_videofile 沒有對應的參數)"""
+    params = []
+    if settings.get('crf') is not None:
+        params += ["-crf", str(settings['crf'])]
+    if settings.get('tune'):
+        params += ["-tune", settings['tune']]
+    return params
+
+
+def encoder_output_args(settings):
+    """直接呼叫 ffmpeg 時的完整影像編碼參數 (與 render_video 相同)"""
+    args = ["-c:v", settings['codec'], "-preset", settings['preset']] + encoder_ffmpeg_params(settings)
+    if settings.get('crf') is None and settings.get('bitrate'):
+        args += ["-b:v", settings['bitrate']]
+    return args
+
+
+def describe_encoder(settings):
+    rate = f"CRF {settings['crf']}" if settings.get('crf') is not None else settings.get('bitrate')
+    tune = f", tune={settings['tune']}" if settings.get('tune') else ""
+    return f"{settings['codec']} {settings['preset']}, {rate}{tune}"
+
+
+def start_telemetry(audio_file):
+    """依 TELEMETRY_PATH 建立並啟動渲染遙測，未設定時回傳 None"""
+    if not TELEMETRY_PATH:
+        return None
+    tracker = telemetry.RenderTelemetry(
+        TELEMETRY_PATH, TELEMETRY_JOB_ID, {'audio': audio_file, 'srt': SRT_FILE, 'font': FONT_PATH},
+        total_frames=int(DURATION * FPS), fps=FPS, stages_func=lambda: list(MEMORY.stages), interval=TELEMETRY_INTERVAL
+    )
+    tracker.add_gauge('background', BACKGROUND.queue_depth)
+    print(f"📡 遙測輸出: {TELEMETRY_PATH} (工作 {tracker.job_id}，每 {TELEMETRY_INTERVAL:g} 秒)")
+    return tracker.start()
+
+
+def timed_frame_func(frame_func, tracker):
+    """包裝畫面函式，記錄每幀的產生時間與是否沿用上一幀"""
+    def timed(t):
+        previous = last_frame
+        start = time.perf_counter()
+        frame = frame_func(t)
+        tracker.frame(time.perf_counter() - start, skipped=previous is not None and frame is previous)
+        return frame
+    return timed
+
+
+def render_video(audio_file, output_file):
+    """建立影片物件、加上音軌並寫入檔案"""
+    print("2. 開始合成影片... (這會花一點時間，取決於電腦效能)")
+
+    settings = load_encoder_settings()
+    print(f"   編碼設定: {describe_encoder(settings)}")
+    ffmpeg_params = encoder_ffmpeg_params(settings)
+    # 低記憶體模式縮小 x264 前瞻佇列
+    if LOW_MEMORY:
+        ffmpeg_params += ["-rc-lookahead", str(LOW_MEMORY_LOOKAHEAD)]
+    # 歌詞切換處強制關鍵幀，方便跳轉與在句子邊界剪輯
+    if LYRIC_KEYFRAMES and subs:
+        keyframe_times = keyframe_index.lyric_keyframe_times(subs)
+        ffmpeg_params += keyframe_index.force_keyframe_params(keyframe_times)
+        print(f"   歌詞關鍵幀: {len(keyframe_times)} 個 (間隔至少 {keyframe_index.KEYFRAME_MIN_SPACING} 秒)")
+
+    tracker = start_telemetry(audio_file)
+    frame_func = make_frame_skipping if FRAME_SKIP else make_frame
+    if tracker:
+        frame_func = timed_frame_func(frame_func, tracker)
+
+    try:
+        with MEMORY.stage("render"):
+            # 建立影片物件
+            reset_render_state()
+            video = VideoClip(frame_func, duration=DURATION)
+            # 加上音軌
+            audio = AudioFileClip(audio_file)
+            video = video.with_audio(audio)
+
+            # 寫入檔案
+            # CRF 模式不指定位元率
+            video.write_videofile(output_file, fps=FPS, codec=settings['codec'], audio_codec='aac',
+                                  bitrate=settings['bitrate'] if settings['crf'] is None else None,
+                                  preset=settings['preset'], ffmpeg_params=ffmpeg_params or None)
+    except BaseException:
+        if tracker:
+            tracker.finish("failed")
+        raise
+    print(f"完成！影片已存為 {output_file}")
+
+    if LYRIC_KEYFRAMES and subs:
+        try:
+            index_path, index = keyframe_index.write_keyframe_index(output_file, subs)
+            exact = sum(1 for line in index['lines'] if line['exact'])
+            print(f"✓ 關鍵幀索引: {os.path.basename(index_path)} "
+                  f"({len(index['keyframes'])} 個關鍵幀, {exact}/{len(index['lines'])} 句剛好從關鍵幀開始)")
+        except Exception as e:
+            print(f"⚠ 關鍵幀索引建立失敗: {e}")
+    if tracker:
+        record = tracker.finish("done", output_file, DURATION)
+        print(f"📡 遙測: 平均 {record['average_fps']:.1f} fps, "
+              f"輸出位元率 {record['output'].get('bitrate_kbps', 0):.0f} kbps")
+    MEMORY.report()
+
+
+def main():
+    selected = select_files()
+    if not selected:
+        exit()
+    audio_file, srt_file, output_file = selected
+
+    if not load_assets(audio_file, srt_file):
+        exit(1)
+
+    render_video(audio_file, output_file)
 
-# 建立影片物件
-video = VideoClip(make_frame, duration=librosa.get_duration(y=y, sr=sr))
-# 加上音軌
-audio = AudioFileClip(AUDIO_FILE)
-video = video.with_audio(audio)
 
-# 寫入檔案
-video.write_videofile(OUTPUT_FILE, fps=FPS, codec='libx264', audio_codec='aac', bitrate="8000k", preset="medium")
-print(f"完成！影片已存為 {OUTPUT_FILE}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
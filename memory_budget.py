@@ -0,0 +1,175 @@
+"""
+記憶體用量統計與預算控管
+- 每個管線階段記錄 RSS 與峰值 RSS，可選擇同時記錄 tracemalloc 快照
+- 渲染前依音訊長度、取樣率與解析度估算記憶體
+- 超過預算時自動改用低記憶體策略 (串流分析、較小的編碼佇列)，仍超過則拒絕執行
+"""
+
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+MB = 1024 * 1024
+
+# 低記憶體模式下 x264 的前瞻幀數 (medium 預設為 40)
+LOW_MEMORY_LOOKAHEAD = 10
+# 串流分析每個區塊的 STFT 幀數 (make_music_videos.analyze_audio_streaming)
+STREAM_BLOCK_FRAMES = 256
+
+
+def get_rss_mb():
+    """回傳目前行程的 RSS (MB)，無法取得時回傳 None"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / MB
+    except ImportError:
+        pass
+
+    # Linux 沒有 psutil 時直接讀 /proc
+    try:
+        with open("/proc/self/statm", 'r') as f:
+            resident_pages = int(f.read().split()[1])
+        import resource
+        return resident_pages * resource.getpagesize() / MB
+    except (OSError, ImportError, IndexError, ValueError):
+        return None
+
+
+def get_peak_rss_mb():
+    """回傳目前行程的峰值 RSS (MB)，無法取得時回傳 None"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS 回傳 bytes，Linux 回傳 KB
+        return peak / MB if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        pass
+
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / MB
+    except ImportError:
+        return None
+
+
+class MemoryTracker:
+    """記錄每個管線階段的記憶體變化"""
+
+    def __init__(self, trace=False, top_n=5):
+        self.trace = trace
+        self.top_n = top_n
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        started_trace = False
+        if self.trace and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            started_trace = True
+        if self.trace:
+            tracemalloc.reset_peak()
+
+        rss_before = get_rss_mb()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry = {
+                'stage': name,
+                'seconds': time.perf_counter() - start,
+                'rss_before_mb': rss_before,
+                'rss_after_mb': get_rss_mb(),
+                'peak_rss_mb': get_peak_rss_mb(),
+            }
+            if self.trace:
+                _, traced_peak = tracemalloc.get_traced_memory()
+                entry['traced_peak_mb'] = traced_peak / MB
+                snapshot = tracemalloc.take_snapshot()
+                entry['top_allocations'] = [
+                    f"{stat.traceback[0].filename}:{stat.traceback[0].lineno} {stat.size / MB:.1f}MB"
+                    for stat in snapshot.statistics('lineno')[:self.top_n]
+                ]
+                if started_trace:
+                    tracemalloc.stop()
+            self.stages.append(entry)
+
+    def report(self):
+        """以表格印出各階段記憶體用量"""
+        print("\n📊 記憶體用量 (MB):")
+        print(f"  {'階段':<12} {'秒數':>8} {'RSS前':>9} {'RSS後':>9} {'峰值RSS':>9}")
+
+        def fmt(value):
+            return f"{value:9.1f}" if value is not None else f"{'N/A':>9}"
+
+        for entry in self.stages:
+            print(f"  {entry['stage']:<12} {entry['seconds']:8.2f} {fmt(entry['rss_before_mb'])} "
+                  f"{fmt(entry['rss_after_mb'])} {fmt(entry['peak_rss_mb'])}")
+            if 'traced_peak_mb' in entry:
+                print(f"    tracemalloc 峰值: {entry['traced_peak_mb']:.1f}")
+                for line in entry['top_allocations']:
+                    print(f"      {line}")
+
+
+def estimate_memory_mb(duration, sr, video_size, n_fft=2048, hop_length=512, low_memory=False, lookahead=40):
+    """
+    估算渲染一首歌的記憶體需求 (MB)，回傳 {項目: MB}。
+    一般模式：整首波形 (float32) + 複數 STFT + 振幅矩陣 + 分貝矩陣同時存在。
+    低記憶體模式：串流分析不保留整首波形與複數 STFT，但振幅矩陣與分貝轉換的暫存仍然存在，
+    另外加上一個區塊的讀取緩衝與區塊 STFT；編碼前瞻佇列縮小。
+    """
+    w, h = video_size
+    n_bins = n_fft // 2 + 1
+    n_frames = int(duration * sr / hop_length) + 1
+    spectrum = n_bins * n_frames * 4
+
+    if low_memory:
+        # 一次只讀一個區塊的波形 (soundfile 讀取的雙聲道緩衝 + 單聲道)，區塊的複數 STFT 與振幅
+        block_samples = (STREAM_BLOCK_FRAMES - 1) * hop_length + n_fft
+        block_bins = n_bins * STREAM_BLOCK_FRAMES
+        analysis = {
+            'waveform': block_samples * 4 * 3,
+            'stream_block': block_bins * 8 + block_bins * 4,
+            # 區塊串接成振幅矩陣時，區塊清單與串接結果同時存在；
+            # amplitude_to_db 的 np.abs 複本、功率與取對數的暫存又各佔一份 (實測峰值約為頻譜的 4 倍)
+            'stft': spectrum * 4,
+        }
+    else:
+        analysis = {
+            'waveform': duration * sr * 4,
+            # complex64 STFT + np.abs 結果 + 分貝矩陣
+            'stft': spectrum * 2 + spectrum * 2,
+        }
+
+    estimate = dict(analysis)
+    # make_frame 的暫存：背景複本、遮罩、合成結果 (RGBA) 與 RGB 轉換、numpy 陣列
+    estimate['frame_temporaries'] = w * h * 4 * 3 + w * h * 3 * 2
+    # x264 前瞻佇列 (yuv420p)
+    estimate['encoder_queue'] = w * h * 1.5 * (LOW_MEMORY_LOOKAHEAD if low_memory else lookahead)
+    # MoviePy 音軌緩衝 (44.1kHz 雙聲道 float64 讀取緩衝)
+    estimate['audio_clip'] = 200000 * 2 * 8
+    return {name: value / MB for name, value in estimate.items()}
+
+
+def plan_memory(duration, sr, video_size, budget_mb, n_fft=2048, hop_length=512):
+    """
+    依預算決定執行策略，回傳 (策略, 估算)：
+    'normal' 一般模式、'low_memory' 低記憶體模式、'refuse' 超出預算拒絕執行。
+    budget_mb 為 None 時一律使用一般模式。
+    """
+    normal = estimate_memory_mb(duration, sr, video_size, n_fft, hop_length)
+    if budget_mb is None or sum(normal.values()) <= budget_mb:
+        return 'normal', normal
+
+    low = estimate_memory_mb(duration, sr, video_size, n_fft, hop_length, low_memory=True)
+    if sum(low.values()) <= budget_mb:
+        return 'low_memory', low
+    return 'refuse', low
+
+
+def print_estimate(estimate, budget_mb=None):
+    total = sum(estimate.values())
+    parts = ", ".join(f"{name} {value:.0f}" for name, value in estimate.items())
+    budget_text = f" / 預算 {budget_mb:.0f} MB" if budget_mb is not None else ""
+    print(f"📐 預估記憶體: {total:.0f} MB{budget_text} ({parts})")
@@ -0,0 +1,215 @@
+"""
+本地模擬的 OpenAI 相容 API 伺服器 (只實作 /v1/chat/completions)
+用來離線測試與量測歌詞優化流程：可設定延遲、抖動、錯誤率、串流速度與固定回應。
+預設的「模型」行為：
+- 斷句請求：把【參考歌詞】依句號、問號、驚嘆號與換行切開 (太長的句子再於逗號處切開) 後逐行回傳 (支援 SSE 串流)
+- 批次翻譯請求：回傳 [{"id": n, "en": ...}] JSON 陣列
+- 單句翻譯請求：回傳一句假英文
+用法: python mock_llm_server.py --port 8765 --latency 0.3 --jitter 0.1 --error-rate 0.05
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FAKE_WORDS = ["love", "heart", "dream", "sky", "star", "light", "rain", "wind", "night", "memory",
+              "smile", "world", "forever", "city", "voice", "story", "youth", "far", "away", "with"]
+
+
+def fake_english(text):
+    """依中文內容產生固定的假英文 (同一句永遠得到同樣的結果)"""
+    digest = hashlib.sha256(text.encode('utf-8')).digest()
+    return ' '.join(FAKE_WORDS[b % len(FAKE_WORDS)] for b in digest[:3 + digest[3] % 5]).capitalize()
+
+
+def default_reply(prompt):
+    """依提示詞類型產生預設回應"""
+    if '【參考歌詞】：' in prompt:
+        reference = prompt.split('【參考歌詞】：', 1)[1].split('🚨', 1)[0]
+        lines = []
+        for line in re.split(r'(?<=[。！？])|\n', reference):
+            line = line.strip()
+            if not line:
+                continue
+            # 句子太長時在逗號處換行
+            lines.extend(re.split(r'(?<=，)', line) if len(line) > 12 else [line])
+        return '\n'.join(line for line in lines if line)
+
+    numbered = re.findall(r'^(\d+)\. (.+)$', prompt, flags=re.MULTILINE)
+    if numbered and 'JSON array' in prompt:
+        return json.dumps([{"id": int(n), "en": fake_english(text)} for n, text in numbered], ensure_ascii=False)
+
+    chinese = prompt.split('\n\n')[1] if prompt.count('\n\n') >= 2 else prompt
+    return fake_english(chinese.strip())
+
+
+class MockLLMServer:
+    """
+    在背景執行緒執行的模擬伺服器。
+    latency: 每個請求的基本延遲 (秒)，jitter: 延遲的隨機變動範圍 (±秒)，
+    error_rate: 回傳 503 的比例，stream_chunk_chars / stream_delay: 串流時每段的字數與間隔，
+    canned: {模型名稱: 固定回應文字}，指定的模型一律回傳該文字。
+    """
+
+    def __init__(self, port=0, latency=0.2, jitter=0.05, error_rate=0.0, stream_chunk_chars=4,
+                 stream_delay=0.01, canned=None, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.stream_chunk_chars = max(1, stream_chunk_chars)
+        self.stream_delay = stream_delay
+        self.canned = canned or {}
+        self.random = random.Random(seed)
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reset_stats(self):
+        with self._lock:
+            self.requests = 0
+            self.errors = 0
+            self.peak_in_flight = 0
+
+    def _begin(self):
+        """記錄請求並決定延遲與是否回傳錯誤"""
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            failed = self.random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        return delay, failed
+
+    def _end(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def reply_for(self, body):
+        model = body.get('model', '')
+        if model in self.canned:
+            return self.canned[model]
+        return default_reply(body['messages'][-1]['content'])
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, payload):
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_chunk(self, data):
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                if not self.path.rstrip('/').endswith('/chat/completions'):
+                    self._send_json(404, {"error": "not found"})
+                    return
+
+                delay, failed = server._begin()
+                try:
+                    time.sleep(delay)
+                    if failed:
+                        self._send_json(503, {"error": "mock server overloaded"})
+                        return
+
+                    content = server.reply_for(body)
+                    usage = {"prompt_tokens": len(body['messages'][-1]['content']) // 2,
+                             "completion_tokens": max(1, len(content) // 2)}
+                    if not body.get('stream'):
+                        self._send_json(200, {"choices": [{"message": {"role": "assistant", "content": content}}],
+                                              "usage": usage})
+                        return
+
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+                    self.send_header("Transfer-Encoding", "chunked")
+                    self.end_headers()
+                    step = server.stream_chunk_chars
+                    for start in range(0, len(content), step):
+                        if server.stream_delay:
+                            time.sleep(server.stream_delay)
+                        chunk = {"choices": [{"delta": {"content": content[start:start + step]}}]}
+                        self._send_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+                    self._send_chunk(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode('utf-8'))
+                    self._send_chunk(b"data: [DONE]\n\n")
+                    self._send_chunk(b"")
+                finally:
+                    server._end()
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模擬的 OpenAI 相容 API 伺服器")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="每個請求的基本延遲 (秒)")
+    parser.add_argument("--jitter", type=float, default=0.05, help="延遲的隨機變動範圍 (±秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="回傳 503 的比例")
+    parser.add_argument("--stream-delay", type=float, default=0.01, help="串流時每段之間的間隔 (秒)")
+    parser.add_argument("--canned", default=None, help="固定回應 JSON 檔: {模型名稱: 回應文字}")
+    args = parser.parse_args()
+
+    canned = None
+    if args.canned:
+        with open(args.canned, 'r', encoding='utf-8') as f:
+            canned = json.load(f)
+
+    server = MockLLMServer(port=args.port, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                           stream_delay=args.stream_delay, canned=canned)
+    print(f"🤖 模擬 LLM 伺服器: {server.url} (Ctrl+C 結束)")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
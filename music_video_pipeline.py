@@ -0,0 +1,189 @@
+"""
+歌詞影片一鍵流程
+原本要先執行 optimize_lyrics.py 等所有 LLM 請求完成，再執行 make_music_videos.py 才開始解碼與分析音訊。
+這裡把兩段合成一個指令：歌詞斷句與翻譯在另一個行程進行 (主要在等網路)，
+同時本行程解碼音訊、分析頻譜、準備字體與背景 (主要吃 CPU)；優化後的 SRT 一完成就開始渲染，
+最後列出各階段的起迄時間與重疊省下的時間。
+用法: python music_video_pipeline.py --audio 歌.mp3 --srt 歌.srt --reference 歌.txt [--output 歌.mp4]
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import make_music_videos as mmv
+import optimize_lyrics
+
+# 歌詞還沒出來前先產生字體子集用的英文字元 (翻譯結果大多只用到這些字)
+ASCII_TEXT = ''.join(chr(code) for code in range(0x20, 0x7f))
+
+
+class StageTimeline:
+    """記錄每個階段相對於流程開始的起迄時間 (多執行緒共用)"""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.stages = []
+        self._lock = threading.Lock()
+
+    def add(self, name, start, end, waiting=False):
+        """waiting=True 表示只是在等其他階段，不計入依序執行的總時間"""
+        with self._lock:
+            self.stages.append({'stage': name, 'start': start - self.origin, 'end': end - self.origin,
+                                'waiting': waiting})
+
+    def run(self, name, func, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.add(name, start, time.perf_counter())
+
+    def elapsed(self):
+        return time.perf_counter() - self.origin
+
+    def print_report(self):
+        total = self.elapsed()
+        print(f"\n⏱ 各階段耗時 (總共 {total:.1f}秒):")
+        width = 40
+        for stage in sorted(self.stages, key=lambda stage: stage['start']):
+            begin = int(stage['start'] / max(total, 1e-6) * width)
+            end = max(begin + 1, int(stage['end'] / max(total, 1e-6) * width))
+            bar = ' ' * begin + ('░' if stage['waiting'] else '█') * (end - begin)
+            print(f"  {stage['stage']:<12} {stage['start']:>6.1f}s → {stage['end']:>6.1f}s "
+                  f"({stage['end'] - stage['start']:>5.1f}s) |{bar:<{width}}|")
+
+        sequential = sum(stage['end'] - stage['start'] for stage in self.stages if not stage['waiting'])
+        if sequential > total:
+            print(f"📈 依序執行約需 {sequential:.1f}秒，重疊執行省下 {sequential - total:.1f}秒")
+
+
+def lyric_job_options(mode, api_url, cache_path, output_dir, onset_snap):
+    """optimize_lyrics.run_batch_job 的選項 (單首歌，LLM 併發使用預設上限)"""
+    return {'mode': mode, 'api_url': api_url, 'max_inflight': optimize_lyrics.LLM_MAX_CONCURRENCY,
+            'batch_size': optimize_lyrics.TRANSLATE_BATCH_SIZE, 'cache_path': cache_path,
+            'output_dir': output_dir, 'onset_snap': onset_snap}
+
+
+def prefetch_font_text(reference_file, song_title):
+    """歌詞優化完成前就能確定的用字：標題、參考歌詞與英文字元"""
+    text = song_title + ASCII_TEXT
+    if reference_file and os.path.exists(reference_file):
+        with open(reference_file, 'r', encoding='utf-8') as f:
+            text += f.read()
+    return text
+
+
+def stop_lyric_job(executor):
+    """
+    提前結束時不等歌詞優化：取消還沒開始的工作並終止歌詞行程
+    (執行中的 future 無法 cancel，離開 with 區塊時的 shutdown 會一直等到 LLM 工作完成)。
+    """
+    if hasattr(executor, 'terminate_workers'):
+        executor.terminate_workers()  # Python 3.14+
+        return
+    processes = list((getattr(executor, '_processes', None) or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    for process in processes:
+        process.join()
+
+
+def run_pipeline(audio_file, srt_file, reference_file, output_file, mode="llm", api_url=optimize_lyrics.OLLAMA_API_URL,
+                 cache_path=optimize_lyrics.LLM_CACHE_PATH, onset_snap=optimize_lyrics.ONSET_SNAP, lyrics_dir=None,
+                 font_path=None, bg_image_path=mmv.BG_IMAGE_PATH, bg_video_path=mmv.BG_VIDEO_PATH):
+    """
+    執行完整流程，成功回傳 {'lyrics', 'stages', 'seconds'}，失敗回傳 None。
+    歌詞優化的輸出與記錄檔放在 lyrics_dir (預設與 SRT 相同)。
+    """
+    timeline = StageTimeline()
+    job = {'srt': srt_file, 'reference': reference_file, 'audio': audio_file}
+    options = lyric_job_options(mode, api_url, cache_path, lyrics_dir, onset_snap)
+
+    # 先建立歌詞行程再啟動本地的執行緒，避免 fork 時複製到執行中的執行緒
+    with ProcessPoolExecutor(max_workers=1) as lyric_executor:
+        lyric_start = time.perf_counter()
+        lyric_future = lyric_executor.submit(optimize_lyrics.run_batch_job, job, options)
+        lyric_future.add_done_callback(lambda future: timeline.add("歌詞優化", lyric_start, time.perf_counter()))
+        print(f"🤖 歌詞優化已在背景開始 (模式: {mode})，記錄檔: "
+              f"{optimize_lyrics.batch_output_file(srt_file, lyrics_dir)}.log")
+
+        try:
+            if not mmv.begin_assets(audio_file, font_path=font_path):
+                stop_lyric_job(lyric_executor)
+                return None
+
+            font_text = prefetch_font_text(reference_file, mmv.SONG_TITLE)
+            with ThreadPoolExecutor(max_workers=3) as local_executor:
+                audio_future = local_executor.submit(timeline.run, "音訊分析", mmv.load_audio, audio_file)
+                font_future = local_executor.submit(timeline.run, "字體準備", mmv.load_fonts, font_text)
+                background_future = local_executor.submit(timeline.run, "背景準備", mmv.load_background_assets,
+                                                          bg_image_path, bg_video_path)
+                audio_future.result()
+                fonts = font_future.result()
+                background_future.result()
+        except BaseException:
+            # 本地準備失敗 (或 Ctrl+C)：同樣不等背景的歌詞優化
+            stop_lyric_job(lyric_executor)
+            raise
+        print(f"✓ 本地準備完成 ({timeline.elapsed():.1f}秒)，等待歌詞優化...")
+
+        wait_start = time.perf_counter()
+        lyrics = lyric_future.result()
+        timeline.add("等待歌詞", wait_start, time.perf_counter(), waiting=True)
+
+    if not lyrics['status'].startswith('完成'):
+        print(f"❌ 歌詞優化失敗 ({lyrics['status']})，詳見記錄檔: {lyrics['log']}")
+        return None
+    print(f"✓ 歌詞優化完成: {lyrics['lines']} 句 ({lyrics['status']})")
+
+    if not timeline.run("載入歌詞", mmv.load_lyrics, lyrics['output'], fonts, font_text):
+        return None
+    mmv.reset_render_state()
+    timeline.run("渲染編碼", mmv.render_video, audio_file, output_file)
+
+    timeline.print_report()
+    if lyrics.get('timings'):
+        timings = lyrics['timings']
+        print(f"   歌詞優化內部: 斷句 {timings['segment']:.1f}秒, 等待翻譯 {timings['translate_wait']:.1f}秒")
+    return {'lyrics': lyrics, 'stages': timeline.stages, 'seconds': timeline.elapsed()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="歌詞優化 + 影片渲染一鍵流程 (兩段重疊執行)")
+    parser.add_argument("--audio", required=True, help="音樂檔案")
+    parser.add_argument("--srt", required=True, help="原始 SRT 歌詞")
+    parser.add_argument("--reference", default=None, help="參考歌詞 (已標註標點，llm 模式必須)")
+    parser.add_argument("--output", default=None, help="輸出影片 (預設為音樂檔名 .mp4)")
+    parser.add_argument("--mode", choices=["llm", "basic"], default="llm", help="llm = 本地模型斷句與翻譯, basic = 基礎優化")
+    parser.add_argument("--api-url", default=optimize_lyrics.OLLAMA_API_URL, help="本地模型 API 端點")
+    parser.add_argument("--no-cache", action="store_true", help="不使用 LLM 回應快取")
+    parser.add_argument("--no-onset-snap", action="store_true", help="不把歌詞時間對齊到音樂的起音點")
+    parser.add_argument("--lyrics-dir", default=None, help="優化後 SRT 的輸出資料夾 (預設與 SRT 相同)")
+    parser.add_argument("--font", default=None, help="字體路徑 (預設使用 make_music_videos 的搜尋邏輯)")
+    parser.add_argument("--telemetry", default=None, help="渲染遙測輸出檔 (.prom 為 Prometheus textfile，其他為 JSON lines)")
+    parser.add_argument("--job-id", default=None, help="遙測的工作 ID (預設以音檔名稱加雜湊產生)")
+    args = parser.parse_args()
+
+    if args.telemetry:
+        mmv.TELEMETRY_PATH = args.telemetry
+        mmv.TELEMETRY_JOB_ID = args.job_id
+
+    output_file = args.output or f"{os.path.splitext(args.audio)[0]}.mp4"
+    result = run_pipeline(
+        args.audio, args.srt, args.reference, output_file, mode=args.mode, api_url=args.api_url,
+        cache_path=None if args.no_cache else optimize_lyrics.LLM_CACHE_PATH,
+        onset_snap=optimize_lyrics.ONSET_SNAP and not args.no_onset_snap, lyrics_dir=args.lyrics_dir,
+        font_path=args.font
+    )
+    if result is None:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
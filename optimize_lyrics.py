@@ -5,8 +5,331 @@ SRT 歌詞優化工具
 
 import pysrt
 from tkinter import Tk, filedialog
+import argparse
+import contextlib
+import glob
+import json
+import multiprocessing
 import os
+import queue
 import re
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from lyric_align import CharTimeline, clean_text
+
+# 本地模型 API 設定：端點 (Ollama)、同時進行的請求數與失敗重試次數
+OLLAMA_API_URL = "http://localhost:11434/v1"
+LLM_MAX_CONCURRENCY = 4
+LLM_MAX_RETRIES = 3
+# 每個翻譯請求包含的歌詞句數 (1 = 逐句翻譯)
+TRANSLATE_BATCH_SIZE = 8
+# LLM 回應快取 (None = 不使用快取) 與大小上限
+LLM_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_cache.sqlite")
+LLM_CACHE_MB = 256
+
+# 斷句：參考歌詞每段的行數，以及附在下一段前面作為上下文的重疊行數
+SEGMENT_MODEL = "qwen2.5"
+SEGMENT_CHUNK_LINES = 20
+SEGMENT_OVERLAP_LINES = 2
+
+# 有音樂檔時，把每句的開始與結束對齊到附近的音訊起音點 (見 onset_snap.py)
+ONSET_SNAP = True
+
+TRANSLATE_MODEL = "llama3.1"
+TRANSLATE_SYSTEM_PROMPT = "You are a professional translator. Translate Chinese lyrics to English concisely. Output ONLY the English translation, no explanations."
+
+
+def clean_translation(english_text, chinese_text):
+    """清理模型回覆中多餘的說明文字，只留下英文翻譯"""
+    # 移除常見的前綴
+    english_text = re.sub(r'^(Here\'s|Here is|Translation:|English translation:?|Line \d+:)\s*', '', english_text, flags=re.IGNORECASE)
+    # 移除引號
+    english_text = english_text.strip('"\'')
+    # 只取第一行（如果有多行說明）
+    english_text = english_text.split('\n')[0].strip()
+
+    # 如果還是包含說明性文字，嘗試提取實際翻譯
+    if 'translation' in english_text.lower() or 'here' in english_text.lower():
+        # 嘗試找到冒號後面的內容
+        if ':' in english_text:
+            english_text = english_text.split(':', 1)[1].strip().strip('"\'')
+
+    # 移除中文原文（如果AI重複了）
+    if chinese_text in english_text:
+        english_text = english_text.replace(chinese_text, '').strip()
+    return english_text
+
+
+def translate_line(client, chinese_text):
+    """用英文模型翻譯一句歌詞，回傳清理後的英文 (失敗時拋出例外)"""
+    # 簡化 prompt，直接要求翻譯
+    translate_prompt = f"""Translate this Chinese lyric to English. Keep it poetic and natural for singing:
+
+{chinese_text}
+
+English translation (one line only):"""
+
+    english_text = client.chat_text(
+        TRANSLATE_MODEL,
+        [
+            {"role": "system", "content": TRANSLATE_SYSTEM_PROMPT},
+            {"role": "user", "content": translate_prompt}
+        ],
+        temperature=0.5,
+        max_tokens=100,
+        timeout=30
+    )
+    return clean_translation(english_text.strip(), chinese_text)
+
+
+def parse_batch_translation(reply, count):
+    """
+    解析批次翻譯的回覆：應為 [{"id": 1, "en": "..."}, ...] 的 JSON 陣列。
+    數量、編號順序或格式不符時拋出 ValueError。
+    """
+    start, end = reply.find('['), reply.rfind(']')
+    if start < 0 or end < start:
+        raise ValueError("回覆中沒有 JSON 陣列")
+    items = json.loads(reply[start:end + 1])
+    if not isinstance(items, list) or len(items) != count:
+        raise ValueError(f"翻譯數量不符 (預期 {count} 句)")
+
+    english_lines = []
+    for n, item in enumerate(items, 1):
+        if not isinstance(item, dict) or item.get('id') != n:
+            raise ValueError(f"第 {n} 項的編號或順序不符")
+        english_text = item.get('en')
+        if not isinstance(english_text, str) or not english_text.strip():
+            raise ValueError(f"第 {n} 項沒有翻譯")
+        english_lines.append(english_text.strip())
+    return english_lines
+
+
+def translate_batch(client, chinese_lines):
+    """一次翻譯多句歌詞 (模型可參考前後句)，回傳與輸入同順序的英文列表"""
+    numbered = "\n".join(f"{n}. {text}" for n, text in enumerate(chinese_lines, 1))
+    translate_prompt = f"""Translate these numbered Chinese lyric lines to English. Keep each line poetic and natural for singing, using the neighbouring lines as context:
+
+{numbered}
+
+Reply with ONLY a JSON array of exactly {len(chinese_lines)} objects in the same order, one per line, like [{{"id": 1, "en": "..."}}]."""
+
+    reply = client.chat_text(
+        TRANSLATE_MODEL,
+        [
+            {"role": "system", "content": TRANSLATE_SYSTEM_PROMPT},
+            {"role": "user", "content": translate_prompt}
+        ],
+        temperature=0.5,
+        max_tokens=60 * len(chinese_lines) + 50,
+        timeout=30 + 10 * len(chinese_lines)
+    )
+    english_lines = parse_batch_translation(reply, len(chinese_lines))
+    return [clean_translation(english_text, chinese_text)
+            for english_text, chinese_text in zip(english_lines, chinese_lines)]
+
+
+def translate_lines(client, chinese_lines, batch_size=TRANSLATE_BATCH_SIZE):
+    """
+    翻譯所有歌詞，結果依原本順序回傳 (失敗的句子為 Exception)。
+    重複的句子 (例如副歌) 只翻譯一次。
+    batch_size > 1 時每個請求翻譯 batch_size 句，批次回覆格式不符的句子再逐句重送。
+    回傳 (翻譯列表, 逐句重送的句數)
+    """
+    unique_lines = list(dict.fromkeys(chinese_lines))
+    if len(unique_lines) < len(chinese_lines):
+        translations, fallback_count = translate_lines(client, unique_lines, batch_size)
+        by_text = dict(zip(unique_lines, translations))
+        return [by_text[text] for text in chinese_lines], fallback_count
+
+    if batch_size <= 1:
+        return client.map(lambda text: translate_line(client, text), chinese_lines), 0
+
+    batches = [chinese_lines[i:i + batch_size] for i in range(0, len(chinese_lines), batch_size)]
+    batch_results = client.map(lambda batch: translate_batch(client, batch), batches)
+
+    translations = []
+    retry_indices = []
+    for batch, result in zip(batches, batch_results):
+        if isinstance(result, Exception):
+            retry_indices.extend(range(len(translations), len(translations) + len(batch)))
+            translations.extend([result] * len(batch))
+        else:
+            translations.extend(result)
+
+    if retry_indices:
+        print(f"  ⚠ {len(retry_indices)} 句的批次回覆不正確，改為逐句翻譯")
+        retried = client.map(lambda index: translate_line(client, chinese_lines[index]), retry_indices)
+        for index, result in zip(retry_indices, retried):
+            translations[index] = result
+    return translations, len(retry_indices)
+
+
+class StreamingTranslator:
+    """
+    邊收到斷句結果邊送出翻譯：每湊滿 batch_size 句 (不重複) 就在背景送出一個批次，
+    最後由 results() 依原本順序取回所有翻譯。
+    有翻譯日誌時，日誌中已有的句子不再送出，每個批次完成後立即把成功的翻譯寫入日誌。
+    """
+
+    def __init__(self, client, batch_size=TRANSLATE_BATCH_SIZE, journal=None):
+        self.client = client
+        self.batch_size = max(1, batch_size)
+        self.journal = journal
+        self.executor = ThreadPoolExecutor(max_workers=client.max_concurrency)
+        self.pending = []     # 尚未送出的句子
+        self.submitted = {}   # 句子 -> (批次的 future, 在批次中的位置)
+
+    def add(self, text):
+        if text in self.submitted or text in self.pending:
+            return
+        if self.journal is not None and text in self.journal:
+            return
+        self.pending.append(text)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        future = self.executor.submit(translate_lines, self.client, batch, self.batch_size)
+        if self.journal is not None:
+            future.add_done_callback(lambda done, batch=batch: self._write_journal(batch, done))
+        for position, text in enumerate(batch):
+            self.submitted[text] = (future, position)
+
+    def _write_journal(self, batch, future):
+        if future.exception() is not None:
+            return
+        for text, english_text in zip(batch, future.result()[0]):
+            if not isinstance(english_text, Exception):
+                self.journal.record(text, english_text)
+
+    def results(self, chinese_lines):
+        """等待並回傳 (翻譯列表, 逐句重送的句數)，失敗的句子為 Exception"""
+        self.flush()
+        translations = []
+        for text in chinese_lines:
+            if text not in self.submitted:
+                translations.append(self.journal.get(text))
+                continue
+            future, position = self.submitted[text]
+            try:
+                translations.append(future.result()[0][position])
+            except Exception as e:
+                translations.append(e)
+
+        futures = {future for future, _ in self.submitted.values()}
+        fallback_count = sum(future.result()[1] for future in futures if future.exception() is None)
+        return translations, fallback_count
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def build_segment_prompt(reference_text, context_text=""):
+    """斷句提示詞；context_text 為上一段結尾的幾行，只供模型參考"""
+    context_section = ""
+    if context_text:
+        context_section = f"""
+【前文】（只供參考，不要輸出）：
+{context_text}
+"""
+    return f"""請將參考歌詞按斷句方式分行輸出。
+{context_section}
+【參考歌詞】：
+{reference_text}
+
+🚨 重要規則：
+1. 嚴格按照參考歌詞的斷句（標點符號、換行）來分割
+2. 完全保留原文，一個字都不能改（包括標點符號）
+3. 每個句號、問號、驚嘆號後換行
+4. 每個逗號可以考慮換行（如果句子太長）
+5. 只輸出歌詞，每行一句，不要添加序號
+
+請直接輸出分行後的歌詞：
+"""
+
+
+def parse_segment_line(line):
+    """清理模型輸出的一行，太短或空白時回傳 None"""
+    line = line.strip()
+    # 移除可能的序號
+    line = re.sub(r'^\d+[\.\、]\s*', '', line)
+    # 移除可能的標點符號開頭
+    line = re.sub(r'^[，。、！？：；]\s*', '', line)
+    if line and len(line) > 2:  # 過濾掉太短的行
+        return line
+    return None
+
+
+def split_reference_chunks(reference_text, chunk_lines=SEGMENT_CHUNK_LINES, overlap_lines=SEGMENT_OVERLAP_LINES):
+    """把參考歌詞按行切段，回傳 [(上下文, 這段歌詞), ...]；上下文為前一段最後 overlap_lines 行"""
+    lines = [line for line in reference_text.split('\n') if line.strip()]
+    chunk_lines = max(1, chunk_lines)
+    chunks = []
+    for start in range(0, len(lines), chunk_lines):
+        context = lines[max(0, start - overlap_lines):start]
+        chunks.append(('\n'.join(context), '\n'.join(lines[start:start + chunk_lines])))
+    return chunks
+
+
+def stream_segmented_lines(client, reference_text):
+    """
+    分段串流斷句：所有段落同時送出 (受 client 的併發上限限制)，
+    每段的回應邊收邊切成完整的行，依段落順序逐行 yield。
+    """
+    chunks = split_reference_chunks(reference_text)
+    if not chunks:
+        return
+    done = object()
+    line_queues = [queue.Queue() for _ in chunks]
+
+    def run(index):
+        context_text, chunk_text = chunks[index]
+        output = line_queues[index]
+        buffer = ""
+        try:
+            for delta in client.chat_stream(
+                SEGMENT_MODEL,
+                [
+                    {"role": "system", "content": "你是一個專業的歌詞編輯。"},
+                    {"role": "user", "content": build_segment_prompt(chunk_text, context_text)}
+                ],
+                temperature=0.7,
+                max_tokens=2000,
+                timeout=60
+            ):
+                buffer += delta
+                *complete, buffer = buffer.split('\n')
+                for line in complete:
+                    parsed = parse_segment_line(line)
+                    if parsed:
+                        output.put(parsed)
+            parsed = parse_segment_line(buffer)
+            if parsed:
+                output.put(parsed)
+            output.put(done)
+        except Exception as e:
+            output.put(e)
+
+    executor = ThreadPoolExecutor(max_workers=min(len(chunks), client.max_concurrency))
+    try:
+        for index in range(len(chunks)):
+            executor.submit(run, index)
+        for output in line_queues:
+            while True:
+                item = output.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
 
 def optimize_lyrics_basic(srt_file, output_file):
     """
@@ -116,17 +439,50 @@ def optimize_lyrics_basic(srt_file, output_file):
     print("  - 合併過短的句子（< 6字且間隔 < 0.5秒）")
     print("  - 分割過長的句子（> 25字）於標點符號處")
     print("  - 時間分配根據字數比例自動調整")
+    return {'lines': len(optimized_subs), 'exact_matches': None}
 
 
-def optimize_lyrics_local_gpt(srt_file, output_file, api_url="http://localhost:1234/v1", reference_lyrics_file=None):
+def optimize_lyrics_local_gpt(srt_file, output_file, api_url="http://localhost:1234/v1", reference_lyrics_file=None,
+                              max_concurrency=LLM_MAX_CONCURRENCY, batch_size=TRANSLATE_BATCH_SIZE,
+                              cache_path=LLM_CACHE_PATH, resume=True, llm_slots=None, audio_file=None):
     """
     使用本地 GPT 模型優化斷句
     支援 LM Studio, Ollama, vLLM 等本地模型
     可選參考歌詞文件（已標註標點符號）
+    翻譯請求會以最多 max_concurrency 個同時送出，每個請求翻譯 batch_size 句，結果仍依原本順序組合
+    cache_path 不為 None 時，模型回應會快取在該 SQLite 檔，重新處理同一首歌不必再等模型
+    每句翻譯完成就寫入輸出檔旁的翻譯日誌；resume=True 時沿用上次中斷前已完成的翻譯
+    llm_slots 為多個工作共用的進行中請求上限 (見 llm_client.LLMClient)
+    指定 audio_file 時，音訊起音點分析與模型請求同時進行，對齊後的時間再微調到附近的起音點
+    成功時回傳句數、精確匹配數、各階段耗時與 LLM 請求統計，失敗時回傳 None
     """
+    client = None
+    translator = None
+    journal = None
+    onset_executor = None
     try:
         import requests
         import json
+        from llm_client import LLMClient
+        from llm_cache import LLMCache
+        from translation_journal import TranslationJournal
+        
+        cache = LLMCache(cache_path, LLM_CACHE_MB) if cache_path else None
+        client = LLMClient(api_url, max_concurrency=max_concurrency, max_retries=LLM_MAX_RETRIES, cache=cache,
+                           slots=llm_slots)
+        
+        if not resume and os.path.exists(f"{output_file}.journal.jsonl"):
+            os.remove(f"{output_file}.journal.jsonl")
+        journal = TranslationJournal(output_file, TRANSLATE_MODEL)
+        if journal.resumed:
+            print(f"♻ 從翻譯日誌恢復 {journal.resumed} 句已完成的翻譯: {journal.path}")
+        
+        # 起音點分析是本地 CPU 工作，在等待模型回應時於背景執行
+        onset_future = None
+        if audio_file:
+            from onset_snap import load_onsets
+            onset_executor = ThreadPoolExecutor(max_workers=1)
+            onset_future = onset_executor.submit(load_onsets, audio_file)
         
         # 讀取原始字幕
         subs = pysrt.open(srt_file, encoding='utf-8')
@@ -158,166 +514,75 @@ def optimize_lyrics_local_gpt(srt_file, output_file, api_url="http://localhost:1
 {reference_text}
 
 請根據參考歌詞的斷句方式，將原始歌詞重新分割，保持時間軸的準確性。
-"""
-        
-        prompt = f"""請將參考歌詞按斷句方式分行輸出。
-
-【參考歌詞】：
-{reference_text}
-
-🚨 重要規則：
-1. 嚴格按照參考歌詞的斷句（標點符號、換行）來分割
-2. 完全保留原文，一個字都不能改（包括標點符號）
-3. 每個句號、問號、驚嘆號後換行
-4. 每個逗號可以考慮換行（如果句子太長）
-5. 只輸出歌詞，每行一句，不要添加序號
-
-請直接輸出分行後的歌詞：
 """
         
         print("正在使用本地 GPT 模型優化歌詞...")
         print(f"API 端點: {api_url}")
         
-        # 調用本地模型 API
-        response = requests.post(
-            f"{api_url}/chat/completions",
-            headers={"Content-Type": "application/json"},
-            json={
-                "model": "qwen2.5",
-                "messages": [
-                    {"role": "system", "content": "你是一個專業的歌詞編輯。"},
-                    {"role": "user", "content": prompt}
-                ],
-                "temperature": 0.7,
-                "max_tokens": 2000
-            },
-            timeout=60
-        )
-        
-        if response.status_code != 200:
-            print(f"❌ API 請求失敗: {response.status_code}")
-            print(f"回應: {response.text}")
-            return
+        # 時間分配：原始 SRT 的每個字存成陣列，重新斷句後的歌詞以編輯距離對齊後決定時間
+        optimized_subs = pysrt.SubRipFile()
         
-        result = response.json()
-        optimized_text = result['choices'][0]['message']['content']
+        # 步驟1: 建立原始 SRT 的字符時間表
+        timeline = CharTimeline(subs)
         
-        # 解析優化後的歌詞
+        # 步驟2: 串流接收斷句結果，完成的句子立即送去翻譯
         optimized_lines = []
-        for line in optimized_text.split('\n'):
-            line = line.strip()
-            # 移除可能的序號
-            line = re.sub(r'^\d+[\.\、]\s*', '', line)
-            # 移除可能的標點符號開頭
-            line = re.sub(r'^[，。、！？：；]\s*', '', line)
-            if line and len(line) > 2:  # 過濾掉太短的行
-                optimized_lines.append(line)
+        translator = StreamingTranslator(client, batch_size, journal)
+        segment_start = time.perf_counter()
         
+        for line in stream_segmented_lines(client, reference_text):
+            line_text = line.strip()
+            # 沒有實際歌詞文字的行不輸出
+            if not clean_text(line_text):
+                continue
+            optimized_lines.append(line_text)
+            translator.add(line_text)
+        
+        segment_elapsed = time.perf_counter() - segment_start
         print(f"\n優化後得到 {len(optimized_lines)} 句歌詞")
         
         if len(optimized_lines) == 0:
             print("❌ 沒有獲得有效的優化結果")
             return
         
-        # 智能時間分配：結合精確匹配和字符映射
-        optimized_subs = pysrt.SubRipFile()
-        
-        # 步驟1: 建立原始 SRT 的字符到時間映射
-        char_time_map = []  # 每個字符對應的時間
-        original_subs_dict = {}  # 用於精確匹配：完整文本 -> 原始字幕項列表
+        # 步驟3: 對齊字符並為每句歌詞分配時間
+        align_start = time.perf_counter()
+        line_times, align_stats = timeline.assign(optimized_lines)
+        align_elapsed = time.perf_counter() - align_start
         
-        for sub in subs:
-            raw_text = sub.text.strip()
-            text = sub.text.replace('\n', '').strip()
-            # 去除標點符號，只保留實際歌詞文字
-            clean_text = re.sub(r'[，。、！？：；\s]', '', text)
-            
-            # 建立文本到字幕的映射（用於精確匹配）
-            original_subs_dict.setdefault(raw_text, []).append(sub)
-            
-            duration = sub.end.ordinal - sub.start.ordinal
-            
-            # 為每個字符分配時間（線性插值）
-            for i, char in enumerate(clean_text):
-                char_start = sub.start.ordinal + int(duration * i / max(1, len(clean_text)))
-                char_end = sub.start.ordinal + int(duration * (i + 1) / max(1, len(clean_text)))
-                
-                char_time_map.append({
-                    'char': char,
-                    'start': char_start,
-                    'end': char_end
-                })
-        
-        # 步驟2: 檢查字符數量
-        optimized_chars = []
-        for line in optimized_lines:
-            clean_line = re.sub(r'[，。、！？：；\s]', '', line.strip())
-            optimized_chars.extend(list(clean_line))
-        
-        print(f"\n📊 字符匹配分析:")
-        print(f"  原始 SRT 字符數: {len(char_time_map)}")
-        print(f"  優化歌詞字符數: {len(optimized_chars)}")
+        print(f"\n📊 字符對齊分析:")
+        print(f"  原始 SRT 字符數: {len(timeline)}")
+        print(f"  優化歌詞字符數: {sum(len(clean_text(line)) for line in optimized_lines)}")
         print(f"  原始 SRT 句數: {len(subs)}")
+        print(f"  相同 {align_stats['same']} 字, 替換 {align_stats['substituted']} 字, "
+              f"多出 {align_stats['inserted']} 字, 缺少 {align_stats['deleted']} 字 ({align_elapsed * 1000:.0f} ms)")
         
-        # 步驟3: 為每句優化後的歌詞分配時間
-        char_index = 0
+        # 步驟4 (可選): 把開始與結束時間對齊到附近的起音點
+        onset_wait = onset_elapsed = 0.0
+        if onset_future is not None:
+            wait_start = time.perf_counter()
+            try:
+                onsets = onset_future.result()
+            except Exception as e:
+                print(f"\n⚠ 起音點分析失敗，使用對齊後的時間: {e}")
+            else:
+                onset_wait = time.perf_counter() - wait_start
+                snap_start = time.perf_counter()
+                starts, ends, snap_stats = onsets.snap([start for start, _, _ in line_times],
+                                                       [end for _, end, _ in line_times])
+                line_times = [(int(start), int(end), kind)
+                              for start, end, (_, _, kind) in zip(starts, ends, line_times)]
+                onset_elapsed = time.perf_counter() - snap_start
+                source = "讀取快取" if onsets.cached else f"等待分析 {onset_wait:.1f}秒"
+                print(f"\n🎵 起音點對齊: {len(onsets)} 個起音點 ({source}), "
+                      f"調整開始 {snap_stats['starts']} 句, 結束 {snap_stats['ends']} 句, "
+                      f"保留原時間 {snap_stats['kept']} 句 ({onset_elapsed * 1000:.1f} ms)")
+        
+        indicators = {'exact': "✓ 精確匹配", 'aligned': "○ 字符對齊", 'unmatched': "⚠ 找不到對應"}
         exact_matches = 0
-        
-        for i, line in enumerate(optimized_lines):
-            line_text = line.strip()
-            if not line_text:
-                continue
-            
-            # 計算這句歌詞的純文字
-            line_clean = re.sub(r'[，。、！？：；\s]', '', line_text)
-            line_char_count = len(line_clean)
-            
-            if line_char_count == 0:
-                continue
-            
-            # 嘗試精確匹配：如果這句歌詞在原始 SRT 中完全相同
-            if line_text in original_subs_dict and original_subs_dict[line_text]:
-                # 找到完全匹配！使用原始 SRT 的時間
-                matched_sub = original_subs_dict[line_text].pop(0)
-                start_time = matched_sub.start.ordinal
-                end_time = matched_sub.end.ordinal
+        for i, (line_text, (start_time, end_time, kind)) in enumerate(zip(optimized_lines, line_times)):
+            if kind == 'exact':
                 exact_matches += 1
-                
-                # 更新字符索引（跳過這些字符）
-                char_index += line_char_count
-                
-                match_indicator = "✓ 精確匹配"
-            else:
-                # 沒有完全匹配，使用字符映射
-                start_idx = char_index
-                end_idx = min(char_index + line_char_count - 1, len(char_time_map) - 1)
-                
-                # 處理超出範圍的情況
-                if start_idx >= len(char_time_map):
-                    if len(optimized_subs) > 0:
-                        last_sub = optimized_subs[-1]
-                        avg_duration = 2000
-                        start_time = last_sub.end.ordinal
-                        end_time = start_time + avg_duration
-                    else:
-                        start_time = subs[0].start.ordinal
-                        end_time = subs[-1].end.ordinal
-                    match_indicator = "⚠ 超出範圍"
-                else:
-                    start_time = char_time_map[start_idx]['start']
-                    
-                    if end_idx < len(char_time_map):
-                        end_time = char_time_map[end_idx]['end']
-                    else:
-                        end_time = char_time_map[-1]['end']
-                    
-                    if end_time <= start_time:
-                        end_time = start_time + 500
-                    
-                    match_indicator = "○ 字符映射"
-                
-                # 更新字符索引
-                char_index = end_idx + 1
             
             # 創建字幕項
             sub = pysrt.SubRipItem(
@@ -330,7 +595,7 @@ def optimize_lyrics_local_gpt(srt_file, output_file, api_url="http://localhost:1
             
             # 顯示進度
             duration_sec = (end_time - start_time) / 1000.0
-            print(f"  {i+1}. {line_text[:18]}... → {duration_sec:.1f}秒 ({line_char_count}字) {match_indicator}")
+            print(f"  {i+1}. {line_text[:18]}... → {duration_sec:.1f}秒 ({len(clean_text(line_text))}字) {indicators[kind]}")
         
         print(f"\n✨ 精確匹配: {exact_matches}/{len(optimized_lines)} 句")
         
@@ -355,65 +620,22 @@ def optimize_lyrics_local_gpt(srt_file, output_file, api_url="http://localhost:1
         all_lyrics = [sub.text for sub in optimized_subs]
         context_text = "\n".join([f"{i+1}. {text}" for i, text in enumerate(all_lyrics)])
         
-        for i, sub in enumerate(optimized_subs):
+        # 翻譯請求在斷句時已陸續送出，這裡依原本順序取回結果
+        translate_start = time.perf_counter()
+        translations, fallback_count = translator.results([sub.text for sub in optimized_subs])
+        translate_elapsed = time.perf_counter() - translate_start
+        
+        for i, (sub, english_text) in enumerate(zip(optimized_subs, translations)):
             chinese_text = sub.text
             
-            # 調用 API 進行翻譯（使用英文模型）
-            try:
-                # 簡化 prompt，直接要求翻譯
-                translate_prompt = f"""Translate this Chinese lyric to English. Keep it poetic and natural for singing:
-
-{chinese_text}
-
-English translation (one line only):"""
-                
-                translate_response = requests.post(
-                    f"{api_url}/chat/completions",
-                    headers={"Content-Type": "application/json"},
-                    json={
-                        "model": "llama3.1",
-                        "messages": [
-                            {"role": "system", "content": "You are a professional translator. Translate Chinese lyrics to English concisely. Output ONLY the English translation, no explanations."},
-                            {"role": "user", "content": translate_prompt}
-                        ],
-                        "temperature": 0.5,
-                        "max_tokens": 100
-                    },
-                    timeout=30
-                )
-                
-                if translate_response.status_code == 200:
-                    english_text = translate_response.json()['choices'][0]['message']['content'].strip()
-                    
-                    # 清理多餘的說明文字
-                    # 移除常見的前綴
-                    english_text = re.sub(r'^(Here\'s|Here is|Translation:|English translation:?|Line \d+:)\s*', '', english_text, flags=re.IGNORECASE)
-                    # 移除引號
-                    english_text = english_text.strip('"\'')
-                    # 只取第一行（如果有多行說明）
-                    english_text = english_text.split('\n')[0].strip()
-                    
-                    # 如果還是包含說明性文字，嘗試提取實際翻譯
-                    if 'translation' in english_text.lower() or 'here' in english_text.lower():
-                        # 嘗試找到冒號後面的內容
-                        if ':' in english_text:
-                            english_text = english_text.split(':', 1)[1].strip().strip('"\'')
-                    
-                    # 移除中文原文（如果AI重複了）
-                    if chinese_text in english_text:
-                        english_text = english_text.replace(chinese_text, '').strip()
-                    
-                    # 保留中文原文 + 添加英文翻譯
-                    combined_text = f"{chinese_text}\n{english_text}"
-                    print(f"  {i+1}/{len(optimized_subs)}: ✓ ({chinese_text[:10]}...)")
-                else:
-                    # 翻譯失敗，只保留中文原文
-                    combined_text = chinese_text
-                    print(f"  {i+1}/{len(optimized_subs)}: ✗ (失敗，保留原文)")
-                    
-            except Exception as e:
+            if isinstance(english_text, Exception):
+                # 翻譯失敗，只保留中文原文
                 combined_text = chinese_text
-                print(f"  {i+1}/{len(optimized_subs)}: ✗")
+                print(f"  {i+1}/{len(optimized_subs)}: ✗ (失敗，保留原文: {english_text})")
+            else:
+                # 保留中文原文 + 添加英文翻譯
+                combined_text = f"{chinese_text}\n{english_text}"
+                print(f"  {i+1}/{len(optimized_subs)}: ✓ ({chinese_text[:10]}...)")
             
             # 最終輸出：移除標點符號（逗點改空白）
             combined_text = "\n".join([clean_punctuation(line) for line in combined_text.split("\n") if line.strip()])
@@ -427,18 +649,56 @@ English translation (one line only):"""
             )
             translated_subs.append(new_sub)
         
-        translated_subs.save(output_file, encoding='utf-8')
+        # 先寫到暫存檔再取代，中斷時不會留下寫到一半的輸出檔
+        temp_file = f"{output_file}.tmp"
+        translated_subs.save(temp_file, encoding='utf-8')
+        os.replace(temp_file, output_file)
+        
+        # 全部翻譯成功才刪除日誌；有失敗的句子時保留，重新執行只會翻譯這些句子
+        failed_count = sum(1 for english_text in translations if isinstance(english_text, Exception))
+        journal.close(remove=failed_count == 0)
+        if failed_count:
+            print(f"\n⚠ {failed_count} 句翻譯失敗，翻譯日誌已保留，重新執行只會翻譯這些句子")
         print(f"\n✅ 優化和翻譯完成！已儲存至: {output_file}")
         print(f"📊 總共 {len(translated_subs)} 句歌詞（中英雙語）")
-        print(f"🎯 使用模型: qwen2.5 (斷句優化) + llama3.1 (英文翻譯)")
-        
-    except ImportError:
-        print("❌ 需要安裝 requests 套件: pip install requests")
+        print(f"🎯 使用模型: qwen2.5 (斷句優化) + {TRANSLATE_MODEL} (英文翻譯)")
+        print(f"⏱ 斷句耗時: {segment_elapsed:.1f}秒, 斷句後等待翻譯: {translate_elapsed:.1f}秒 "
+              f"(每批 {max(1, batch_size)} 句, 逐句重送 {fallback_count} 句)")
+        line_count = max(1, len(optimized_subs))
+        translate_latency = sum(client.latencies.get(TRANSLATE_MODEL, []))
+        translate_tokens = sum(client.usage.get(TRANSLATE_MODEL, {}).values())
+        print(f"   每句平均: 延遲 {translate_latency / line_count:.2f}秒, {translate_tokens / line_count:.0f} tokens")
+        client.print_stats()
+        return {
+            'lines': len(translated_subs),
+            'exact_matches': exact_matches,
+            'failed_translations': failed_count,
+            'timings': {'segment': segment_elapsed, 'align': align_elapsed, 'onset_wait': onset_wait,
+                        'onset_snap': onset_elapsed, 'translate_wait': translate_elapsed},
+            'llm_requests': {model: len(values) for model, values in client.latencies.items()},
+            'llm_seconds': {model: sum(values) for model, values in client.latencies.items()},
+            'llm_retries': client.retries,
+            'llm_failures': client.failures,
+        }
+        
+    except ImportError as e:
+        print(f"❌ 需要安裝 {e.name or 'requests'} 套件: pip install {e.name or 'requests'}")
     except requests.exceptions.ConnectionError:
         print(f"❌ 無法連接到本地模型 API: {api_url}")
         print("請確認本地模型服務正在運行")
     except Exception as e:
         print(f"❌ 本地模型優化失敗: {e}")
+    finally:
+        if onset_executor is not None:
+            onset_executor.shutdown(wait=False, cancel_futures=True)
+        if translator is not None:
+            translator.close()
+        if journal is not None:
+            journal.close()
+        if client is not None:
+            client.close()
+            if client.cache is not None:
+                client.cache.close()
 
 
 def optimize_lyrics_ai(srt_file, output_file):
@@ -505,7 +765,165 @@ def optimize_lyrics_ai(srt_file, output_file):
         print(f"❌ AI 優化失敗: {e}")
 
 
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.m4a', '.flac')
+OUTPUT_SUFFIX = "_優化"
+
+
+def find_batch_jobs(batch_path):
+    """
+    讀取批次工作列表，回傳 [{'srt', 'reference', 'audio'}, ...]。
+    batch_path 為資料夾時，每個 .srt 搭配同名的 .txt (參考歌詞) 與音樂檔；
+    為 JSON 檔時，內容為 [{"srt": ..., "reference": ..., "audio": ...}, ...]，相對路徑以 JSON 所在資料夾為準。
+    """
+    if os.path.isdir(batch_path):
+        jobs = []
+        for srt_file in sorted(glob.glob(os.path.join(batch_path, "*.srt"))):
+            base_name = os.path.splitext(srt_file)[0]
+            if base_name.endswith(OUTPUT_SUFFIX):
+                continue
+            reference = f"{base_name}.txt"
+            audio = next((f"{base_name}{ext}" for ext in AUDIO_EXTENSIONS if os.path.exists(f"{base_name}{ext}")), None)
+            jobs.append({'srt': srt_file, 'reference': reference if os.path.exists(reference) else None, 'audio': audio})
+        return jobs
+
+    with open(batch_path, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    root_dir = os.path.dirname(os.path.abspath(batch_path))
+
+    def resolve(path):
+        return os.path.join(root_dir, path) if path and not os.path.isabs(path) else path
+
+    return [{'srt': resolve(entry['srt']), 'reference': resolve(entry.get('reference')),
+             'audio': resolve(entry.get('audio'))} for entry in entries]
+
+
+def batch_output_file(srt_file, output_dir=None):
+    base_name = os.path.splitext(os.path.basename(srt_file))[0]
+    return os.path.join(output_dir or os.path.dirname(os.path.abspath(srt_file)), f"{base_name}{OUTPUT_SUFFIX}.srt")
+
+
+def run_batch_job(job, options, llm_slots=None):
+    """
+    在工作行程中處理一首歌，所有輸出寫入 <輸出檔>.log。
+    回傳 {'name', 'status', 'seconds', 'lines', 'exact_matches', 'log', 'output', 'timings'}
+    """
+    output_file = batch_output_file(job['srt'], options['output_dir'])
+    log_file = f"{output_file}.log"
+    summary = {'name': os.path.basename(job['srt']), 'status': '失敗', 'seconds': 0.0,
+               'lines': None, 'exact_matches': None, 'log': log_file, 'output': output_file, 'timings': None}
+
+    if options['mode'] == 'llm' and not (job['reference'] and os.path.exists(job['reference'])):
+        summary['status'] = '缺少參考歌詞'
+        return summary
+
+    start = time.perf_counter()
+    with open(log_file, 'w', encoding='utf-8') as log, contextlib.redirect_stdout(log):
+        try:
+            if job['audio']:
+                print(f"🎵 音樂檔案: {os.path.basename(job['audio'])}")
+            if options['mode'] == 'basic':
+                result = optimize_lyrics_basic(job['srt'], output_file)
+            else:
+                result = optimize_lyrics_local_gpt(
+                    job['srt'], output_file, options['api_url'], job['reference'],
+                    max_concurrency=options['max_inflight'], batch_size=options['batch_size'],
+                    cache_path=options['cache_path'], llm_slots=llm_slots,
+                    audio_file=job['audio'] if options['onset_snap'] else None
+                )
+        except Exception as e:
+            print(f"❌ 處理失敗: {e}")
+            result = None
+    summary['seconds'] = time.perf_counter() - start
+
+    if result:
+        summary.update(status='完成', lines=result['lines'], exact_matches=result['exact_matches'],
+                       timings=result.get('timings'))
+        if result.get('failed_translations'):
+            summary['status'] = f"完成 ({result['failed_translations']} 句未翻譯)"
+    return summary
+
+
+def run_batch(batch_path, mode="llm", workers=2, max_inflight=LLM_MAX_CONCURRENCY, api_url=OLLAMA_API_URL,
+              batch_size=TRANSLATE_BATCH_SIZE, cache_path=LLM_CACHE_PATH, output_dir=None, onset_snap=ONSET_SNAP):
+    """
+    無人值守的批次處理：以 workers 個行程同時處理多首歌，
+    所有行程共用最多 max_inflight 個進行中的 LLM 請求。回傳每首歌的結果列表。
+    """
+    jobs = find_batch_jobs(batch_path)
+    if not jobs:
+        print(f"❌ 找不到任何 SRT 檔案: {batch_path}")
+        return []
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    options = {'mode': mode, 'api_url': api_url, 'max_inflight': max_inflight, 'batch_size': batch_size,
+               'cache_path': cache_path, 'output_dir': output_dir, 'onset_snap': onset_snap}
+    print(f"📂 共 {len(jobs)} 首歌, 模式: {mode}, {workers} 個工作行程, LLM 併發上限 {max_inflight}")
+
+    start = time.perf_counter()
+    results = [None] * len(jobs)
+    with multiprocessing.Manager() as manager:
+        llm_slots = manager.BoundedSemaphore(max_inflight) if mode == 'llm' else None
+        with ProcessPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = {executor.submit(run_batch_job, job, options, llm_slots): index for index, job in enumerate(jobs)}
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    results[index] = {'name': os.path.basename(jobs[index]['srt']), 'status': f'失敗: {e}',
+                                      'seconds': 0.0, 'lines': None, 'exact_matches': None, 'log': None}
+                marker = "✓" if results[index]['status'].startswith('完成') else "✗"
+                print(f"  {marker} {results[index]['name']} ({results[index]['seconds']:.1f}秒)")
+    elapsed = time.perf_counter() - start
+
+    print_batch_summary(results, elapsed)
+    return results
+
+
+def print_batch_summary(results, elapsed):
+    """印出批次處理的結果表"""
+    name_width = max(10, max(len(result['name']) for result in results))
+    print(f"\n📊 批次處理結果:")
+    print(f"  {'檔案':<{name_width - 2}}  {'句數':>4}  {'精確匹配':>4}  {'耗時':>6}  狀態")
+    for result in results:
+        lines = result['lines'] if result['lines'] is not None else '-'
+        if result['exact_matches'] is not None and result['lines']:
+            match_rate = f"{result['exact_matches'] / result['lines']:.0%}"
+        else:
+            match_rate = '-'
+        print(f"  {result['name']:<{name_width}}  {lines:>6}  {match_rate:>8}  {result['seconds']:>7.1f}s  {result['status']}")
+
+    succeeded = sum(1 for result in results if result['status'].startswith('完成'))
+    total_seconds = sum(result['seconds'] for result in results)
+    print(f"\n✅ 完成 {succeeded}/{len(results)} 首, 總耗時 {elapsed:.1f}秒 "
+          f"(各首合計 {total_seconds:.1f}秒, 平行加速 {total_seconds / max(elapsed, 1e-6):.1f}x)")
+
+
 def main():
+    parser = argparse.ArgumentParser(description="SRT 歌詞優化與翻譯工具 (不加參數時開啟檔案選擇視窗)")
+    parser.add_argument("--batch", default=None, help="批次處理：SRT 所在資料夾，或 JSON 工作列表")
+    parser.add_argument("--mode", choices=["llm", "basic"], default="llm", help="llm = 本地模型斷句與翻譯, basic = 基礎優化")
+    parser.add_argument("--workers", type=int, default=2, help="同時處理的歌曲數")
+    parser.add_argument("--max-inflight", type=int, default=LLM_MAX_CONCURRENCY, help="所有歌曲共用的 LLM 併發上限")
+    parser.add_argument("--api-url", default=OLLAMA_API_URL, help="本地模型 API 端點")
+    parser.add_argument("--batch-size", type=int, default=TRANSLATE_BATCH_SIZE, help="每個翻譯請求的句數")
+    parser.add_argument("--no-cache", action="store_true", help="不使用 LLM 回應快取")
+    parser.add_argument("--output-dir", default=None, help="輸出資料夾 (預設與 SRT 相同)")
+    parser.add_argument("--no-onset-snap", action="store_true", help="不把歌詞時間對齊到音樂的起音點")
+    args = parser.parse_args()
+
+    if not args.batch:
+        main_interactive()
+        return
+
+    run_batch(args.batch, mode=args.mode, workers=args.workers, max_inflight=args.max_inflight,
+              api_url=args.api_url, batch_size=args.batch_size,
+              cache_path=None if args.no_cache else LLM_CACHE_PATH, output_dir=args.output_dir,
+              onset_snap=ONSET_SNAP and not args.no_onset_snap)
+
+
+def main_interactive():
     print("=" * 60)
     print("SRT 歌詞優化與翻譯工具")
     print("=" * 60)
@@ -555,7 +973,7 @@ def main():
     print(f"✅ 已選擇參考歌詞: {os.path.basename(reference_file)}")
     
     # 使用本地 GPT 模型優化
-    api_url = "http://localhost:11434/v1"
+    api_url = OLLAMA_API_URL
     print(f"\n🤖 使用本地 GPT 模型 (Ollama): {api_url}")
     print(f"🎵 音樂檔案: {os.path.basename(audio_file)}")
     
@@ -564,7 +982,8 @@ def main():
     output_file = f"{base_name}_優化.srt"
     
     # 執行優化和翻譯
-    optimize_lyrics_local_gpt(input_file, output_file, api_url, reference_file)
+    optimize_lyrics_local_gpt(input_file, output_file, api_url, reference_file,
+                              audio_file=audio_file if ONSET_SNAP else None)
     
     root.destroy()
 
@@ -0,0 +1,313 @@
+"""
+多行程平行渲染
+把整首歌切成數個連續的片段，交給多個工作行程同時產生畫面並各自編碼，最後不重新編碼直接串接並加上音軌。
+主行程只做一次音訊分析、字體載入與背景合成，再先畫每句歌詞的一幀建好排版快取與卡拉 OK 精靈圖，
+這些唯讀資源放進共享區 (asset_store)，工作行程直接映射使用：
+不會各自重新解碼音訊、重算頻譜、重建背景或精靈圖，也不會收到 pickle 複本，
+多一個工作行程增加的記憶體只有 Python 本身與字體物件。
+影片背景 (BG_VIDEO_PATH) 目前由各工作行程自行解碼。
+用法: python parallel_render.py --audio 歌.mp3 --srt 歌.srt [--output 歌.mp4] [--workers N]
+"""
+
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pysrt
+from PIL import Image
+
+import asset_store
+import font_fallback
+import keyframe_index
+import make_music_videos as mmv
+from background_source import StaticBackground
+from ffmpeg_tools import get_ffmpeg_exe
+from karaoke import KaraokeRenderer, LineSprite
+from memory_budget import get_rss_mb
+
+MB = 1024 * 1024
+
+# ================= 設定區 =================
+RENDER_WORKERS = max(1, min(4, os.cpu_count() or 1))  # 工作行程數
+SEGMENTS_PER_WORKER = 2      # 每個工作行程分到的片段數 (片段越多，快慢不均時越容易平衡)
+# =========================================
+
+# 暖機畫面取在歌詞滑動動畫結束之後 (之後的畫面都沿用同一位置的精靈圖)
+WARM_UP_OFFSET = mmv.ANIM_DURATION + 0.05
+# 傳給工作行程的模組狀態 (大寫設定值與載入結果中的簡單型別，以及頻譜參數)
+PLAIN_TYPES = (bool, int, float, str, tuple, list, type(None))
+EXTRA_STATE = ('sr', 'n_fft', 'hop_length')
+
+# 工作行程映射的共享陣列 (保留參照，避免映射被關閉)
+_ATTACHED = None
+
+
+def module_state():
+    state = {name: value for name, value in vars(mmv).items() if name.isupper() and isinstance(value, PLAIN_TYPES)}
+    state.update({name: getattr(mmv, name) for name in EXTRA_STATE})
+    return state
+
+
+def plan_segments(total_frames, segment_count):
+    """把 [0, total_frames) 切成 segment_count 段連續的 (起始幀, 結束幀)"""
+    segment_count = max(1, min(segment_count, total_frames))
+    bounds = np.linspace(0, total_frames, segment_count + 1).round().astype(int)
+    return [(int(first), int(last)) for first, last in zip(bounds[:-1], bounds[1:]) if last > first]
+
+
+def warm_up_caches():
+    """
+    在主行程先畫出每句歌詞成為當前歌詞 (動畫結束後) 的一幀，
+    排版快取與卡拉 OK 精靈圖因此建好。回傳過程中產生的所有精靈圖 {key: sprite}。
+    """
+    sprites = {}
+    mmv.reset_render_state()
+    for sub in mmv.subs:
+        start, end = sub.start.ordinal / 1000.0, sub.end.ordinal / 1000.0
+        t = min(start + WARM_UP_OFFSET, (start + end) / 2) if end > start else start
+        mmv.make_frame(min(t, max(mmv.DURATION - 1e-3, 0.0)))
+        # 精靈圖快取有數量上限，每幀結束就收集起來
+        sprites.update(mmv.KARAOKE.sprites)
+    mmv.reset_render_state()
+    return sprites
+
+
+def publish_sprites(store, sprites):
+    """把精靈圖的黑底/白底畫面打包成一個陣列，字體以主要字體的字級位置表示"""
+    slots = {id(font): slot for slot, font in enumerate(mmv.FONT_CHAIN.fonts[0])}
+    entries, arrays = [], []
+    for key, sprite in sprites.items():
+        text, font_id, spacing, base_passes, high_passes, frac_x, frac_y = key
+        if font_id not in slots:
+            continue
+        layers = [sprite.base[0], sprite.base[1], sprite.high[0], sprite.high[1]]
+        entries.append({'key': (text, slots[font_id], spacing, base_passes, high_passes, frac_x, frac_y),
+                        'center': sprite.center, 'lefts': sprite.lefts.tolist(), 'rights': sprite.rights.tolist(),
+                        'layers': list(range(len(arrays), len(arrays) + 4))})
+        arrays.extend(layers)
+
+    packed, layout = asset_store.pack_arrays(arrays)
+    store.publish('sprite_pixels', packed)
+    store.meta['sprites'] = entries
+    store.meta['sprite_layout'] = layout
+
+
+def publish_common(store):
+    """與歌曲無關的共用資源：模組設定、字體備援鏈 (各字體已載入的子集路徑) 與已合成遮罩的靜態背景"""
+    if isinstance(mmv.BACKGROUND, StaticBackground):
+        store.publish('background', np.asarray(mmv.BACKGROUND.composed))
+    store.meta.update({
+        'state': module_state(),
+        'chain_paths': mmv.FONT_CHAIN.paths,
+        'font_paths': mmv.FONT_CHAIN.loaded_paths,
+    })
+
+
+def publish_assets(store):
+    """把工作行程需要的唯讀資源放進共享區"""
+    publish_common(store)
+
+    # 柱子特徵 (主行程之後也改用共享的那一份)
+    if mmv.BAR_HEIGHTS is not None:
+        mmv.BAR_HEIGHTS = store.publish('bar_heights', mmv.BAR_HEIGHTS)
+    else:
+        mmv.DB = store.publish('db', mmv.DB)
+
+    # 排版表與卡拉 OK 精靈圖
+    sprites = warm_up_caches()
+    entries, widths, indexes = mmv.FONT_CHAIN.export_layouts()
+    store.publish('layout_widths', widths)
+    store.publish('layout_fonts', indexes)
+    store.meta['layouts'] = entries
+    publish_sprites(store, sprites)
+    store.meta['srt_file'] = mmv.SRT_FILE
+    return len(entries), len(sprites)
+
+
+def attach_common(manifest):
+    """
+    工作行程端的共用初始化：套用模組設定、載入字體備援鏈 (與主行程相同的子集檔)、
+    建立背景來源與卡拉 OK 快取。回傳 (共享陣列, meta)。
+    """
+    global _ATTACHED
+
+    arrays, meta = asset_store.attach(manifest)
+    _ATTACHED = arrays
+
+    for name, value in meta['state'].items():
+        setattr(mmv, name, value)
+
+    chain = font_fallback.build_font_chain(meta['chain_paths'], mmv.FONT_CACHE_DIR)
+    for index, path in enumerate(meta['font_paths']):
+        if path:
+            chain.fonts[index] = mmv.try_load_fonts(path)
+            chain.loaded_paths[index] = path
+    mmv.FONT_CHAIN = chain
+    (mmv.CHINESE_FONT, mmv.CHINESE_FONT_CURRENT, mmv.ENGLISH_FONT, mmv.ENGLISH_FONT_CURRENT,
+     mmv.TITLE_FONT, mmv.SINGER_FONT) = chain.fonts[0]
+
+    if 'background' in arrays:
+        composed = Image.frombuffer("RGBA", tuple(mmv.VIDEO_SIZE), arrays['background'], "raw", "RGBA", 0, 1)
+        mmv.BACKGROUND = StaticBackground.from_composed(composed)
+    else:
+        mmv.BG_IMAGE = mmv.load_background(mmv.BG_IMAGE_PATH)
+        mmv.BACKGROUND = mmv.create_background_source(mmv.BG_VIDEO_PATH)
+
+    mmv.KARAOKE = KaraokeRenderer(mmv.draw_text_with_spacing, layout=mmv.text_layout)
+    return arrays, meta
+
+
+def raw_video_input():
+    """從標準輸入讀取原始 RGB 畫面的 ffmpeg 輸入參數"""
+    w, h = mmv.VIDEO_SIZE
+    return ["-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{w}x{h}", "-r", str(mmv.FPS), "-i", "pipe:0"]
+
+
+def init_worker(manifest):
+    """工作行程初始化：映射共享資源並設定 make_music_videos 的全域狀態"""
+    # 字體載入等訊息主行程已經印過
+    with contextlib.redirect_stdout(io.StringIO()):
+        arrays, meta = attach_common(manifest)
+        mmv.BAR_HEIGHTS = arrays.get('bar_heights')
+        mmv.DB = arrays.get('db')
+        mmv.subs = pysrt.open(meta['srt_file'])
+        mmv.FONT_CHAIN.seed_layouts(meta['layouts'], arrays['layout_widths'], arrays['layout_fonts'])
+
+        chain = mmv.FONT_CHAIN
+        pixels = arrays['sprite_pixels']
+        layout = meta['sprite_layout']
+        for entry in meta['sprites']:
+            text, slot, spacing, base_passes, high_passes, frac_x, frac_y = entry['key']
+            font = chain.fonts[0][slot]
+            black, white, high_black, high_white = (asset_store.unpack_array(pixels, layout[i]) for i in entry['layers'])
+            sprite = LineSprite.from_arrays(text, tuple(entry['center']), (black, white), (high_black, high_white),
+                                            entry['lefts'], entry['rights'])
+            mmv.KARAOKE.seed((text, id(font), spacing, base_passes, high_passes, frac_x, frac_y), sprite)
+        mmv.reset_render_state()
+
+
+def render_segment(first, last, segment_path, encoder_args, keyframe_times):
+    """在工作行程中產生 [first, last) 幀並編碼成只有影像的片段，回傳統計"""
+    # 片段內的歌詞關鍵幀 (相對於片段開頭；片段開頭本來就是關鍵幀)
+    offset = first / mmv.FPS
+    local_times = [t - offset for t in keyframe_times if offset < t < last / mmv.FPS]
+    cmd = [
+        get_ffmpeg_exe(), "-y", "-loglevel", "error", *raw_video_input(),
+        *encoder_args, *keyframe_index.force_keyframe_params(local_times), "-pix_fmt", "yuv420p", "-an",
+        segment_path
+    ]
+
+    frame_func = mmv.make_frame_skipping if mmv.FRAME_SKIP else mmv.make_frame
+    mmv.reset_render_state()
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+    try:
+        for index in range(first, last):
+            proc.stdin.write(np.ascontiguousarray(frame_func(index / mmv.FPS), dtype=np.uint8).tobytes())
+    finally:
+        proc.stdin.close()
+        proc.wait()
+    if proc.returncode != 0:
+        raise RuntimeError(f"片段 {os.path.basename(segment_path)} 編碼失敗 (ffmpeg return code {proc.returncode})")
+
+    # 只回報目前的 RSS：Linux 的峰值 RSS 會沿用 spawn 時父行程的數值
+    return {'pid': os.getpid(), 'frames': last - first, 'seconds': time.perf_counter() - start, 'rss_mb': get_rss_mb()}
+
+
+def concat_segments(segment_paths, audio_file, output_file, list_path):
+    """以 concat demuxer 直接串接片段 (不重新編碼影像) 並加上 AAC 音軌"""
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for path in segment_paths:
+            escaped = path.replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    cmd = [
+        get_ffmpeg_exe(), "-y", "-loglevel", "error",
+        "-f", "concat", "-safe", "0", "-i", list_path, "-i", audio_file,
+        "-map", "0:v", "-map", "1:a", "-c:v", "copy", "-c:a", "aac", "-shortest",
+        output_file
+    ]
+    subprocess.run(cmd, check=True)
+
+
+def render_parallel(audio_file, srt_file, output_file, workers=RENDER_WORKERS, font_path=None,
+                    bg_image_path=mmv.BG_IMAGE_PATH, bg_video_path=mmv.BG_VIDEO_PATH):
+    """平行渲染整首歌，成功回傳統計字典，資源載入失敗回傳 None"""
+    start = time.perf_counter()
+    if not mmv.load_assets(audio_file, srt_file, font_path=font_path, bg_image_path=bg_image_path,
+                           bg_video_path=bg_video_path):
+        return None
+
+    settings = mmv.load_encoder_settings()
+    encoder_args = mmv.encoder_output_args(settings)
+    if mmv.LOW_MEMORY:
+        encoder_args += ["-rc-lookahead", str(mmv.LOW_MEMORY_LOOKAHEAD)]
+    keyframe_times = keyframe_index.lyric_keyframe_times(mmv.subs) if mmv.LYRIC_KEYFRAMES else []
+    segments = plan_segments(int(mmv.DURATION * mmv.FPS), workers * SEGMENTS_PER_WORKER)
+
+    with asset_store.AssetStore() as store, tempfile.TemporaryDirectory() as tmp_dir:
+        layout_count, sprite_count = publish_assets(store)
+        print(f"📦 共享資源: {store.nbytes() / MB:.1f} MB ({store.directory})，"
+              f"排版 {layout_count} 筆、精靈圖 {sprite_count} 張")
+        print(f"2. 平行渲染: {workers} 個行程, {len(segments)} 個片段, 編碼設定: {mmv.describe_encoder(settings)}")
+
+        segment_paths = [os.path.join(tmp_dir, f"segment_{i:03d}.mp4") for i in range(len(segments))]
+        render_start = time.perf_counter()
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker,
+                                 initargs=(store.manifest,)) as executor:
+            futures = [executor.submit(render_segment, first, last, path, encoder_args, keyframe_times)
+                       for (first, last), path in zip(segments, segment_paths)]
+            results = []
+            for i, future in enumerate(futures):
+                results.append(future.result())
+                print(f"   片段 {i + 1}/{len(segments)} 完成 ({results[-1]['frames']} 幀, "
+                      f"{results[-1]['frames'] / results[-1]['seconds']:.1f} fps)")
+        render_seconds = time.perf_counter() - render_start
+
+        concat_segments(segment_paths, audio_file, output_file, os.path.join(tmp_dir, "segments.txt"))
+    print(f"完成！影片已存為 {output_file}")
+
+    if mmv.LYRIC_KEYFRAMES and mmv.subs:
+        try:
+            index_path, index = keyframe_index.write_keyframe_index(output_file, mmv.subs)
+            print(f"✓ 關鍵幀索引: {os.path.basename(index_path)} ({len(index['keyframes'])} 個關鍵幀)")
+        except Exception as e:
+            print(f"⚠ 關鍵幀索引建立失敗: {e}")
+
+    # 每個工作行程的記憶體 (同一行程可能處理多個片段，取最後一次)
+    worker_memory = {}
+    for result in results:
+        worker_memory[result['pid']] = result
+    total_frames = sum(result['frames'] for result in results)
+    print(f"\n📊 平行渲染: {total_frames} 幀, {render_seconds:.1f}秒 ({total_frames / render_seconds:.1f} fps)")
+    for pid, result in worker_memory.items():
+        rss = f"{result['rss_mb']:.0f} MB" if result['rss_mb'] is not None else "N/A"
+        print(f"   行程 {pid}: RSS {rss} (含共享資源映射)")
+    return {'segments': results, 'render_seconds': render_seconds, 'seconds': time.perf_counter() - start,
+            'store_mb': store.nbytes() / MB}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多行程平行渲染歌詞影片 (共享唯讀資源)")
+    parser.add_argument("--audio", required=True, help="音樂檔案")
+    parser.add_argument("--srt", required=True, help="SRT 歌詞")
+    parser.add_argument("--output", default=None, help="輸出影片 (預設為音樂檔名 .mp4)")
+    parser.add_argument("--workers", type=int, default=RENDER_WORKERS, help="工作行程數")
+    parser.add_argument("--font", default=None, help="字體路徑 (預設使用 make_music_videos 的搜尋邏輯)")
+    args = parser.parse_args()
+
+    output_file = args.output or f"{os.path.splitext(args.audio)[0]}.mp4"
+    if render_parallel(args.audio, args.srt, output_file, workers=max(1, args.workers), font_path=args.font) is None:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+"""
+歌單合輯渲染
+把依序排列的多首歌 (音樂 + SRT) 做成一支連續的合輯影片：
+- 每首歌是獨立的片段，由多個工作行程同時渲染 (影像 + 統一格式的 AAC 音軌)
+- 字體備援鏈以整張歌單的用字只建立一次 (同一份子集)，靜態背景只合成一次並放進共享區 (asset_store)，
+  每個工作行程載入一次字體後，排版快取與卡拉 OK 精靈圖在它處理的所有歌曲之間沿用
+- 歌曲之間只在交界加上標題卡 (card) 或交叉淡化 (fade)，這些短片段另外編碼，歌曲片段本身不會重新編碼
+- 最後以 concat demuxer 直接串接，寫入 MP4 章節，並輸出 YouTube 格式的章節清單 <影片>.chapters.txt
+用法:
+  python playlist_render.py --song 1.mp3 1.srt --song 2.mp3 2.srt --output 合輯.mp4
+  python playlist_render.py --playlist 歌單.json --output 合輯.mp4
+  歌單.json: [{"audio": "1.mp3", "srt": "1.srt", "title": "歌名 (可省略)"}, ...]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pysrt
+from PIL import ImageDraw
+
+import asset_store
+import keyframe_index
+import make_music_videos as mmv
+import parallel_render
+from ffmpeg_tools import get_ffmpeg_exe
+
+# ================= 設定區 =================
+TRANSITION = "card"          # 歌曲交界："card" 標題卡、"fade" 交叉淡化、"none" 直接相接
+TITLE_CARD_SECONDS = 3.0     # 標題卡長度 (秒)
+FADE_SECONDS = 1.0           # 交叉淡化長度 (秒)
+# 所有片段使用相同的音訊格式，才能不重新編碼直接串接
+AUDIO_ARGS = ["-c:a", "aac", "-b:a", "192k", "-ar", "48000", "-ac", "2"]
+# =========================================
+
+# 工作行程內沿用的字體備援鏈與它涵蓋的文字
+_FONT_TEXT = ""
+
+
+def load_playlist(path):
+    """讀取歌單 JSON，回傳 [{'audio', 'srt', 'title'}, ...]"""
+    with open(path, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(path))
+    songs = []
+    for entry in entries:
+        songs.append({
+            'audio': os.path.join(base_dir, entry['audio']),
+            'srt': os.path.join(base_dir, entry['srt']),
+            'title': entry.get('title'),
+        })
+    return songs
+
+
+def song_title(song):
+    return song.get('title') or os.path.splitext(os.path.basename(song['audio']))[0]
+
+
+def card_label(number, total):
+    return f"{number} / {total}"
+
+
+def playlist_text(songs):
+    """整張歌單需要的所有文字 (標題、歌詞與標題卡編號)"""
+    text = ''
+    for number, song in enumerate(songs, 1):
+        text += mmv.font_text(pysrt.open(song['srt']), song_title(song)) + card_label(number, len(songs))
+    return text
+
+
+def silent_audio_input():
+    return ["-f", "lavfi", "-i", "anullsrc=channel_layout=stereo:sample_rate=48000"]
+
+
+def encode_frames(frames, frame_count, segment_path, encoder_args, audio_input=None, keyframe_times=()):
+    """
+    把 frames (可迭代的 RGB 畫面) 編碼成片段；audio_input 為音訊輸入參數，None 表示靜音。
+    音訊長度以畫面為準。
+    """
+    audio_input = audio_input or silent_audio_input()
+    cmd = [
+        get_ffmpeg_exe(), "-y", "-loglevel", "error", *parallel_render.raw_video_input(), *audio_input,
+        "-map", "0:v", "-map", "1:a", *encoder_args, *keyframe_index.force_keyframe_params(list(keyframe_times)),
+        "-pix_fmt", "yuv420p", *AUDIO_ARGS, "-t", f"{frame_count / mmv.FPS:.6f}", segment_path
+    ]
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+    try:
+        for frame in frames:
+            proc.stdin.write(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+    finally:
+        proc.stdin.close()
+        proc.wait()
+    if proc.returncode != 0:
+        raise RuntimeError(f"片段 {os.path.basename(segment_path)} 編碼失敗 (ffmpeg return code {proc.returncode})")
+
+
+def init_worker(manifest, font_text):
+    """工作行程初始化：共用設定、字體與背景只載入一次，之後處理的每首歌都沿用"""
+    global _FONT_TEXT
+    with contextlib.redirect_stdout(io.StringIO()):
+        parallel_render.attach_common(manifest)
+    _FONT_TEXT = font_text
+
+
+def render_song(song, segment_path, encoder_args):
+    """在工作行程中渲染一整首歌 (含音軌)，回傳統計與頭尾畫面 (交叉淡化用)"""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()) as log:
+        ok = mmv.begin_assets(song['audio'], song_title(song), mmv.FONT_PATH)
+        if ok:
+            mmv.load_audio(song['audio'])
+            # 字體備援鏈已涵蓋整張歌單的用字，直接沿用 (排版快取也一起沿用)
+            ok = mmv.load_lyrics(song['srt'], mmv.FONT_CHAIN, _FONT_TEXT)
+    if not ok:
+        raise RuntimeError(f"{song_title(song)} 資源載入失敗:\n{log.getvalue()}")
+
+    mmv.reset_render_state()
+    frame_count = int(mmv.DURATION * mmv.FPS)
+    frame_func = mmv.make_frame_skipping if mmv.FRAME_SKIP else mmv.make_frame
+    edges = {}
+
+    def frames():
+        for index in range(frame_count):
+            frame = frame_func(index / mmv.FPS)
+            if index == 0 or index == frame_count - 1:
+                edges[index] = np.array(frame)
+            yield frame
+
+    keyframe_times = keyframe_index.lyric_keyframe_times(mmv.subs) if mmv.LYRIC_KEYFRAMES else []
+    encode_frames(frames(), frame_count, segment_path, encoder_args, ["-i", song['audio']], keyframe_times)
+    return {'title': song_title(song), 'frames': frame_count, 'seconds': time.perf_counter() - start,
+            'first_frame': edges.get(0), 'last_frame': edges.get(frame_count - 1)}
+
+
+def render_title_card(title, number, total):
+    """標題卡畫面：背景 + 歌名 + 編號"""
+    w, h = mmv.VIDEO_SIZE
+    img = mmv.BACKGROUND.get_frame(0)
+    draw = ImageDraw.Draw(img)
+    mmv.draw_text_with_spacing(draw, (w / 2, h / 2 - mmv.CURRENT_FONT_SIZE * 0.6), title, font=mmv.TITLE_FONT,
+                               fill=mmv.CURRENT_LYRICS_COLOR, stroke_width=3, stroke_fill=mmv.TEXT_STROKE_COLOR,
+                               spacing=8)
+    mmv.draw_text_with_spacing(draw, (w / 2, h / 2 + mmv.CURRENT_FONT_SIZE * 0.9), card_label(number, total),
+                               font=mmv.ENGLISH_FONT_CURRENT, fill=mmv.KARAOKE_COLOR, stroke_width=1,
+                               stroke_fill=mmv.TEXT_STROKE_COLOR, spacing=4)
+    return np.array(img.convert("RGB"))
+
+
+def fade_frames(previous, following, frame_count):
+    """從上一首的最後一幀淡化到下一首的第一幀"""
+    previous = previous.astype(np.float32)
+    following = following.astype(np.float32)
+    for index in range(frame_count):
+        alpha = (index + 1) / (frame_count + 1)
+        yield np.rint(previous * (1 - alpha) + following * alpha).astype(np.uint8)
+
+
+def format_chapter_time(seconds):
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}" if hours else f"{minutes:02d}:{secs:02d}"
+
+
+def write_chapters(chapters, total_seconds, metadata_path, text_path):
+    """寫入 ffmpeg 章節中繼資料 (ffmetadata) 與 YouTube 格式的章節清單"""
+    def escape(value):
+        for char in '\\=;#\n':
+            value = value.replace(char, '\\' + char)
+        return value
+
+    with open(metadata_path, 'w', encoding='utf-8') as f:
+        f.write(";FFMETADATA1\n")
+        for i, (start, title) in enumerate(chapters):
+            end = chapters[i + 1][0] if i + 1 < len(chapters) else total_seconds
+            f.write(f"[CHAPTER]\nTIMEBASE=1/1000\nSTART={int(start * 1000)}\nEND={int(end * 1000)}\n"
+                    f"title={escape(title)}\n")
+
+    with open(text_path, 'w', encoding='utf-8') as f:
+        for start, title in chapters:
+            f.write(f"{format_chapter_time(start)} {title}\n")
+
+
+def concat_with_chapters(segment_paths, metadata_path, output_file, list_path):
+    """串接所有片段 (影像與音訊都不重新編碼) 並寫入章節"""
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for path in segment_paths:
+            escaped = path.replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    cmd = [
+        get_ffmpeg_exe(), "-y", "-loglevel", "error",
+        "-f", "concat", "-safe", "0", "-i", list_path, "-f", "ffmetadata", "-i", metadata_path,
+        "-map", "0", "-map_metadata", "1", "-map_chapters", "1", "-c", "copy", "-movflags", "+faststart",
+        output_file
+    ]
+    subprocess.run(cmd, check=True)
+
+
+def render_playlist(songs, output_file, workers=parallel_render.RENDER_WORKERS, transition=TRANSITION,
+                    font_path=None, bg_image_path=mmv.BG_IMAGE_PATH, bg_video_path=mmv.BG_VIDEO_PATH):
+    """渲染整張歌單，成功回傳 {'chapters', 'seconds'}，資源載入失敗回傳 None"""
+    start = time.perf_counter()
+    if not songs:
+        print("✗ 歌單是空的")
+        return None
+    missing = [path for song in songs for path in (song['audio'], song['srt']) if not os.path.exists(path)]
+    if missing:
+        print(f"✗ 找不到檔案: {', '.join(missing)}")
+        return None
+
+    # 共用資源只準備一次：字體 (整張歌單的用字)、背景、編碼設定
+    print(f"🎵 歌單: {len(songs)} 首，交界: {transition}")
+    mmv.FONT_PATH = font_path if font_path else mmv.find_font_file()
+    font_text = playlist_text(songs)
+    fonts = mmv.load_fonts(font_text)
+    if fonts is None:
+        print(f"✗ 致命錯誤: 無法載入字體 {mmv.FONT_PATH}。")
+        return None
+    mmv.FONT_CHAIN = fonts
+    (mmv.CHINESE_FONT, mmv.CHINESE_FONT_CURRENT, mmv.ENGLISH_FONT, mmv.ENGLISH_FONT_CURRENT,
+     mmv.TITLE_FONT, mmv.SINGER_FONT) = fonts.fonts[0]
+    mmv.load_background_assets(bg_image_path, bg_video_path)
+
+    settings = mmv.load_encoder_settings()
+    encoder_args = mmv.encoder_output_args(settings)
+    print(f"   編碼設定: {mmv.describe_encoder(settings)}, {workers} 個行程")
+
+    with asset_store.AssetStore() as store, tempfile.TemporaryDirectory() as tmp_dir:
+        parallel_render.publish_common(store)
+        song_paths = [os.path.join(tmp_dir, f"song_{i:03d}.mp4") for i in range(len(songs))]
+
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker,
+                                 initargs=(store.manifest, font_text)) as executor:
+            futures = [executor.submit(render_song, song, path, encoder_args) for song, path in zip(songs, song_paths)]
+
+            # 歌曲在工作行程渲染時，主行程編碼標題卡
+            card_paths = {}
+            if transition == "card":
+                card_frames = int(TITLE_CARD_SECONDS * mmv.FPS)
+                for i, song in enumerate(songs):
+                    card = render_title_card(song_title(song), i + 1, len(songs))
+                    card_paths[i] = os.path.join(tmp_dir, f"card_{i:03d}.mp4")
+                    encode_frames((card for _ in range(card_frames)), card_frames, card_paths[i], encoder_args)
+
+            results = []
+            for i, future in enumerate(futures):
+                results.append(future.result())
+                result = results[-1]
+                print(f"   ✓ {i + 1}/{len(songs)} {result['title']}: {result['frames']} 幀, {result['seconds']:.1f}秒")
+
+        # 交叉淡化需要前後兩首的頭尾畫面，歌曲渲染完才能產生
+        fade_paths = {}
+        if transition == "fade":
+            fade_count = int(FADE_SECONDS * mmv.FPS)
+            for i in range(1, len(songs)):
+                fade_paths[i] = os.path.join(tmp_dir, f"fade_{i:03d}.mp4")
+                encode_frames(fade_frames(results[i - 1]['last_frame'], results[i]['first_frame'], fade_count),
+                              fade_count, fade_paths[i], encoder_args)
+
+        # 依序排列片段並以實際長度計算章節 (章節從該首歌的標題卡或淡化開始)
+        segment_paths, chapters = [], []
+        position = 0.0
+        for i, song in enumerate(songs):
+            boundary = card_paths.get(i) or fade_paths.get(i)
+            chapters.append((position, song_title(song)))
+            for path in ([boundary] if boundary else []) + [song_paths[i]]:
+                segment_paths.append(path)
+                position += keyframe_index.read_movie_duration(path)
+
+        base = os.path.splitext(output_file)[0]
+        chapters_path = f"{base}.chapters.txt"
+        metadata_path = os.path.join(tmp_dir, "chapters.ffmeta")
+        write_chapters(chapters, position, metadata_path, chapters_path)
+        concat_with_chapters(segment_paths, metadata_path, output_file, os.path.join(tmp_dir, "segments.txt"))
+
+    print(f"完成！合輯已存為 {output_file} ({format_chapter_time(position)})")
+    print(f"✓ 章節清單: {os.path.basename(chapters_path)}")
+    for chapter_start, title in chapters:
+        print(f"   {format_chapter_time(chapter_start)} {title}")
+    print(f"⏱ 總共 {time.perf_counter() - start:.1f}秒")
+    return {'chapters': chapters, 'seconds': time.perf_counter() - start, 'duration': position}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把多首歌渲染成一支有章節的合輯影片")
+    parser.add_argument("--song", nargs=2, action="append", metavar=("AUDIO", "SRT"), default=[],
+                        help="依序加入一首歌 (可重複)")
+    parser.add_argument("--playlist", default=None, help="歌單 JSON ([{\"audio\", \"srt\", \"title\"}, ...])")
+    parser.add_argument("--output", required=True, help="輸出影片")
+    parser.add_argument("--workers", type=int, default=parallel_render.RENDER_WORKERS, help="工作行程數")
+    parser.add_argument("--transition", choices=["card", "fade", "none"], default=TRANSITION, help="歌曲交界的處理")
+    parser.add_argument("--font", default=None, help="字體路徑 (預設使用 make_music_videos 的搜尋邏輯)")
+    args = parser.parse_args()
+
+    songs = load_playlist(args.playlist) if args.playlist else []
+    songs += [{'audio': audio, 'srt': srt, 'title': None} for audio, srt in args.song]
+    result = render_playlist(songs, args.output, workers=max(1, args.workers), transition=args.transition,
+                             font_path=args.font)
+    if result is None:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
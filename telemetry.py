@@ -0,0 +1,233 @@
+"""
+渲染遙測輸出
+渲染時由背景執行緒每隔 interval 秒寫出一次目前狀態，供排程器與容量規劃使用：
+已渲染幀數、瞬間與平均 fps、預估剩餘時間、各階段耗時、佇列深度、RSS，
+結束時再寫出最終狀態與輸出檔的實際位元率。每筆資料都帶有工作 ID 與輸入檔的 SHA-256。
+兩種格式：
+- jsonl：每次附加一行 JSON 到檔案 (保留完整歷程)
+- prom：Prometheus textfile (node_exporter textfile collector)，每次以暫存檔 + 改名整檔替換
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+
+from file_hash import file_sha256
+from memory_budget import get_peak_rss_mb, get_rss_mb
+
+# 預設寫出間隔 (秒)
+TELEMETRY_INTERVAL = 5.0
+# Prometheus 指標名稱前綴
+METRIC_PREFIX = "music_video"
+
+
+def telemetry_format(path):
+    """依副檔名決定格式：.prom 為 Prometheus textfile，其他為 JSON lines"""
+    return "prom" if path.endswith(".prom") else "jsonl"
+
+
+def input_hashes(inputs):
+    """{名稱: 路徑} → {名稱: SHA-256}，路徑不存在時略過"""
+    return {name: file_sha256(path) for name, path in inputs.items() if path and os.path.exists(path)}
+
+
+def default_job_id(audio_file, hashes):
+    """沒有指定工作 ID 時，以音檔名稱加上音檔雜湊前 8 碼識別"""
+    base = os.path.splitext(os.path.basename(audio_file))[0]
+    audio_hash = hashes.get('audio')
+    return f"{base}-{audio_hash[:8]}" if audio_hash else base
+
+
+class RenderTelemetry:
+    """
+    收集單一渲染工作的進度並定期寫出。
+    - frame(seconds, skipped)：每產生一幀呼叫一次，seconds 為產生畫面花的時間
+    - add_gauge(name, func)：註冊佇列深度等即時數值，寫出時呼叫 func() 取值
+    - stages_func()：回傳 [{'stage', 'seconds'}, ...] (例如 MemoryTracker.stages)
+    兩幀之間 (畫面已交出，等待下一次呼叫) 的時間算作編碼與寫入時間，
+    比例偏高代表編碼器跟不上 (反壓)。
+    """
+
+    def __init__(self, path, job_id, inputs, total_frames, fps, stages_func=None, interval=TELEMETRY_INTERVAL,
+                 fmt=None):
+        self.path = path
+        self.fmt = fmt or telemetry_format(path)
+        self.interval = interval
+        self.total_frames = total_frames
+        self.fps = fps
+        self.stages_func = stages_func
+        self.gauges = {}
+
+        self.hashes = input_hashes(inputs)
+        self.job_id = job_id or default_job_id(inputs.get('audio', 'job'), self.hashes)
+        self.host = socket.gethostname()
+        self.pid = os.getpid()
+
+        self.frames = 0
+        self.skipped_frames = 0
+        self.frame_seconds = 0.0
+        self.status = "running"
+        self.output = {}
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._last_sample = (self._start, 0)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_gauge(self, name, func):
+        self.gauges[name] = func
+
+    def frame(self, seconds, skipped=False):
+        self.frames += 1
+        self.frame_seconds += seconds
+        if skipped:
+            self.skipped_frames += 1
+
+    def start(self):
+        if self.fmt == "jsonl" and os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def finish(self, status, output_file=None, duration=None):
+        """停止定期寫出，記錄最終狀態與輸出檔位元率，寫出最後一筆"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.status = status
+        if output_file and os.path.exists(output_file):
+            size = os.path.getsize(output_file)
+            self.output = {'path': output_file, 'bytes': size}
+            if duration:
+                self.output['bitrate_kbps'] = round(size * 8 / duration / 1000, 1)
+        return self.write()
+
+    def snapshot(self):
+        """目前狀態 (dict)"""
+        now = time.perf_counter()
+        elapsed = now - self._start
+        frames = self.frames
+        last_time, last_frames = self._last_sample
+        self._last_sample = (now, frames)
+
+        running = self.status == "running"
+        instant_fps = (frames - last_frames) / (now - last_time) if running and now > last_time else None
+        average_fps = frames / elapsed if elapsed > 0 else 0.0
+        remaining = max(self.total_frames - frames, 0)
+        eta = remaining / average_fps if average_fps > 0 and running else None
+
+        stages = {stage['stage']: round(stage['seconds'], 3) for stage in self.stages_func()} if self.stages_func else {}
+        gauges = {}
+        for name, func in self.gauges.items():
+            try:
+                gauges[name] = func()
+            except Exception:
+                gauges[name] = None
+
+        return {
+            'time': time.time(),
+            'job': self.job_id,
+            'host': self.host,
+            'pid': self.pid,
+            'inputs': self.hashes,
+            'status': self.status,
+            'started': self.started,
+            'elapsed_seconds': round(elapsed, 3),
+            'frames': frames,
+            'skipped_frames': self.skipped_frames,
+            'total_frames': self.total_frames,
+            # MoviePy 開始前會先取一次第 0 幀，幀數可能比總幀數多 1
+            'progress': round(min(frames / self.total_frames, 1.0), 4) if self.total_frames else None,
+            'instant_fps': round(instant_fps, 2) if instant_fps is not None else None,
+            'average_fps': round(average_fps, 2),
+            'realtime_factor': round(average_fps / self.fps, 3) if self.fps else None,
+            'eta_seconds': round(eta, 1) if eta is not None else None,
+            'frame_seconds': round(self.frame_seconds, 3),
+            'encode_seconds': round(max(elapsed - self.frame_seconds, 0.0), 3),
+            'stages': stages,
+            'queues': gauges,
+            'rss_mb': get_rss_mb(),
+            'peak_rss_mb': get_peak_rss_mb(),
+            'output': self.output,
+        }
+
+    def write(self):
+        """寫出一筆目前狀態，回傳該筆資料；寫入失敗只警告一次，不中斷渲染"""
+        with self._lock:
+            record = self.snapshot()
+            try:
+                if self.fmt == "prom":
+                    write_textfile(self.path, prometheus_lines(record))
+                else:
+                    with open(self.path, 'a', encoding='utf-8') as f:
+                        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            except OSError as e:
+                if not getattr(self, '_write_error_logged', False):
+                    print(f"⚠ 遙測寫入失敗: {e}")
+                    self._write_error_logged = True
+            return record
+
+
+def write_textfile(path, lines):
+    """暫存檔 + 改名，讓收集器不會讀到寫到一半的檔案"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, path)
+
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{name}="{_label_value(value)}"' for name, value in labels.items()) + "}"
+
+
+def prometheus_lines(record):
+    """把一筆狀態轉成 Prometheus 文字格式"""
+    job = {'job_id': record['job'], 'host': record['host']}
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        samples = [(labels, value) for labels, value in samples if value is not None]
+        if not samples:
+            return
+        full_name = f"{METRIC_PREFIX}_{name}"
+        lines.append(f"# HELP {full_name} {help_text}")
+        lines.append(f"# TYPE {full_name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{full_name}{_labels(**job, **labels)} {value}")
+
+    info = {f"{name}_sha256": digest for name, digest in record['inputs'].items()}
+    metric("job_info", "gauge", "渲染工作識別與輸入檔雜湊",
+           [(dict(info, status=record['status'], pid=record['pid']), 1)])
+    metric("job_start_time_seconds", "gauge", "渲染開始的 Unix 時間", [({}, record['started'])])
+    metric("frames_rendered_total", "counter", "已產生的幀數", [({}, record['frames'])])
+    metric("frames_skipped_total", "counter", "沿用上一幀畫面的幀數", [({}, record['skipped_frames'])])
+    metric("frames_expected", "gauge", "輸出影片的總幀數", [({}, record['total_frames'])])
+    metric("fps", "gauge", "渲染速度 (每秒幀數)",
+           [({'window': 'instant'}, record['instant_fps']), ({'window': 'average'}, record['average_fps'])])
+    metric("eta_seconds", "gauge", "預估剩餘秒數", [({}, record['eta_seconds'])])
+    metric("elapsed_seconds", "gauge", "渲染已進行的秒數", [({}, record['elapsed_seconds'])])
+    metric("busy_seconds", "counter", "渲染時間拆成產生畫面與編碼寫入兩部分",
+           [({'part': 'frame'}, record['frame_seconds']), ({'part': 'encode'}, record['encode_seconds'])])
+    metric("stage_seconds", "gauge", "已完成的各階段耗時",
+           [({'stage': stage}, seconds) for stage, seconds in record['stages'].items()])
+    metric("queue_depth", "gauge", "內部畫面佇列目前的深度",
+           [({'queue': name}, depth) for name, depth in record['queues'].items()])
+    metric("rss_bytes", "gauge", "渲染行程的 RSS",
+           [({'kind': 'current'}, None if record['rss_mb'] is None else int(record['rss_mb'] * 1024 * 1024)),
+            ({'kind': 'peak'}, None if record['peak_rss_mb'] is None else int(record['peak_rss_mb'] * 1024 * 1024))])
+    metric("output_bytes", "gauge", "輸出檔大小", [({}, record['output'].get('bytes'))])
+    metric("output_bitrate_kbps", "gauge", "輸出檔的平均位元率",
+           [({}, record['output'].get('bitrate_kbps'))])
+    return lines
@@ -0,0 +1,70 @@
+"""
+翻譯進度日誌 (write-ahead journal)
+每翻譯完一句就把 (中文, 英文) 以 JSON Lines 附加到輸出檔旁的日誌並 fsync；
+中斷或模型當機後重新執行時，已完成的句子直接從日誌讀取，只翻譯尚未完成的句子。
+日誌以中文原句為鍵，因此重新斷句後順序或句數改變也能沿用。
+"""
+
+import json
+import os
+import threading
+
+
+class TranslationJournal:
+    """輸出檔旁的翻譯日誌：<輸出檔>.journal.jsonl"""
+
+    def __init__(self, output_file, model):
+        self.path = f"{output_file}.journal.jsonl"
+        self.model = model
+        self.done = {}    # 中文原句 -> 英文翻譯
+        self._lock = threading.Lock()
+
+        if os.path.exists(self.path):
+            self._load()
+        self.resumed = len(self.done)
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def _load(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        # 寫到一半就中斷的最後一行直接捨棄
+        complete = data[:data.rfind(b'\n') + 1]
+        if len(complete) != len(data):
+            with open(self.path, 'r+b') as f:
+                f.truncate(len(complete))
+
+        for line in complete.decode('utf-8').splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            # 換了翻譯模型就不沿用舊的翻譯
+            if entry.get('model') == self.model and entry.get('zh') and entry.get('en'):
+                self.done[entry['zh']] = entry['en']
+
+    def get(self, chinese_text):
+        with self._lock:
+            return self.done.get(chinese_text)
+
+    def __contains__(self, chinese_text):
+        with self._lock:
+            return chinese_text in self.done
+
+    def record(self, chinese_text, english_text):
+        """寫入一句完成的翻譯 (寫入並 fsync 後才算完成)"""
+        with self._lock:
+            if self._file.closed or self.done.get(chinese_text) == english_text:
+                return
+            self.done[chinese_text] = english_text
+            self._file.write(json.dumps({'model': self.model, 'zh': chinese_text, 'en': english_text},
+                                        ensure_ascii=False) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self, remove=False):
+        """關閉日誌；remove=True 時刪除日誌檔 (所有句子都已翻譯並輸出)"""
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+        if remove and os.path.exists(self.path):
+            os.remove(self.path)